@@ -0,0 +1,1207 @@
+"""
+Record level reading and writing of version 2.0 rosbag files.
+
+The rosbag library only exposes bags one message at a time. The export engine needs to work on
+whole chunks instead (copying compressed chunks straight across, or dropping records out of a
+chunk without deserializing them), so this module reads the index records of a bag and writes
+new bags from chunks and serialized message records.
+"""
+
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+import bz2
+import collections
+import mmap
+import os
+import profiling
+import struct
+
+# lz4 chunks can be handled by either the ROS lz4 bindings or the lz4 package from PyPI,
+# both of which use the LZ4 frame format
+try:
+    import roslz4 as lz4Module
+    foundLz4 = True
+except ImportError:
+    try:
+        import lz4.frame as lz4Module
+        foundLz4 = True
+    except ImportError:
+        foundLz4 = False
+
+
+# First line of every bag file this module understands
+VERSION_LINE = b"#ROSBAG V2.0\n"
+
+# Suffix the ROS recorder adds to a bag until it is closed, which a bag left behind by a
+# recorder that crashed keeps (and which has no index, see rebuildIndex)
+ACTIVE_BAG_SUFFIX = ".active"
+
+# The file header record is padded to this many bytes so it can be rewritten in place on close
+FILE_HEADER_LENGTH = 4096
+
+# Same default chunk size as the rosbag library
+DEFAULT_CHUNK_THRESHOLD = 768 * 1024
+
+# Upper bounds on the size of each kind of record, not counting their data, used to estimate
+# how big a bag being written will be
+MESSAGE_RECORD_OVERHEAD = 64
+CONNECTION_RECORD_OVERHEAD = 64
+CHUNK_RECORD_OVERHEAD = 64
+INDEX_RECORD_OVERHEAD = 96
+CHUNK_INFO_RECORD_OVERHEAD = 128
+
+
+class Op:
+    """
+    Record types (the "op" header field) defined by the rosbag 2.0 format
+    """
+    MESSAGE_DATA = 0x02
+    FILE_HEADER = 0x03
+    INDEX_DATA = 0x04
+    CHUNK = 0x05
+    CHUNK_INFO = 0x06
+    CONNECTION = 0x07
+
+
+class Compression:
+    """
+    Chunk compression formats, named the same way as in the chunk records
+    """
+    NONE = "none"
+    BZ2 = "bz2"
+    LZ4 = "lz4"
+
+
+class BagFormatError(Exception):
+    """
+    Raised when a bag file can't be read by this module
+    """
+
+
+class UnsupportedBagVersionError(BagFormatError):
+    """
+    Raised when a bag file is not a version 2.0 bag
+    """
+
+
+class UnindexedBagError(BagFormatError):
+    """
+    Raised when a bag file has no index (e.g. the recorder crashed before closing it)
+    """
+
+
+def packTime(timeNs: int) -> bytes:
+    """
+    Packs a time in nanoseconds into the secs/nsecs pair used by the bag format
+    """
+    return struct.pack("<II", timeNs // 1000000000, timeNs % 1000000000)
+
+
+def unpackTime(buffer, offset=0) -> int:
+    """
+    Unpacks a secs/nsecs pair into a time in nanoseconds
+    """
+    secs, nsecs = struct.unpack_from("<II", buffer, offset)
+    return secs * 1000000000 + nsecs
+
+
+def encodeHeader(fields: Dict[str, bytes]) -> bytes:
+    """
+    Encodes a record header from a dictionary of field name -> packed value
+    """
+    encoded = bytearray()
+    for name, value in fields.items():
+        encoded += struct.pack("<I", len(name) + 1 + len(value))
+        encoded += name.encode()
+        encoded += b"="
+        encoded += value
+    return bytes(encoded)
+
+
+def decodeHeader(buffer) -> Dict[str, bytes]:
+    """
+    Decodes a record header into a dictionary of field name -> packed value
+    """
+    buffer = bytes(buffer)
+    fields = {}
+    offset = 0
+    while offset < len(buffer):
+        fieldLength, = struct.unpack_from("<I", buffer, offset)
+        offset += 4
+        nameValue = buffer[offset:offset + fieldLength]
+        offset += fieldLength
+
+        separator = nameValue.find(b"=")
+        if separator < 0:
+            raise BagFormatError("Record header field is missing '='")
+        fields[nameValue[:separator].decode()] = nameValue[separator + 1:]
+    return fields
+
+
+def encodeRecord(headerFields: Dict[str, bytes], data) -> bytes:
+    """
+    Encodes a full record (header length, header, data length, data)
+    """
+    header = encodeHeader(headerFields)
+    return struct.pack("<I", len(header)) + header + struct.pack("<I", len(data)) + bytes(data)
+
+
+def readRecord(file) -> Tuple[Dict[str, bytes], bytes]:
+    """
+    Reads the record at the current position of the file, returning its header and data
+    """
+    header = _readExactly(file, _readLength(file))
+    data = _readExactly(file, _readLength(file))
+    return decodeHeader(header), data
+
+
+def iterRecords(buffer) -> Iterator[Tuple[Dict[str, bytes], int, int, int]]:
+    """
+    Iterates through the records in an in-memory buffer (e.g. an uncompressed chunk), yielding
+    the record header, the record's offset, and the start and end offset of its data
+    """
+    offset = 0
+    bufferLength = len(buffer)
+    while offset < bufferLength:
+        headerLength, = struct.unpack_from("<I", buffer, offset)
+        headerStart = offset + 4
+        dataLength, = struct.unpack_from("<I", buffer, headerStart + headerLength)
+        dataStart = headerStart + headerLength + 4
+        dataEnd = dataStart + dataLength
+        if dataEnd > bufferLength:
+            raise BagFormatError("Record extends past the end of its chunk")
+
+        yield decodeHeader(buffer[headerStart:headerStart + headerLength]), offset, dataStart, dataEnd
+        offset = dataEnd
+
+
+def recordDataAt(buffer, offset) -> Tuple[int, int]:
+    """
+    Returns the start and end offset of the data of the record at the given offset of an
+    in-memory buffer, without decoding its header
+    """
+    headerLength, = struct.unpack_from("<I", buffer, offset)
+    dataLength, = struct.unpack_from("<I", buffer, offset + 4 + headerLength)
+    dataStart = offset + 4 + headerLength + 4
+    if dataStart + dataLength > len(buffer):
+        raise BagFormatError("Record extends past the end of its chunk")
+    return dataStart, dataStart + dataLength
+
+
+def compressChunk(data, compression: str) -> bytes:
+    """
+    Compresses the contents of a chunk with the given compression format
+    """
+    with profiling.stage("compress"):
+        profiling.count("bytes_compressed", len(data))
+
+        if compression == Compression.NONE:
+            return data
+        if compression == Compression.BZ2:
+            return bz2.compress(data)
+        if compression == Compression.LZ4:
+            if not foundLz4:
+                raise BagFormatError("lz4 compression requires the roslz4 or lz4 module")
+            return lz4Module.compress(bytes(data))
+        raise BagFormatError(f"Unknown chunk compression '{compression}'")
+
+
+def decompressChunk(data, compression: str, uncompressedSize: int) -> bytes:
+    """
+    Decompresses the contents of a chunk stored with the given compression format
+    """
+    with profiling.stage("decompress"):
+        profiling.count("bytes_decompressed", uncompressedSize)
+
+        if compression == Compression.NONE:
+            decompressed = data
+        elif compression == Compression.BZ2:
+            decompressed = bz2.decompress(data)
+        elif compression == Compression.LZ4:
+            if not foundLz4:
+                raise BagFormatError("lz4 compressed chunks require the roslz4 or lz4 module")
+            decompressed = lz4Module.decompress(bytes(data))
+        else:
+            raise BagFormatError(f"Unknown chunk compression '{compression}'")
+
+    if len(decompressed) != uncompressedSize:
+        raise BagFormatError("Chunk decompressed to the wrong size")
+    return decompressed
+
+
+@dataclass
+class ConnectionInfo:
+    """
+    A connection (topic + message type) stored in a bag
+    """
+    id: int
+    topic: str
+    # Connection header fields, e.g. type, md5sum, message_definition, callerid, latching
+    header: Dict[str, bytes]
+
+    @property
+    def datatype(self) -> str:
+        return self.header["type"].decode()
+
+    @property
+    def md5sum(self) -> str:
+        return self.header["md5sum"].decode()
+
+    @property
+    def messageDefinition(self) -> str:
+        return self.header.get("message_definition", b"").decode()
+
+
+@dataclass
+class ChunkInfo:
+    """
+    Index information about a single chunk, combined from its chunk info record and chunk header
+    """
+    # Position of the chunk record in the file
+    position: int
+    startTime: int
+    endTime: int
+    # Connection id -> number of messages on that connection in this chunk
+    connectionCounts: Dict[int, int]
+    compression: str = Compression.NONE
+    compressedSize: int = 0
+    uncompressedSize: int = 0
+    # Position of the (compressed) chunk data in the file
+    dataPosition: int = 0
+
+    @property
+    def endPosition(self) -> int:
+        """
+        Position right after the chunk record, where the chunk's index data records start
+        """
+        return self.dataPosition + self.compressedSize
+
+    @property
+    def messageCount(self) -> int:
+        return sum(self.connectionCounts.values())
+
+
+@dataclass
+class BagIndex:
+    """
+    Everything read from the index of a bag: its connections and where its chunks are
+    """
+    # Connection id -> connection
+    connections: Dict[int, ConnectionInfo]
+    # Chunks in the order they are stored in the file
+    chunks: List[ChunkInfo]
+
+    def toDict(self) -> dict:
+        """
+        Converts the index into plain types that can be stored as JSON. Header values are
+        arbitrary bytes, so they are stored as latin-1 strings which map back to the same bytes.
+        """
+        return {
+            "connections": [
+                {"id": connection.id, "topic": connection.topic, "header": {name: value.decode("latin-1") for name, value in connection.header.items()}}
+                for connection in self.connections.values()
+            ],
+            "chunks": [
+                [chunk.position, chunk.startTime, chunk.endTime, [[connectionId, count] for connectionId, count in chunk.connectionCounts.items()],
+                 chunk.compression, chunk.compressedSize, chunk.uncompressedSize, chunk.dataPosition]
+                for chunk in self.chunks
+            ],
+        }
+
+    @classmethod
+    def fromDict(cls, indexDict: dict) -> "BagIndex":
+        """
+        Creates an index from the output of toDict
+        """
+        connections = {}
+        for connectionDict in indexDict["connections"]:
+            header = {name: value.encode("latin-1") for name, value in connectionDict["header"].items()}
+            connections[connectionDict["id"]] = ConnectionInfo(connectionDict["id"], connectionDict["topic"], header)
+
+        chunks = []
+        for position, startTime, endTime, connectionCounts, compression, compressedSize, uncompressedSize, dataPosition in indexDict["chunks"]:
+            chunks.append(ChunkInfo(position, startTime, endTime, dict(connectionCounts), compression, compressedSize, uncompressedSize, dataPosition))
+
+        return cls(connections, chunks)
+
+
+class BagReader:
+    """
+    Reads the index of a version 2.0 bag file, and gives access to its chunks. If the index is
+    already known (e.g. from a cache), it can be passed in so it isn't read from the file again.
+
+    With memoryMap, the file is memory mapped and chunks, chunk records and index records are
+    handed out as memoryviews into the mapping instead of being read into new bytes objects, so
+    uncompressed chunks and the messages in them reach the writer without being copied. Pages
+    of the file before the chunk being read are released as the reader moves through the file,
+    so memory use doesn't grow with the size of the bag. This is meant for bags on local disks
+    (a mapped file that becomes unreadable, e.g. over the network, crashes the process instead
+    of raising), and falls back to ordinary reads if the file can't be mapped.
+    """
+
+    def __init__(self, filename, index: BagIndex = None, memoryMap=False):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        self._map: Optional[mmap.mmap] = None
+        # Everything in the mapping before this position has been handed back to the OS
+        self._releasedPosition = 0
+
+        try:
+            if self._file.readline() != VERSION_LINE:
+                raise UnsupportedBagVersionError(f"{filename} is not a version 2.0 rosbag")
+
+            if memoryMap:
+                self._map = _mapFile(self._file)
+
+            if index is None:
+                with profiling.stage("index_read"):
+                    index = self._readIndex()
+
+            self.index = index
+            self.connections: Dict[int, ConnectionInfo] = index.connections
+            self.chunks: List[ChunkInfo] = index.chunks
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Some of the memoryviews handed out are still in use, so the mapping is closed
+                # once they have all been garbage collected instead
+                pass
+            self._map = None
+        self._file.close()
+
+    @property
+    def isMemoryMapped(self) -> bool:
+        return self._map is not None
+
+    @property
+    def startTime(self) -> int:
+        return min([chunk.startTime for chunk in self.chunks], default=0)
+
+    @property
+    def endTime(self) -> int:
+        return max([chunk.endTime for chunk in self.chunks], default=0)
+
+    def _readIndex(self) -> BagIndex:
+        """
+        Reads the file header, connection records, chunk info records and chunk headers
+        """
+        header, _ = readRecord(self._file)
+        if _unpackUint8(header["op"]) != Op.FILE_HEADER:
+            raise BagFormatError(f"{self.filename} does not start with a file header record")
+
+        indexPosition, = struct.unpack("<Q", header["index_pos"])
+        connectionCount, = struct.unpack("<I", header["conn_count"])
+        chunkCount, = struct.unpack("<I", header["chunk_count"])
+
+        if indexPosition == 0:
+            raise UnindexedBagError(f"{self.filename} is not indexed")
+
+        self._file.seek(indexPosition)
+
+        connections = {}
+        chunks = []
+
+        for _ in range(connectionCount):
+            header, data = readRecord(self._file)
+            connection = _connectionFromRecord(header, data)
+            connections[connection.id] = connection
+
+        for _ in range(chunkCount):
+            header, data = readRecord(self._file)
+            if _unpackUint8(header["op"]) != Op.CHUNK_INFO:
+                raise BagFormatError(f"{self.filename} has a corrupt chunk info record")
+
+            connectionCounts = {}
+            for index in range(struct.unpack("<I", header["count"])[0]):
+                connectionId, count = struct.unpack_from("<II", data, index * 8)
+                connectionCounts[connectionId] = count
+
+            chunks.append(ChunkInfo(
+                position=struct.unpack("<Q", header["chunk_pos"])[0],
+                startTime=unpackTime(header["start_time"]),
+                endTime=unpackTime(header["end_time"]),
+                connectionCounts=connectionCounts,
+            ))
+
+        # Reading the chunk headers tells us where each chunk's data is and how it is compressed
+        for chunk in chunks:
+            self._file.seek(chunk.position)
+            header = decodeHeader(_readExactly(self._file, _readLength(self._file)))
+            chunk.compression = header["compression"].decode()
+            chunk.uncompressedSize, = struct.unpack("<I", header["size"])
+            chunk.compressedSize = _readLength(self._file)
+            chunk.dataPosition = self._file.tell()
+
+        return BagIndex(connections, chunks)
+
+    def readChunkRecord(self, chunk: ChunkInfo) -> bytes:
+        """
+        Returns the chunk record exactly as it is stored in the file, still compressed
+        """
+        with profiling.stage("chunk_read"):
+            profiling.count("bytes_read", chunk.endPosition - chunk.position)
+            self._releasePagesBefore(chunk.position)
+            return self._read(chunk.position, chunk.endPosition - chunk.position)
+
+    def readIndexRecords(self, chunk: ChunkInfo) -> bytes:
+        """
+        Returns the index data records that follow the chunk, exactly as they are stored in the file
+        """
+        with profiling.stage("index_read"):
+            if self._map is not None:
+                # The records are next to each other in the file, so they can be handed out as one view
+                position = chunk.endPosition
+                for _ in range(len(chunk.connectionCounts)):
+                    headerLength, = struct.unpack_from("<I", self._map, position)
+                    dataLength, = struct.unpack_from("<I", self._map, position + 4 + headerLength)
+                    position += 4 + headerLength + 4 + dataLength
+
+                profiling.count("index_bytes_read", position - chunk.endPosition)
+                return self._read(chunk.endPosition, position - chunk.endPosition)
+
+            self._file.seek(chunk.endPosition)
+            records = bytearray()
+            for _ in range(len(chunk.connectionCounts)):
+                headerLength = _readLength(self._file)
+                header = _readExactly(self._file, headerLength)
+                dataLength = _readLength(self._file)
+                records += struct.pack("<I", headerLength) + header + struct.pack("<I", dataLength)
+                records += _readExactly(self._file, dataLength)
+
+            profiling.count("index_bytes_read", len(records))
+            return bytes(records)
+
+    def readMessageIndex(self, chunk: ChunkInfo) -> List[Tuple[int, int, int]]:
+        """
+        Returns (offset into the uncompressed chunk, connection id, time) of every message in the
+        chunk, in the order they are stored, using only the index records that follow the chunk
+        """
+        entries = []
+        indexRecords = self.readIndexRecords(chunk)
+        for header, _, dataStart, dataEnd in iterRecords(indexRecords):
+            connectionId, = struct.unpack("<I", header["conn"])
+            for entryOffset in range(dataStart, dataEnd, 12):
+                secs, nsecs, offset = struct.unpack_from("<III", indexRecords, entryOffset)
+                entries.append((offset, connectionId, secs * 1000000000 + nsecs))
+
+        entries.sort()
+        return entries
+
+    def readChunkData(self, chunk: ChunkInfo) -> bytes:
+        """
+        Returns the uncompressed contents of the chunk
+        """
+        with profiling.stage("chunk_read"):
+            profiling.count("bytes_read", chunk.compressedSize)
+            self._releasePagesBefore(chunk.position)
+            data = self._read(chunk.dataPosition, chunk.compressedSize)
+        return decompressChunk(data, chunk.compression, chunk.uncompressedSize)
+
+    def _read(self, position, size):
+        """
+        Returns size bytes of the file starting at position, as a view into the mapping when the
+        file is memory mapped
+        """
+        if self._map is None:
+            self._file.seek(position)
+            return _readExactly(self._file, size)
+
+        if position + size > len(self._map):
+            raise BagFormatError("Unexpected end of file")
+        return memoryview(self._map)[position:position + size]
+
+    def _releasePagesBefore(self, position):
+        """
+        Tells the OS the mapped pages before position (the start of the chunk being read) aren't
+        needed anymore, so they stop counting towards the memory use of the process. Views into
+        them stay valid, and are read from the file again if they are used.
+        """
+        if self._map is None or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+
+        position -= position % mmap.PAGESIZE
+        if position > self._releasedPosition:
+            self._map.madvise(mmap.MADV_DONTNEED, self._releasedPosition, position - self._releasedPosition)
+            self._releasedPosition = position
+
+
+class BagWriter:
+    """
+    Writes a version 2.0 bag file from serialized messages and/or existing chunks.
+    Connection ids are chosen by the caller, so chunks copied from another bag keep working.
+
+    Given a compressionPool (a concurrent.futures executor), chunks are compressed on it while
+    the next chunks are being built. The compressed chunks are still written by the caller's
+    thread, in the order they were built, with at most maxPendingChunks waiting at once.
+
+    Given resumePosition and resumeConnectionIds (from sync() of an earlier writer of the same
+    file that never got to close it), the file is cut back to that position and written from
+    there on, with the chunks already in the file read back from their chunk and index data records.
+    """
+
+    def __init__(self, filename, compression=Compression.NONE, chunkThreshold=DEFAULT_CHUNK_THRESHOLD, compressionPool: Executor = None, maxPendingChunks=4,
+                 resumePosition: Optional[int] = None, resumeConnectionIds: Iterable[int] = ()):
+        self.filename = filename
+        self.compression = compression
+        self.chunkThreshold = chunkThreshold
+        self.compressionPool = compressionPool
+        self.maxPendingChunks = maxPendingChunks
+
+        # Chunks being compressed, oldest first, as (future compressed data, uncompressed size, index data records, chunk)
+        self._pendingChunks: Deque[Tuple[Future, int, bytes, ChunkInfo]] = collections.deque()
+
+        # Connection id -> connection
+        self.connections: Dict[int, ConnectionInfo] = {}
+        self.chunks: List[ChunkInfo] = []
+
+        # Size of the connection records that close() writes into the index
+        self._connectionRecordBytes = 0
+
+        # Connections whose connection record has already been written into a chunk
+        self._connectionsInChunks = set()
+
+        # State of the chunk currently being built
+        self._chunkBuffer = bytearray()
+        self._chunkIndexes: Dict[int, List[Tuple[int, int]]] = {}
+        self._chunkStartTime = None
+        self._chunkEndTime = None
+
+        if resumePosition is not None:
+            self._file = open(filename, "r+b")
+            try:
+                if self._file.readline() != VERSION_LINE:
+                    raise UnsupportedBagVersionError(f"{filename} is not a version 2.0 rosbag")
+                self._fileHeaderPosition = self._file.tell()
+                self.chunks = readChunkInfos(self._file, self._fileHeaderPosition + FILE_HEADER_LENGTH, resumePosition)
+                self._file.truncate(resumePosition)
+                self._file.seek(resumePosition)
+                self._connectionsInChunks.update(resumeConnectionIds)
+            except Exception:
+                self._file.close()
+                raise
+            return
+
+        self._file = open(filename, "wb")
+        self._file.write(VERSION_LINE)
+        self._fileHeaderPosition = self._file.tell()
+        self._writeFileHeader(0, 0, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def addConnection(self, connection: ConnectionInfo):
+        """
+        Registers a connection that messages/chunks written to this bag may use
+        """
+        if connection.id not in self.connections:
+            self._connectionRecordBytes += CONNECTION_RECORD_OVERHEAD + len(connection.topic) + len(encodeHeader(connection.header))
+        self.connections[connection.id] = connection
+
+    @property
+    def sizeEstimate(self) -> int:
+        """
+        Roughly how big the bag would be if it were closed now, erring on the large side (the
+        current chunk is counted uncompressed)
+        """
+        pendingIndexBytes = sum([INDEX_RECORD_OVERHEAD + 12 * len(entries) for entries in self._chunkIndexes.values()])
+        chunkInfoBytes = sum([CHUNK_INFO_RECORD_OVERHEAD + 8 * len(chunk.connectionCounts) for chunk in self.chunks])
+        chunkInfoBytes += CHUNK_INFO_RECORD_OVERHEAD + 8 * len(self._chunkIndexes)
+
+        for _, uncompressedSize, indexRecords, chunk in self._pendingChunks:
+            pendingIndexBytes += CHUNK_RECORD_OVERHEAD + uncompressedSize + len(indexRecords)
+            chunkInfoBytes += CHUNK_INFO_RECORD_OVERHEAD + 8 * len(chunk.connectionCounts)
+
+        return self._file.tell() + CHUNK_RECORD_OVERHEAD + len(self._chunkBuffer) + pendingIndexBytes + self._connectionRecordBytes + chunkInfoBytes
+
+    @property
+    def isEmpty(self) -> bool:
+        """
+        Whether no messages or chunks have been written yet
+        """
+        return len(self.chunks) == 0 and len(self._pendingChunks) == 0 and len(self._chunkIndexes) == 0
+
+    def writeMessage(self, connectionId: int, timeNs: int, data):
+        """
+        Adds a serialized message to the current chunk, writing the chunk out once it is full
+        """
+        if connectionId not in self._connectionsInChunks:
+            # Like the rosbag library, store each connection record in the chunk where it is first
+            # used, so the bag can still be reindexed if writing never finishes
+            self._chunkBuffer += self._connectionRecord(connectionId)
+            self._connectionsInChunks.add(connectionId)
+
+        offset = len(self._chunkBuffer)
+        header = encodeHeader({"op": _packUint8(Op.MESSAGE_DATA), "conn": struct.pack("<I", connectionId), "time": packTime(timeNs)})
+        self._chunkBuffer += struct.pack("<I", len(header))
+        self._chunkBuffer += header
+        self._chunkBuffer += struct.pack("<I", len(data))
+        self._chunkBuffer += data
+
+        self._chunkIndexes.setdefault(connectionId, []).append((timeNs, offset))
+        if self._chunkStartTime is None or timeNs < self._chunkStartTime:
+            self._chunkStartTime = timeNs
+        if self._chunkEndTime is None or timeNs > self._chunkEndTime:
+            self._chunkEndTime = timeNs
+
+        if len(self._chunkBuffer) >= self.chunkThreshold:
+            self.flushChunk()
+
+    def copyChunk(self, chunkRecord: bytes, indexRecords: bytes, chunk: ChunkInfo):
+        """
+        Writes a chunk record and its index data records exactly as they were read from another bag.
+        A chunk using connections whose connection records aren't in this bag's chunks yet is
+        rewritten with them instead (see copyChunkData).
+        """
+        if not self._connectionsInChunks.issuperset(chunk.connectionCounts):
+            dataStart = chunk.dataPosition - chunk.position
+            chunkData = decompressChunk(chunkRecord[dataStart:dataStart + chunk.compressedSize], chunk.compression, chunk.uncompressedSize)
+            self.copyChunkData(chunkData, indexRecords, chunk)
+            return
+
+        self.flushChunk()
+        self._writePendingChunks()
+
+        with profiling.stage("write"):
+            profiling.count("bytes_written", len(chunkRecord) + len(indexRecords))
+            position = self._file.tell()
+            self._file.write(chunkRecord)
+            self._file.write(indexRecords)
+
+        self.chunks.append(ChunkInfo(position, chunk.startTime, chunk.endTime, dict(chunk.connectionCounts), chunk.compression))
+
+    def copyChunkData(self, chunkData, indexRecords: bytes, chunk: ChunkInfo):
+        """
+        Writes the uncompressed contents of a chunk read from another bag as a chunk compressed
+        with this bag's compression. The chunk's index data records stay valid since they point
+        into the uncompressed contents, so they are copied as they are.
+
+        The chunk's connection records may be in an earlier chunk of the other bag (or in an
+        earlier bag of a split), which this bag doesn't have. So the connection records this bag's
+        chunks are still missing go in front of the contents, keeping the bag reindexable on its own.
+        """
+        missingConnectionIds = sorted(chunk.connectionCounts.keys() - self._connectionsInChunks)
+        if len(missingConnectionIds) > 0:
+            connectionRecords = b"".join([self._connectionRecord(connectionId) for connectionId in missingConnectionIds])
+            chunkData = connectionRecords + bytes(chunkData)
+            indexRecords = _shiftIndexRecords(indexRecords, len(connectionRecords))
+            self._connectionsInChunks.update(missingConnectionIds)
+
+        self.flushChunk()
+        self._queueChunk(chunkData, indexRecords, ChunkInfo(0, chunk.startTime, chunk.endTime, dict(chunk.connectionCounts), self.compression))
+
+    def flushChunk(self):
+        """
+        Compresses and writes the chunk currently being built, followed by its index data records
+        (with a compression pool, the chunk is only queued to be compressed and written)
+        """
+        if len(self._chunkIndexes) == 0:
+            return
+
+        indexRecords = b""
+        for connectionId, entries in self._chunkIndexes.items():
+            indexData = b"".join([packTime(timeNs) + struct.pack("<I", offset) for timeNs, offset in entries])
+            indexRecords += encodeRecord(
+                {"op": _packUint8(Op.INDEX_DATA), "ver": struct.pack("<I", 1), "conn": struct.pack("<I", connectionId), "count": struct.pack("<I", len(entries))},
+                indexData,
+            )
+
+        connectionCounts = {connectionId: len(entries) for connectionId, entries in self._chunkIndexes.items()}
+        # The buffer is replaced below, so it can be handed over without copying it
+        self._queueChunk(self._chunkBuffer, indexRecords, ChunkInfo(0, self._chunkStartTime, self._chunkEndTime, connectionCounts, self.compression))
+
+        self._chunkBuffer = bytearray()
+        self._chunkIndexes = {}
+        self._chunkStartTime = None
+        self._chunkEndTime = None
+
+    def sync(self) -> Tuple[int, List[int]]:
+        """
+        Writes out everything added so far (ending the current chunk early) and makes sure it is on
+        disk, returning the position a new writer can resume writing the file from, and the ids of
+        the connections whose connection records are already in its chunks (the resumePosition and
+        resumeConnectionIds of that writer)
+        """
+        self.flushChunk()
+        self._writePendingChunks()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell(), sorted(self._connectionsInChunks)
+
+    def _connectionRecord(self, connectionId) -> bytes:
+        connection = self.connections[connectionId]
+        return encodeRecord(
+            {"op": _packUint8(Op.CONNECTION), "conn": struct.pack("<I", connection.id), "topic": connection.topic.encode()},
+            encodeHeader(connection.header),
+        )
+
+    def _queueChunk(self, chunkData: bytes, indexRecords: bytes, chunk: ChunkInfo):
+        """
+        Compresses and writes a chunk, on the compression pool if there is one
+        """
+        if self.compressionPool is None:
+            self._writeChunk(compressChunk(chunkData, chunk.compression), len(chunkData), indexRecords, chunk)
+            return
+
+        self._pendingChunks.append((self.compressionPool.submit(compressChunk, chunkData, chunk.compression), len(chunkData), indexRecords, chunk))
+
+        # Write out whatever is done, and wait when too many chunks are queued so memory use stays bounded
+        while len(self._pendingChunks) > 0 and (len(self._pendingChunks) > self.maxPendingChunks or self._pendingChunks[0][0].done()):
+            self._writePendingChunk()
+
+    def _writePendingChunk(self):
+        future, uncompressedSize, indexRecords, chunk = self._pendingChunks.popleft()
+        self._writeChunk(future.result(), uncompressedSize, indexRecords, chunk)
+
+    def _writePendingChunks(self):
+        while len(self._pendingChunks) > 0:
+            self._writePendingChunk()
+
+    def _writeChunk(self, compressed: bytes, uncompressedSize, indexRecords: bytes, chunk: ChunkInfo):
+        """
+        Writes a compressed chunk record followed by its index data records
+        """
+        with profiling.stage("write"):
+            profiling.count("bytes_written", len(compressed) + len(indexRecords))
+            chunk.position = self._file.tell()
+            # The header goes first on its own, so the chunk's data (which may be a view into an
+            # input bag) isn't copied into a new record first
+            header = encodeHeader({"op": _packUint8(Op.CHUNK), "compression": chunk.compression.encode(), "size": struct.pack("<I", uncompressedSize)})
+            self._file.write(struct.pack("<I", len(header)) + header + struct.pack("<I", len(compressed)))
+            self._file.write(compressed)
+            self._file.write(indexRecords)
+        self.chunks.append(chunk)
+
+    def close(self):
+        """
+        Writes the last chunk and the index, then points the file header at the index
+        """
+        if self._file.closed:
+            return
+
+        self.flushChunk()
+        self._writePendingChunks()
+
+        with profiling.stage("write"):
+            indexPosition = self._file.tell()
+
+            for connection in sorted(self.connections.values(), key=lambda connection: connection.id):
+                self._file.write(encodeRecord(
+                    {"op": _packUint8(Op.CONNECTION), "conn": struct.pack("<I", connection.id), "topic": connection.topic.encode()},
+                    encodeHeader(connection.header),
+                ))
+
+            for chunk in self.chunks:
+                chunkInfoData = b"".join([struct.pack("<II", connectionId, count) for connectionId, count in chunk.connectionCounts.items()])
+                self._file.write(encodeRecord(
+                    {
+                        "op": _packUint8(Op.CHUNK_INFO),
+                        "ver": struct.pack("<I", 1),
+                        "chunk_pos": struct.pack("<Q", chunk.position),
+                        "start_time": packTime(chunk.startTime),
+                        "end_time": packTime(chunk.endTime),
+                        "count": struct.pack("<I", len(chunk.connectionCounts)),
+                    },
+                    chunkInfoData,
+                ))
+
+        self._file.seek(self._fileHeaderPosition)
+        self._writeFileHeader(indexPosition, len(self.connections), len(self.chunks))
+        self._file.close()
+
+    def _writeFileHeader(self, indexPosition, connectionCount, chunkCount):
+        """
+        Writes the file header record, padded so that it always takes up FILE_HEADER_LENGTH bytes
+        """
+        header = encodeHeader({
+            "op": _packUint8(Op.FILE_HEADER),
+            "index_pos": struct.pack("<Q", indexPosition),
+            "conn_count": struct.pack("<I", connectionCount),
+            "chunk_count": struct.pack("<I", chunkCount),
+        })
+        padding = b" " * (FILE_HEADER_LENGTH - 4 - len(header) - 4)
+        self._file.write(struct.pack("<I", len(header)) + header + struct.pack("<I", len(padding)) + padding)
+
+
+class SplitBagWriter:
+    """
+    Writes what would otherwise be one bag as a series of bags, rolling over to a new bag
+    whenever the current one would grow past maxBytes or span maxDurationNs or more. Each bag is
+    complete on its own, with its own index and the connection records of the connections it uses.
+    Without maxBytes or maxDurationNs, this writes a single bag just like BagWriter.
+
+    filenameOf gives the filename of each bag from its index (0, 1, 2, ...). The first bag is only
+    created once something is written to it (or on close, so there is always at least one).
+
+    With more than one compression thread, chunks are compressed on a thread pool owned by this
+    writer (compressing releases the GIL, so threads are enough to use several cores).
+    """
+
+    def __init__(self, filenameOf: Callable[[int], str], compression=Compression.NONE, chunkThreshold=DEFAULT_CHUNK_THRESHOLD,
+                 maxBytes: Optional[int] = None, maxDurationNs: Optional[int] = None, compressionThreads=1):
+        self.filenameOf = filenameOf
+        self.compression = compression
+        self.chunkThreshold = chunkThreshold
+        self.maxBytes = maxBytes
+        self.maxDurationNs = maxDurationNs
+
+        self.compressionThreads = compressionThreads
+        self._compressionPool = None
+        if compressionThreads > 1 and compression != Compression.NONE:
+            self._compressionPool = ThreadPoolExecutor(compressionThreads)
+
+        # Connection id -> connection, for every connection any of the bags may use
+        self.connections: Dict[int, ConnectionInfo] = {}
+        # Every bag created so far, in order
+        self.filenames: List[str] = []
+        # Number of chunks in the bags that have been closed
+        self.chunkCount = 0
+
+        self._writer: Optional[BagWriter] = None
+        # Earliest message time in the current bag
+        self._startTime: Optional[int] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def addConnection(self, connection: ConnectionInfo):
+        """
+        Registers a connection that messages/chunks may use. It is only written to the bags that use it.
+        """
+        self.connections[connection.id] = connection
+
+    def canCopyChunk(self, chunk: ChunkInfo) -> bool:
+        """
+        Whether a chunk fits into a single bag, so it can be copied over whole
+        """
+        if self.maxDurationNs is not None and chunk.endTime - chunk.startTime >= self.maxDurationNs:
+            return False
+        if self.maxBytes is not None and chunk.endPosition - chunk.position + CHUNK_INFO_RECORD_OVERHEAD > self.maxBytes - FILE_HEADER_LENGTH:
+            return False
+        return True
+
+    def writeMessage(self, connectionId: int, timeNs: int, data):
+        """
+        Adds a serialized message to the current bag, first rolling over to a new bag if it doesn't fit
+        """
+        writer = self._writerFor(MESSAGE_RECORD_OVERHEAD + len(data), timeNs, timeNs, [connectionId])
+        writer.writeMessage(connectionId, timeNs, data)
+
+    def copyChunk(self, chunkRecord: bytes, indexRecords: bytes, chunk: ChunkInfo):
+        """
+        Copies a chunk read from another bag into the current bag, first rolling over to a new bag
+        if it doesn't fit (see canCopyChunk)
+        """
+        writer = self._writerFor(len(chunkRecord) + len(indexRecords), chunk.startTime, chunk.endTime, chunk.connectionCounts.keys())
+        writer.copyChunk(chunkRecord, indexRecords, chunk)
+
+    def copyChunkData(self, chunkData, indexRecords: bytes, chunk: ChunkInfo):
+        """
+        Recompresses the contents of a chunk read from another bag into the current bag, first
+        rolling over to a new bag if it doesn't fit (see BagWriter.copyChunkData and canCopyChunk)
+        """
+        writer = self._writerFor(CHUNK_RECORD_OVERHEAD + len(chunkData) + len(indexRecords), chunk.startTime, chunk.endTime, chunk.connectionCounts.keys())
+        writer.copyChunkData(chunkData, indexRecords, chunk)
+
+    def checkpoint(self) -> Optional[dict]:
+        """
+        Makes sure everything written so far is on disk (see BagWriter.sync), returning what
+        resume() needs to carry on writing from this point, or None if nothing has been written yet
+        """
+        if self._writer is None:
+            return None
+
+        position, connectionsInChunks = self._writer.sync()
+        return {
+            "filenames": list(self.filenames),
+            "position": position,
+            "startTime": self._startTime,
+            "chunkCount": self.chunkCount,
+            "connectionsInChunks": connectionsInChunks,
+        }
+
+    def resume(self, state: dict):
+        """
+        Carries on writing the bags that another writer (with the same connections and settings)
+        was writing when it returned the state from checkpoint(). The bags before the last one are
+        complete already, and the last one is cut back to where the checkpoint was taken.
+        """
+        # In place, since callers may hold on to the list
+        self.filenames[:] = state["filenames"]
+        self.chunkCount = state["chunkCount"]
+        self._startTime = state["startTime"]
+
+        self._writer = BagWriter(self.filenames[-1], self.compression, self.chunkThreshold, self._compressionPool, 2 * self.compressionThreads,
+                                 state["position"], state["connectionsInChunks"])
+        for chunk in self._writer.chunks:
+            for connectionId in chunk.connectionCounts:
+                if connectionId not in self._writer.connections:
+                    self._writer.addConnection(self.connections[connectionId])
+
+    def close(self):
+        """
+        Closes the current bag, creating an empty one if nothing was ever written
+        """
+        if self._writer is None and len(self.filenames) == 0:
+            self._openNextBag()
+        self._closeCurrentBag()
+
+        if self._compressionPool is not None:
+            self._compressionPool.shutdown()
+            self._compressionPool = None
+
+    def _writerFor(self, byteCount, startTime, endTime, connectionIds) -> BagWriter:
+        """
+        Returns the writer of the bag that something of the given size and time span goes into,
+        rolling over to a new bag when it doesn't fit the current one
+        """
+        if self._writer is not None and not self._writer.isEmpty:
+            tooBig = self.maxBytes is not None and self._writer.sizeEstimate + byteCount > self.maxBytes
+            tooLong = self.maxDurationNs is not None and endTime - min(self._startTime, startTime) >= self.maxDurationNs
+            if tooBig or tooLong:
+                self._closeCurrentBag()
+
+        if self._writer is None:
+            self._openNextBag()
+
+        self._startTime = startTime if self._startTime is None else min(self._startTime, startTime)
+
+        for connectionId in connectionIds:
+            if connectionId not in self._writer.connections:
+                self._writer.addConnection(self.connections[connectionId])
+
+        return self._writer
+
+    def _openNextBag(self):
+        filename = self.filenameOf(len(self.filenames))
+        self.filenames.append(filename)
+        self._writer = BagWriter(filename, self.compression, self.chunkThreshold, self._compressionPool, 2 * self.compressionThreads)
+        self._startTime = None
+
+    def _closeCurrentBag(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self.chunkCount += len(self._writer.chunks)
+        self._writer = None
+
+
+def readChunkInfos(file, position, endPosition, truncated=False, progressCallback: Callable[[int], None] = None) -> List[ChunkInfo]:
+    """
+    Reads the chunk records between two positions of a bag file, along with the index data
+    records following each of them, without reading the chunks' contents. This rebuilds the
+    chunk info records of a bag whose index was never written.
+
+    With truncated, the records may stop partway (e.g. where a recorder crashed): reading ends
+    at the first record that is cut off or garbled, and chunks whose index data records were
+    never written are left out. progressCallback is called with the position of each record.
+    """
+    chunks = []
+    file.seek(position)
+
+    while position < endPosition:
+        try:
+            header = decodeHeader(_readExactly(file, _readLength(file)))
+            dataLength = _readLength(file)
+            op = _unpackUint8(header["op"])
+            if file.tell() + dataLength > endPosition:
+                raise BagFormatError(f"{file.name} has a record running past position {endPosition}")
+
+            if op == Op.CHUNK:
+                chunk = ChunkInfo(
+                    position=position,
+                    startTime=None,
+                    endTime=None,
+                    connectionCounts={},
+                    compression=header["compression"].decode(),
+                    compressedSize=dataLength,
+                    uncompressedSize=struct.unpack("<I", header["size"])[0],
+                    dataPosition=file.tell(),
+                )
+                file.seek(dataLength, os.SEEK_CUR)
+                chunks.append(chunk)
+
+            elif op == Op.INDEX_DATA and len(chunks) > 0:
+                chunk = chunks[-1]
+                connectionId, = struct.unpack("<I", header["conn"])
+                data = _readExactly(file, dataLength)
+                chunk.connectionCounts[connectionId] = chunk.connectionCounts.get(connectionId, 0) + len(data) // 12
+
+                for secs, nsecs, _ in struct.iter_unpack("<III", data):
+                    timeNs = secs * 1000000000 + nsecs
+                    chunk.startTime = timeNs if chunk.startTime is None else min(chunk.startTime, timeNs)
+                    chunk.endTime = timeNs if chunk.endTime is None else max(chunk.endTime, timeNs)
+
+            else:
+                file.seek(dataLength, os.SEEK_CUR)
+
+        except (BagFormatError, KeyError, UnicodeDecodeError, struct.error):
+            if not truncated:
+                raise
+            break
+
+        position = file.tell()
+        if progressCallback is not None:
+            progressCallback(position)
+
+    if not truncated and position != endPosition:
+        raise BagFormatError(f"{file.name} has a record running past position {endPosition}")
+    if not truncated and any([chunk.startTime is None for chunk in chunks]):
+        raise BagFormatError(f"{file.name} has a chunk without index data records")
+
+    return [chunk for chunk in chunks if chunk.startTime is not None]
+
+
+def isIndexed(filename) -> bool:
+    """
+    Whether the file header of a version 2.0 bag points to an index, which it doesn't until the
+    bag is closed
+    """
+    with open(filename, "rb") as file:
+        if file.readline() != VERSION_LINE:
+            raise UnsupportedBagVersionError(f"{filename} is not a version 2.0 rosbag")
+
+        header, _ = readRecord(file)
+        if _unpackUint8(header["op"]) != Op.FILE_HEADER:
+            raise BagFormatError(f"{filename} does not start with a file header record")
+        return struct.unpack("<Q", header["index_pos"])[0] != 0
+
+
+def rebuildIndex(filename, progressCallback: Callable[[int, int], None] = None) -> BagIndex:
+    """
+    Rebuilds the index of a bag that was never closed (e.g. a .bag.active file left behind by a
+    recorder that crashed) from its chunk and index data records, without changing the file.
+    Messages in a chunk that was only partly written, or whose index data records weren't all
+    written, are lost. progressCallback is called with (bytes scanned, total bytes) as it goes.
+
+    The connection records of an unindexed bag are in the chunks where each connection is first
+    used, so only those chunks are decompressed.
+    """
+    with open(filename, "rb") as file:
+        if file.readline() != VERSION_LINE:
+            raise UnsupportedBagVersionError(f"{filename} is not a version 2.0 rosbag")
+
+        header, _ = readRecord(file)
+        if _unpackUint8(header["op"]) != Op.FILE_HEADER:
+            raise BagFormatError(f"{filename} does not start with a file header record")
+
+        totalBytes = os.fstat(file.fileno()).st_size
+        scanProgress = None if progressCallback is None else lambda position: progressCallback(position, totalBytes)
+        chunks = readChunkInfos(file, file.tell(), totalBytes, True, scanProgress)
+
+        # The index data records of the last chunk may have been cut short, which only shows by
+        # the chunk holding more messages than they list
+        if len(chunks) > 0:
+            try:
+                complete = len(_chunkRecordsOfOp(file, chunks[-1], Op.MESSAGE_DATA)) == chunks[-1].messageCount
+            except Exception:
+                # A garbled chunk can fail in any of the decompressors, each in its own way
+                complete = False
+            if not complete:
+                chunks.pop()
+
+        connections: Dict[int, ConnectionInfo] = {}
+        for chunk in chunks:
+            if all([connectionId in connections for connectionId in chunk.connectionCounts]):
+                continue
+            for recordHeader, data in _chunkRecordsOfOp(file, chunk, Op.CONNECTION):
+                connection = _connectionFromRecord(recordHeader, data)
+                connections.setdefault(connection.id, connection)
+
+        missingConnectionIds = set().union(*[chunk.connectionCounts.keys() for chunk in chunks]) - connections.keys()
+        if len(missingConnectionIds) > 0:
+            raise BagFormatError(f"{filename} is missing the connection records of connections {sorted(missingConnectionIds)}")
+
+        if progressCallback is not None:
+            progressCallback(totalBytes, totalBytes)
+
+    return BagIndex(connections, chunks)
+
+
+def _chunkRecordsOfOp(file, chunk: ChunkInfo, op) -> List[Tuple[Dict[str, bytes], bytes]]:
+    """
+    Returns the header and data of every record of one kind in a chunk, decompressing it
+    """
+    file.seek(chunk.dataPosition)
+    chunkData = decompressChunk(_readExactly(file, chunk.compressedSize), chunk.compression, chunk.uncompressedSize)
+
+    return [
+        (header, chunkData[dataStart:dataEnd])
+        for header, _, dataStart, dataEnd in iterRecords(chunkData)
+        if _unpackUint8(header["op"]) == op
+    ]
+
+
+def _shiftIndexRecords(indexRecords: bytes, shift) -> bytes:
+    """
+    Returns index data records with the offset of every message moved along by shift bytes
+    """
+    shifted = bytearray(indexRecords)
+    for _, _, dataStart, dataEnd in iterRecords(indexRecords):
+        for entryOffset in range(dataStart + 8, dataEnd, 12):
+            offset, = struct.unpack_from("<I", shifted, entryOffset)
+            struct.pack_into("<I", shifted, entryOffset, offset + shift)
+    return bytes(shifted)
+
+
+def _connectionFromRecord(header: Dict[str, bytes], data) -> ConnectionInfo:
+    """
+    Creates a ConnectionInfo from a connection record
+    """
+    connectionId, = struct.unpack("<I", header["conn"])
+    return ConnectionInfo(connectionId, header["topic"].decode(), decodeHeader(data))
+
+
+def _packUint8(value) -> bytes:
+    return struct.pack("<B", value)
+
+
+def _unpackUint8(buffer) -> int:
+    return struct.unpack("<B", buffer)[0]
+
+
+def _mapFile(file) -> Optional[mmap.mmap]:
+    """
+    Memory maps a whole file for reading, returning None if it can't be mapped
+    """
+    try:
+        fileMap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    # Chunks are mostly read from the start of the file to the end
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        fileMap.madvise(mmap.MADV_SEQUENTIAL)
+    return fileMap
+
+
+def _readLength(file) -> int:
+    return struct.unpack("<I", _readExactly(file, 4))[0]
+
+
+def _readExactly(file, size) -> bytes:
+    """
+    Reads exactly size bytes from the file, raising BagFormatError if the file ends first
+    """
+    data = file.read(size)
+    if len(data) != size:
+        raise BagFormatError("Unexpected end of file")
+    return data
@@ -0,0 +1,258 @@
+from bagformat import BagReader, UnsupportedBagVersionError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from metadatacache import MetadataCache, needsReindexing, openBagReader
+from reindex import ReindexProgress, reindexBagsInParallel
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Number of rosbags opened at the same time while loading. Opening a rosbag is mostly waiting
+# on the disk (or network storage), so this can be larger than the number of cores.
+DEFAULT_LOAD_THREADS = 8
+
+# Bytes of a message data record that aren't the serialized message: the header length, the
+# op/conn/time header fields, and the data length
+MESSAGE_RECORD_HEADER_BYTES = 4 + (4 + 3 + 1) + (4 + 5 + 4) + (4 + 5 + 8) + 4
+
+
+@dataclass
+class RosbagData:
+    filename: str
+    topics: Tuple[str, ...]
+    messageTypes: Tuple[str, ...]
+    messageTypesToTopicsDict: Dict[str, List[str]]
+    exporting: bool = False
+    # Topic -> number of messages on that topic
+    messageCounts: Dict[str, int] = field(default_factory=dict)
+    # Time of the first and last message in the rosbag, in nanoseconds
+    startTime: int = 0
+    endTime: int = 0
+
+
+@dataclass
+class TopicStats:
+    """
+    Statistics of the messages on a topic (in one rosbag, or added up over several)
+    """
+    messageCount: int = 0
+    # Total size of the serialized messages
+    byteCount: int = 0
+    # Time of the first and last message, in nanoseconds
+    startTime: Optional[int] = None
+    endTime: Optional[int] = None
+
+    @property
+    def frequency(self) -> Optional[float]:
+        """
+        Average number of messages per second between the first and last message
+        """
+        if self.messageCount < 2 or self.startTime is None or self.endTime <= self.startTime:
+            return None
+        return (self.messageCount - 1) / ((self.endTime - self.startTime) / 1e9)
+
+    def add(self, other: "TopicStats"):
+        """
+        Adds the statistics of the same topic in another rosbag to these
+        """
+        self.messageCount += other.messageCount
+        self.byteCount += other.byteCount
+        if other.startTime is not None:
+            self.startTime = other.startTime if self.startTime is None else min(self.startTime, other.startTime)
+            self.endTime = other.endTime if self.endTime is None else max(self.endTime, other.endTime)
+
+
+def readRosbagData(bagFilePath, cache: MetadataCache = None) -> RosbagData:
+    """
+    Opens a rosbag file and reads its topics, message types, message counts and time bounds
+    from its index. The index is taken from the cache when the rosbag hasn't changed since it
+    was last read.
+    """
+
+    try:
+        reader = openBagReader(bagFilePath, cache)
+    except UnsupportedBagVersionError:
+        # Older bag formats are read with the rosbag library
+        return _readRosbagDataWithRosbag(bagFilePath)
+
+    with reader:
+        return rosbagDataFromReader(reader)
+
+
+def rosbagDataFromReader(reader: BagReader) -> RosbagData:
+    """
+    Creates the RosbagData for a rosbag from its index
+    """
+
+    # Dictionary of topic -> message type, and topic -> message count
+    topicTypes: Dict[str, str] = {}
+    messageCounts: Dict[str, int] = {}
+
+    for connection in reader.connections.values():
+        topicTypes[connection.topic] = connection.datatype
+        messageCounts.setdefault(connection.topic, 0)
+
+    for chunk in reader.chunks:
+        for connectionId, count in chunk.connectionCounts.items():
+            messageCounts[reader.connections[connectionId].topic] += count
+
+    rosbagData = _rosbagDataFromTopicTypes(reader.filename, topicTypes)
+    rosbagData.messageCounts = messageCounts
+    rosbagData.startTime = reader.startTime
+    rosbagData.endTime = reader.endTime
+    return rosbagData
+
+
+def readTopicStats(bagFilePath, cache: MetadataCache = None) -> Dict[str, TopicStats]:
+    """
+    Works out the statistics of every topic in a version 2.0 rosbag from its index records,
+    without reading any messages. The statistics are cached alongside the rosbag's index.
+    """
+    if cache is not None:
+        cachedStats = cache.get(bagFilePath, kind="stats")
+        if cachedStats is not None:
+            return {topic: TopicStats(**topicStats) for topic, topicStats in cachedStats.items()}
+
+    with openBagReader(bagFilePath, cache) as reader:
+        topicStats = topicStatsFromReader(reader)
+
+    if cache is not None:
+        cache.put(bagFilePath, {topic: asdict(stats) for topic, stats in topicStats.items()}, kind="stats")
+    return topicStats
+
+
+def topicStatsFromReader(reader: BagReader) -> Dict[str, TopicStats]:
+    """
+    Works out the statistics of every topic from the index data records that follow each chunk.
+    A message's size is the distance to the next record in its chunk, less the record header,
+    so it slightly overcounts messages that are followed by a connection record.
+    """
+    topicStats: Dict[str, TopicStats] = {connection.topic: TopicStats() for connection in reader.connections.values()}
+
+    for chunk in reader.chunks:
+        entries = reader.readMessageIndex(chunk)
+
+        for position, (offset, connectionId, timeNs) in enumerate(entries):
+            nextOffset = entries[position + 1][0] if position + 1 < len(entries) else chunk.uncompressedSize
+
+            stats = topicStats[reader.connections[connectionId].topic]
+            stats.messageCount += 1
+            stats.byteCount += max(0, nextOffset - offset - MESSAGE_RECORD_HEADER_BYTES)
+            if stats.startTime is None or timeNs < stats.startTime:
+                stats.startTime = timeNs
+            if stats.endTime is None or timeNs > stats.endTime:
+                stats.endTime = timeNs
+
+    return topicStats
+
+
+def _readRosbagDataWithRosbag(bagFilePath) -> RosbagData:
+    """
+    Reads the topics and message types of a rosbag with the rosbag library
+    """
+
+    # Only needed for old bag formats
+    import rosbag
+
+    # Parse file
+    with rosbag.Bag(bagFilePath) as bag:
+        # Dictionary of topic -> topic information
+        topicDict = bag.get_type_and_topic_info()[1]
+
+        rosbagData = _rosbagDataFromTopicTypes(bagFilePath, {topic: topicInfo.msg_type for topic, topicInfo in topicDict.items()})
+        rosbagData.messageCounts = {topic: topicInfo.message_count for topic, topicInfo in topicDict.items()}
+        rosbagData.startTime = int(bag.get_start_time() * 1e9) if len(topicDict) > 0 else 0
+        rosbagData.endTime = int(bag.get_end_time() * 1e9) if len(topicDict) > 0 else 0
+
+    return rosbagData
+
+
+def _rosbagDataFromTopicTypes(bagFilePath, topicTypes: Dict[str, str]) -> RosbagData:
+    """
+    Creates a RosbagData from a dictionary of topic -> message type
+    """
+
+    topics = [str(key) for key in topicTypes.keys()]
+    topics.sort()
+    topics = tuple(topics)
+
+    # Dictionary of message type -> topic name
+    messageTypeDict: Dict[str, List[str]] = {}
+
+    # Populating messageTypeDict
+    for topic in topics:
+        messageType = topicTypes[topic]
+
+        # If this is the first topic that we have found to be publishing this type of message
+        if messageType not in messageTypeDict.keys():
+            messageTypeDict[messageType] = []
+
+        messageTypeDict[messageType].append(topic)
+
+    # Get sorted messageTypes as tuple
+    messageTypes = [str(key) for key in messageTypeDict.keys()]
+    messageTypes.sort()
+    messageTypes = tuple(messageTypes)
+
+    return RosbagData(bagFilePath, topics, messageTypes, messageTypeDict)
+
+
+def readRosbagDataConcurrently(bagFilePaths: List[str], loadedCallback: Callable[[RosbagData], None],
+                               failedCallback: Callable[[str, str], None], maxThreads=DEFAULT_LOAD_THREADS,
+                               cache: MetadataCache = None, reindexProgressCallback: Callable[[ReindexProgress], None] = None):
+    """
+    Reads several rosbag files at once on a thread pool. loadedCallback is called with each
+    RosbagData as soon as its rosbag is read, and failedCallback is called with the path and the
+    error for each rosbag that can't be read, without stopping the others. Both callbacks are
+    called from the thread running this function.
+
+    With a cache, the indexes of unindexed rosbags are rebuilt first, on worker processes (see
+    reindexBagsInParallel), with their progress passed to reindexProgressCallback. Without one,
+    they are rebuilt on the thread pool as each is read.
+    """
+
+    if cache is not None and cache.enabled:
+        failedPaths = set()
+
+        def onReindexFailed(bagFilePath, error):
+            failedPaths.add(bagFilePath)
+            failedCallback(bagFilePath, error)
+
+        unindexedPaths = [bagFilePath for bagFilePath in bagFilePaths if needsReindexing(bagFilePath, cache)]
+        reindexBagsInParallel(unindexedPaths, cache, progressCallback=reindexProgressCallback, failedCallback=onReindexFailed)
+        bagFilePaths = [bagFilePath for bagFilePath in bagFilePaths if bagFilePath not in failedPaths]
+
+    _readConcurrently(readRosbagData, bagFilePaths, lambda bagFilePath, rosbagData: loadedCallback(rosbagData), failedCallback, maxThreads, cache)
+
+
+def readTopicStatsConcurrently(bagFilePaths: List[str], statsCallback: Callable[[str, Dict[str, TopicStats]], None],
+                               failedCallback: Callable[[str, str], None], maxThreads=DEFAULT_LOAD_THREADS,
+                               cache: MetadataCache = None, cancelEvent=None):
+    """
+    Works out the topic statistics of several rosbag files at once on a thread pool, the same
+    way as readRosbagDataConcurrently. statsCallback is called with the path and the statistics
+    of each rosbag. Once cancelEvent is set, rosbags that haven't been started are skipped.
+    """
+    _readConcurrently(readTopicStats, bagFilePaths, statsCallback, failedCallback, maxThreads, cache, cancelEvent)
+
+
+def _readConcurrently(readFunction, bagFilePaths: List[str], loadedCallback, failedCallback, maxThreads, cache, cancelEvent=None):
+    """
+    Calls readFunction(path, cache) for every rosbag on a thread pool, passing each path and
+    result to loadedCallback (or each path and error to failedCallback) from this thread
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, min(maxThreads, len(bagFilePaths)))) as executor:
+        futures = {executor.submit(readFunction, bagFilePath, cache): bagFilePath for bagFilePath in bagFilePaths}
+
+        for future in as_completed(futures):
+            if cancelEvent is not None and cancelEvent.is_set():
+                for pendingFuture in futures:
+                    pendingFuture.cancel()
+                break
+
+            try:
+                result = future.result()
+            except Exception as error:
+                failedCallback(futures[future], str(error))
+                continue
+
+            loadedCallback(futures[future], result)
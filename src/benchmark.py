@@ -0,0 +1,392 @@
+"""
+Reproducible benchmarks of loading and exporting rosbags, run on synthetic rosbags generated
+locally, so nothing but this repository is needed (no ROS installation, ROS master or recorded
+data) and runs of different versions of the code can be compared.
+
+For every combination of the topic counts, message sizes and compressions given, a rosbag is
+generated with BagWriter, and then:
+    - its metadata is loaded the way Controller.loadBag loads it, without and with the metadata cache
+    - its topics are put into the topic table the way CentralWidget.updateDisplay does (if PyQt5 is installed)
+    - it is exported in each export mode (every topic, half of the topics, a time window,
+      decimation, recompression, splitting, and merging it with itself)
+
+Each benchmark runs in a fresh process, so the peak RSS reported is its own, and is repeated to
+get latency percentiles. Results are written as JSON.
+
+Example:
+    python3 benchmark.py --topics 10 1000 10000 --message-bytes 100 100000 --compression none lz4 --output results.json
+"""
+
+from bagformat import BagReader, BagWriter, Compression, ConnectionInfo, foundLz4
+from bagmetadata import readRosbagData
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimation import Decimation
+from exporter import ExportJob, ExportOptions, runExportJob
+from metadatacache import MetadataCache
+from typing import Dict, List, Optional
+import argparse
+import functools
+import importlib.util
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+# Bump when the layout of the results changes
+RESULTS_FORMAT_VERSION = 1
+
+# Synthetic messages are std_msgs/String messages (spread over several made up message types with
+# the same definition), so they are valid messages that could be deserialized
+MESSAGE_DEFINITION = b"string data\n"
+MESSAGE_MD5SUM = b"992ce8a1687cec8c8bd883ec73ca41d1"
+
+# Time of the first message of every synthetic rosbag, so generated rosbags are identical
+START_TIME_NS = 1600000000 * 10**9
+
+# Synthetic message contents are drawn from 16 different byte values, so they compress about
+# as well as typical sensor data (random bytes wouldn't compress at all)
+MESSAGE_ALPHABET = bytes(range(ord("a"), ord("a") + 16)) * 16
+
+# Name -> the throughput unit of the benchmark ("bytes" of the input rosbag, or "topics" in the table)
+BENCHMARKS = {
+    "load": "bytes",
+    "load_cached": "bytes",
+    "table": "topics",
+    "export_all": "bytes",
+    "export_subset": "bytes",
+    "export_subset_mmap": "bytes",
+    "export_window": "bytes",
+    "export_decimate": "bytes",
+    "export_recompress": "bytes",
+    "export_split": "bytes",
+    "export_merge": "bytes",
+}
+
+# Percentiles of the run times reported for each benchmark
+PERCENTILES = (50, 90, 99)
+
+
+def generateSyntheticBag(bagFilePath, topicCount, messageBytes, messageCount, durationSeconds, compression=Compression.NONE, typeCount=10, seed=0):
+    """
+    Writes a rosbag with messageCount messages of messageBytes bytes each, sent round robin on
+    topicCount topics (of up to typeCount message types) evenly spread over durationSeconds.
+    The same arguments always give the same rosbag.
+    """
+    randomGenerator = random.Random(seed)
+
+    # Messages are slices of one block of data, so generating big rosbags doesn't take long
+    poolBytes = max(2 * messageBytes, 1024 * 1024)
+    pool = randomGenerator.getrandbits(8 * poolBytes).to_bytes(poolBytes, "little").translate(MESSAGE_ALPHABET)
+
+    with BagWriter(bagFilePath, compression) as writer:
+        for connectionId in range(topicCount):
+            topic = f"/synthetic/topic_{connectionId:05d}"
+            header = {
+                "topic": topic.encode(),
+                "type": f"synthetic_msgs/Synthetic{connectionId % typeCount}".encode(),
+                "md5sum": MESSAGE_MD5SUM,
+                "message_definition": MESSAGE_DEFINITION,
+                "callerid": b"/benchmark",
+            }
+            writer.addConnection(ConnectionInfo(connectionId, topic, header))
+
+        periodNs = int(durationSeconds * 1e9) // max(1, messageCount)
+        for messageIndex in range(messageCount):
+            offset = randomGenerator.randrange(poolBytes - messageBytes + 1)
+            data = struct.pack("<I", messageBytes) + pool[offset:offset + messageBytes]
+            writer.writeMessage(messageIndex % topicCount, START_TIME_NS + messageIndex * periodNs, data)
+
+
+def runBenchmark(name, bagFilePath, workDirectory, repeats) -> dict:
+    """
+    Runs one benchmark repeatedly on a rosbag, returning the time each run took and the peak
+    RSS of the process (and of any processes it started). Meant to run in a fresh process.
+    """
+    os.makedirs(workDirectory, exist_ok=True)
+
+    seconds = []
+    for repeat in range(repeats):
+        runDirectory = os.path.join(workDirectory, f"{name}_{repeat}")
+        os.makedirs(runDirectory)
+        seconds.append(_BENCHMARK_FUNCTIONS[name](bagFilePath, runDirectory))
+        shutil.rmtree(runDirectory)
+
+    return {"seconds": seconds, "peakRssBytes": _peakRssBytes()}
+
+
+def _benchmarkLoad(bagFilePath, runDirectory) -> float:
+    startTime = time.perf_counter()
+    readRosbagData(bagFilePath)
+    return time.perf_counter() - startTime
+
+
+def _benchmarkCachedLoad(bagFilePath, runDirectory) -> float:
+    cache = MetadataCache(os.path.join(runDirectory, "metadata.sqlite3"))
+    readRosbagData(bagFilePath, cache)
+
+    startTime = time.perf_counter()
+    readRosbagData(bagFilePath, cache)
+    return time.perf_counter() - startTime
+
+
+def _benchmarkTable(bagFilePath, runDirectory) -> float:
+    # Only needed for this benchmark, and nothing is ever shown
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from main import CentralWidget
+
+    application = QApplication.instance() or QApplication([])
+    widget = CentralWidget()
+
+    rosbagData = readRosbagData(bagFilePath)
+    messageTypesToTopicsDict = {messageType: set(topics) for messageType, topics in rosbagData.messageTypesToTopicsDict.items()}
+
+    # Filling in the table, then switching it to message types and back
+    startTime = time.perf_counter()
+    widget.displayRosbags(set(rosbagData.topics), set(rosbagData.messageTypes), messageTypesToTopicsDict)
+    widget.displayByTopic = False
+    widget.updateDisplay()
+    widget.displayByTopic = True
+    widget.updateDisplay()
+    elapsedSeconds = time.perf_counter() - startTime
+
+    widget.deleteLater()
+    application.processEvents()
+    return elapsedSeconds
+
+
+def _benchmarkExport(bagFilePath, runDirectory, mode) -> float:
+    rosbagData = readRosbagData(bagFilePath)
+    topics = sorted(rosbagData.topics)
+    options = ExportOptions()
+    mergedFilenames = []
+
+    if mode == "export_subset":
+        topics = topics[::2]
+    elif mode == "export_subset_mmap":
+        topics = topics[::2]
+        options = ExportOptions(memoryMap=True)
+    elif mode == "export_window":
+        durationSeconds = (rosbagData.endTime - rosbagData.startTime) / 1e9
+        options = ExportOptions(startTime=durationSeconds / 4, endTime=3 * durationSeconds / 4, relativeTime=True)
+    elif mode == "export_decimate":
+        options = ExportOptions(decimations={topic: Decimation(everyNth=10) for topic in topics})
+    elif mode == "export_recompress":
+        with BagReader(bagFilePath) as reader:
+            inputCompression = reader.chunks[0].compression if len(reader.chunks) > 0 else Compression.NONE
+        # Uncompressed rosbags are compressed with lz4 when it's installed, since bz2 takes far longer
+        if inputCompression != Compression.NONE:
+            options = ExportOptions(compression=Compression.NONE)
+        else:
+            options = ExportOptions(compression=Compression.LZ4 if foundLz4 else Compression.BZ2)
+    elif mode == "export_split":
+        options = ExportOptions(splitBytes=max(1, os.path.getsize(bagFilePath) // 4))
+    elif mode == "export_merge":
+        mergedFilenames = [bagFilePath]
+
+    # Without the metadata cache, so every run is the same (and the export history is left alone)
+    job = ExportJob(bagFilePath, os.path.join(runDirectory, "output.bag"), topics, options, useMetadataCache=False, mergedFilenames=mergedFilenames)
+    result = runExportJob(job)
+    if not result.success:
+        raise RuntimeError(f"{mode} failed: {result.error}")
+    return result.elapsedSeconds
+
+
+_BENCHMARK_FUNCTIONS = {
+    "load": _benchmarkLoad,
+    "load_cached": _benchmarkCachedLoad,
+    "table": _benchmarkTable,
+    **{name: functools.partial(_benchmarkExport, mode=name) for name in BENCHMARKS if name.startswith("export_")},
+}
+
+
+def _peakRssBytes() -> Optional[int]:
+    """
+    Returns the peak resident set size of this process and its finished child processes,
+    or None where that can't be found out (Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _gitCommit() -> Optional[str]:
+    """
+    Returns the commit of the code being benchmarked, or None if it isn't in a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentile(sortedValues: List[float], percent) -> float:
+    """
+    Returns a percentile of sorted values, interpolating between the two closest values
+    """
+    position = (len(sortedValues) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sortedValues) - 1)
+    return sortedValues[lower] + (sortedValues[upper] - sortedValues[lower]) * (position - lower)
+
+
+def summarizeRuns(runs: dict, unit, bagFileBytes, messageCount, topicCount, inputCount=1) -> dict:
+    """
+    Turns the run times of a benchmark into latency percentiles and throughput (of the median run)
+    """
+    seconds = sorted(runs["seconds"])
+    summary = {
+        "repeats": len(seconds),
+        "seconds": {
+            "min": seconds[0],
+            **{f"p{percent}": _percentile(seconds, percent) for percent in PERCENTILES},
+            "max": seconds[-1],
+            "mean": sum(seconds) / len(seconds),
+        },
+        "peakRssBytes": runs["peakRssBytes"],
+    }
+
+    medianSeconds = summary["seconds"]["p50"]
+    if medianSeconds > 0:
+        if unit == "bytes":
+            summary["bytesPerSecond"] = inputCount * bagFileBytes / medianSeconds
+            summary["messagesPerSecond"] = inputCount * messageCount / medianSeconds
+        else:
+            summary["topicsPerSecond"] = topicCount / medianSeconds
+
+    return summary
+
+
+def parseArguments(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks loading and exporting synthetic rosbags, writing the results as JSON")
+
+    bagGroup = parser.add_argument_group("synthetic rosbags (one per combination of topics, message size and compression)")
+    bagGroup.add_argument("--topics", nargs="+", type=int, default=[10, 1000], help="numbers of topics")
+    bagGroup.add_argument("--message-bytes", nargs="+", type=int, default=[256, 16384], help="sizes of the messages in bytes")
+    bagGroup.add_argument("--compression", nargs="+", choices=[Compression.NONE, Compression.LZ4, Compression.BZ2], default=[Compression.NONE], help="compressions of the rosbags")
+    bagGroup.add_argument("--messages", type=int, default=10000, help="number of messages in each rosbag, spread evenly over the topics")
+    bagGroup.add_argument("--duration", type=float, default=60.0, help="seconds spanned by each rosbag")
+    bagGroup.add_argument("--types", type=int, default=10, help="number of message types the topics are spread over")
+    bagGroup.add_argument("--seed", type=int, default=0, help="seed of the message contents")
+
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS), help="benchmarks to run (default: all of them)")
+    parser.add_argument("--repeats", type=int, default=5, help="number of times each benchmark is run")
+    parser.add_argument("--work-dir", help="directory for the synthetic rosbags and exports (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic rosbags instead of removing them afterwards")
+    parser.add_argument("--output", default="-", help="where to write the JSON results (default: stdout)")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    """
+    Runs the benchmarks, returning the exit code: 0 when every benchmark ran, 1 when some failed,
+    and 2 for bad arguments
+    """
+    arguments = parseArguments(argv)
+
+    if arguments.repeats < 1 or arguments.messages < 1 or min(arguments.topics) < 1 or min(arguments.message_bytes) < 0 or arguments.types < 1:
+        print("Repeats, messages, topics and types must be at least 1, and message sizes can't be negative", file=sys.stderr)
+        return 2
+
+    workDirectory = arguments.work_dir if arguments.work_dir is not None else tempfile.mkdtemp(prefix="rosbag-benchmark-")
+    os.makedirs(workDirectory, exist_ok=True)
+
+    # The table benchmark needs PyQt5, everything else runs without it
+    skippedBenchmarks: Dict[str, str] = {}
+    if importlib.util.find_spec("PyQt5") is None:
+        skippedBenchmarks["table"] = "PyQt5 is not installed"
+
+    results = {
+        "formatVersion": RESULTS_FORMAT_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": _gitCommit(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpuCount": os.cpu_count(),
+        },
+        "settings": {
+            "messages": arguments.messages,
+            "durationSeconds": arguments.duration,
+            "types": arguments.types,
+            "seed": arguments.seed,
+            "repeats": arguments.repeats,
+        },
+        "bags": [],
+    }
+    failed = False
+
+    try:
+        for topicCount, messageBytes, compression in itertools.product(arguments.topics, arguments.message_bytes, arguments.compression):
+            bagName = f"synthetic_{topicCount}topics_{messageBytes}bytes_{compression}"
+            bagFilePath = os.path.join(workDirectory, bagName + ".bag")
+
+            startTime = time.perf_counter()
+            generateSyntheticBag(bagFilePath, topicCount, messageBytes, arguments.messages, arguments.duration, compression, arguments.types, arguments.seed)
+            generateSeconds = time.perf_counter() - startTime
+
+            bagResults = {
+                "name": bagName,
+                "topics": topicCount,
+                "messageBytes": messageBytes,
+                "compression": compression,
+                "messages": arguments.messages,
+                "fileBytes": os.path.getsize(bagFilePath),
+                "generateSeconds": generateSeconds,
+                "benchmarks": {},
+            }
+            results["bags"].append(bagResults)
+
+            for name in arguments.benchmarks:
+                if name in skippedBenchmarks:
+                    bagResults["benchmarks"][name] = {"skipped": skippedBenchmarks[name]}
+                    continue
+
+                # A fresh process per benchmark, so its peak RSS isn't that of an earlier one
+                try:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                        runs = executor.submit(runBenchmark, name, bagFilePath, os.path.join(workDirectory, bagName), arguments.repeats).result()
+                except Exception as error:
+                    bagResults["benchmarks"][name] = {"error": str(error)}
+                    print(f"{bagName} {name}: FAILED, {error}", file=sys.stderr)
+                    failed = True
+                    continue
+
+                inputCount = 2 if name == "export_merge" else 1
+                summary = summarizeRuns(runs, BENCHMARKS[name], bagResults["fileBytes"], arguments.messages, topicCount, inputCount)
+                bagResults["benchmarks"][name] = summary
+                print(f"{bagName} {name}: p50 {summary['seconds']['p50']:.4f} s, p90 {summary['seconds']['p90']:.4f} s", file=sys.stderr)
+
+            if not arguments.keep:
+                os.remove(bagFilePath)
+    finally:
+        if not arguments.keep and arguments.work_dir is None:
+            shutil.rmtree(workDirectory, ignore_errors=True)
+
+    if arguments.output == "-":
+        json.dump(results, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        with open(arguments.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=4)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+Headless command line interface to the rosbag filter, for filtering many rosbags without a display.
+
+Uses the same loading, topic selection and parallel export code as the GUI, but never imports
+PyQt5 (or the rosbag library, unless a rosbag older than format 2.0 shows up).
+
+Example:
+    python3 cli.py /data/run1.bag /data/fleet/ -o /data/filtered --types sensor_msgs/Imu --topic-regex "^/odom" --report report.json
+"""
+
+from bagformat import ACTIVE_BAG_SUFFIX, DEFAULT_CHUNK_THRESHOLD, Compression
+from bagmetadata import RosbagData, readRosbagDataConcurrently
+from datetime import datetime
+from decimation import Decimation
+from exporter import ExportJob, ExportOptions, filteredBagFilename, mergedBagFilename
+from metadatacache import MetadataCache
+from predicates import PredicateError, compilePredicates
+from reindex import ReindexProgress
+from scheduler import DEFAULT_JOBS_PER_DEVICE, exportBagsInParallel
+from selection import SelectionProfile
+from typing import Dict, List, Set
+import argparse
+import json
+import os
+import profiling
+import re
+import sys
+
+
+def findBagFiles(paths: List[str]) -> List[str]:
+    """
+    Expands the given files and directories into a sorted list of rosbag files. Directories are
+    searched recursively for files ending in .bag (or .bag.active, left behind by recorders that
+    crashed).
+    """
+    bagFiles = set()
+
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, filenames in os.walk(path):
+                bagFiles.update([os.path.join(directory, filename) for filename in filenames if filename.endswith((".bag", ".bag" + ACTIVE_BAG_SUFFIX))])
+        else:
+            bagFiles.add(path)
+
+    return sorted(bagFiles)
+
+
+def decimationsFromArguments(arguments: argparse.Namespace) -> Dict[str, Decimation]:
+    """
+    Combines the --max-hz, --every-nth and --min-gap options into one decimation per topic
+    """
+    settings: Dict[str, dict] = {}
+
+    for topic, hz in arguments.max_hz:
+        settings.setdefault(topic, {})["maxHz"] = float(hz)
+    for topic, n in arguments.every_nth:
+        settings.setdefault(topic, {})["everyNth"] = int(n)
+    for topic, seconds in arguments.min_gap:
+        settings.setdefault(topic, {})["minGapSeconds"] = float(seconds)
+
+    return {topic: Decimation(**topicSettings) for topic, topicSettings in settings.items()}
+
+
+def parseArguments(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Filters rosbag files by topic/message type without a GUI")
+
+    parser.add_argument("inputs", nargs="+", help="rosbag files, or directories to search for rosbag files")
+    parser.add_argument("-o", "--output-dir", required=True, help="directory to write the filtered rosbags to")
+
+    selectionGroup = parser.add_argument_group("topic selection (topics matching any of these are exported)")
+    selectionGroup.add_argument("--topics", nargs="+", default=[], help="topics to export")
+    selectionGroup.add_argument("--types", nargs="+", default=[], help="message types whose topics are exported")
+    selectionGroup.add_argument("--topic-regex", action="append", default=[], help="regular expression matched against topics")
+    selectionGroup.add_argument("--type-regex", action="append", default=[], help="regular expression matched against message types")
+    selectionGroup.add_argument("--profile", help="JSON selection profile (as saved from the GUI), combined with the options above")
+    selectionGroup.add_argument("--invert", action="store_true", help="export every topic that is NOT selected")
+
+    timeGroup = parser.add_argument_group("time window")
+    timeGroup.add_argument("--start", type=float, help="start of the time window in seconds")
+    timeGroup.add_argument("--end", type=float, help="end of the time window in seconds")
+    timeGroup.add_argument("--absolute-time", action="store_true", help="--start/--end are unix times instead of seconds from the start of each rosbag")
+
+    predicateGroup = parser.add_argument_group("message predicates (see predicates.py)")
+    predicateGroup.add_argument("--predicate", nargs=2, action="append", default=[], metavar=("TOPIC", "EXPRESSION"),
+                                help="only export messages on TOPIC for which the Python EXPRESSION is true, e.g. --predicate /diagnostics \"m.level >= 2\"")
+    predicateGroup.add_argument("--batch-predicate", nargs=2, action="append", default=[], metavar=("TOPIC", "EXPRESSION"),
+                                help="like --predicate, but EXPRESSION is evaluated once per block of messages (msgs, times) and returns one value per message")
+
+    decimationGroup = parser.add_argument_group("decimation (downsampling of single topics)")
+    decimationGroup.add_argument("--max-hz", nargs=2, action="append", default=[], metavar=("TOPIC", "HZ"), help="keep at most HZ messages per second of TOPIC")
+    decimationGroup.add_argument("--every-nth", nargs=2, action="append", default=[], metavar=("TOPIC", "N"), help="keep every Nth message of TOPIC")
+    decimationGroup.add_argument("--min-gap", nargs=2, action="append", default=[], metavar=("TOPIC", "SECONDS"), help="keep messages of TOPIC at least SECONDS apart")
+
+    splitGroup = parser.add_argument_group("splitting (split outputs are named <name>_filtered_0000.bag, <name>_filtered_0001.bag, ..., replacing the parts of earlier exports of the same rosbag)")
+    splitGroup.add_argument("--split-size", type=float, metavar="MB", help="split outputs into rosbags of at most MB megabytes")
+    splitGroup.add_argument("--split-duration", type=float, metavar="SECONDS", help="split outputs into rosbags spanning less than SECONDS each")
+
+    outputGroup = parser.add_argument_group("output format")
+    outputGroup.add_argument("--compression", choices=[Compression.NONE, Compression.LZ4, Compression.BZ2], help="compression of the outputs (default: same as each input)")
+    outputGroup.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_THRESHOLD // 1024, metavar="KB", help="size of the chunks written to the outputs (copied chunks keep their size)")
+    outputGroup.add_argument("--compression-threads", type=int, metavar="N", help="threads compressing chunks for each output (default: cores divided by --jobs)")
+
+    parser.add_argument("--merge", action="store_true", help="merge every rosbag into one output rosbag, in time order")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of rosbags exported at once (default: number of cores)")
+    parser.add_argument("--jobs-per-device", type=int, default=DEFAULT_JOBS_PER_DEVICE, help="number of rosbags read from/written to the same disk at once")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the metadata cache")
+    parser.add_argument("--no-resume", action="store_true", help="export every rosbag from scratch, neither resuming interrupted exports nor skipping finished ones")
+    parser.add_argument("--mmap", action="store_true", help="memory map the input rosbags instead of reading them, copying less (for rosbags on local disks)")
+    parser.add_argument("--report", default="-", help="where to write the JSON report (default: stdout)")
+
+    profilingGroup = parser.add_argument_group("profiling (see profiling.py)")
+    profilingGroup.add_argument("--profile-stages", action="store_true", help="time each stage of loading and exporting, printing a summary to stderr and adding it to the report")
+    profilingGroup.add_argument("--trace", metavar="FILE", help="also write every stage as a Chrome trace to FILE (implies --profile-stages)")
+    profilingGroup.add_argument("--cprofile", metavar="FILE", help="dump cProfile statistics of this process to FILE, and of each export job to FILE.job<N>")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    """
+    Runs the command line interface, returning the exit code: 0 when every rosbag was exported,
+    1 when some failed, and 2 for bad arguments
+    """
+    arguments = parseArguments(argv)
+
+    if arguments.profile_stages or arguments.trace is not None:
+        profiling.enable(arguments.trace)
+    if arguments.cprofile is not None:
+        profiling.enableJobCProfile(arguments.cprofile)
+
+    with profiling.cProfiled(arguments.cprofile):
+        return run(arguments)
+
+
+def run(arguments: argparse.Namespace) -> int:
+    """
+    Loads and exports the rosbags given on the command line, see main
+    """
+    for name, value in (("--jobs", arguments.jobs), ("--jobs-per-device", arguments.jobs_per_device), ("--compression-threads", arguments.compression_threads)):
+        if value is not None and value < 1:
+            print(f"{name} must be at least 1", file=sys.stderr)
+            return 2
+
+    profile = SelectionProfile()
+    if arguments.profile is not None:
+        try:
+            profile = SelectionProfile.load(arguments.profile)
+        except (OSError, ValueError, AttributeError, TypeError) as error:
+            print(f"Couldn't load selection profile {arguments.profile}: {error}", file=sys.stderr)
+            return 2
+
+    profile.topics.extend(arguments.topics)
+    profile.messageTypes.extend(arguments.types)
+    profile.topicPatterns.extend(arguments.topic_regex)
+    profile.messageTypePatterns.extend(arguments.type_regex)
+
+    if profile.isEmpty():
+        print("No topics selected, use --topics, --types, --topic-regex, --type-regex or --profile", file=sys.stderr)
+        return 2
+
+    # Check the patterns compile before loading anything
+    for pattern in profile.topicPatterns + profile.messageTypePatterns:
+        try:
+            re.compile(pattern)
+        except (re.error, TypeError) as error:
+            print(f"Invalid regular expression {pattern!r}: {error}", file=sys.stderr)
+            return 2
+
+    try:
+        decimations = decimationsFromArguments(arguments)
+    except ValueError as error:
+        print(f"Invalid decimation: {error}", file=sys.stderr)
+        return 2
+
+    options = ExportOptions(
+        startTime=arguments.start,
+        endTime=arguments.end,
+        relativeTime=not arguments.absolute_time,
+        predicates=dict(arguments.predicate),
+        batchPredicates=dict(arguments.batch_predicate),
+        decimations=decimations,
+        splitBytes=None if arguments.split_size is None else int(arguments.split_size * 1e6),
+        splitSeconds=arguments.split_duration,
+        compression=arguments.compression,
+        chunkThreshold=arguments.chunk_size * 1024,
+        compressionThreads=arguments.compression_threads if arguments.compression_threads is not None else max(1, (os.cpu_count() or 1) // arguments.jobs),
+        memoryMap=arguments.mmap,
+    )
+
+    if (options.splitBytes is not None and options.splitBytes <= 0) or (options.splitSeconds is not None and options.splitSeconds <= 0):
+        print("Outputs can only be split at a positive size/duration", file=sys.stderr)
+        return 2
+
+    # Check the predicates compile before loading anything
+    try:
+        compilePredicates(options.predicates, options.batchPredicates)
+    except PredicateError as error:
+        print(error, file=sys.stderr)
+        return 2
+
+    cache = None if arguments.no_cache else MetadataCache()
+
+    bagFiles = findBagFiles(arguments.inputs)
+    if len(bagFiles) == 0:
+        print("No rosbag files found", file=sys.stderr)
+        return 2
+
+    # Load every rosbag, combining their topics the same way the GUI does
+    rosbags: List[RosbagData] = []
+    failedLoads: Dict[str, str] = {}
+    allMessageTypesToTopicsDict: Dict[str, Set[str]] = {}
+
+    def onBagLoaded(rosbagData: RosbagData):
+        rosbags.append(rosbagData)
+        for messageType, topics in rosbagData.messageTypesToTopicsDict.items():
+            allMessageTypesToTopicsDict.setdefault(messageType, set()).update(topics)
+
+    # Unindexed rosbags are reindexed first, reporting each one's progress every 10%
+    reportedPercents: Dict[str, int] = {}
+
+    def onReindexProgress(progress: ReindexProgress):
+        percent = 100 * progress.bytesRead // max(1, progress.totalBytes) // 10 * 10
+        if percent > reportedPercents.get(progress.filename, -1):
+            reportedPercents[progress.filename] = percent
+            print(f"Reindexing {progress.filename}: {percent}%", file=sys.stderr)
+
+    readRosbagDataConcurrently(bagFiles, onBagLoaded, failedLoads.__setitem__, cache=cache, reindexProgressCallback=onReindexProgress)
+    rosbags.sort(key=lambda rosbagData: rosbagData.filename)
+
+    selectedTopics = profile.selectTopics(allMessageTypesToTopicsDict)
+    if arguments.invert:
+        allTopics = set().union(*allMessageTypesToTopicsDict.values())
+        selectedTopics = sorted(allTopics - set(selectedTopics))
+
+    os.makedirs(arguments.output_dir, exist_ok=True)
+
+    # Split outputs are numbered instead of timestamped, so exporting again gives the same names
+    exportTime = None if options.splits() else datetime.now()
+    if arguments.merge and len(rosbags) > 0:
+        bagFilenames = [rosbagData.filename for rosbagData in rosbags]
+        jobs = [ExportJob(bagFilenames[0], mergedBagFilename(bagFilenames, arguments.output_dir, exportTime), selectedTopics, options, cache is not None, bagFilenames[1:], not arguments.no_resume)]
+    else:
+        jobs = [
+            ExportJob(rosbagData.filename, filteredBagFilename(rosbagData.filename, arguments.output_dir, exportTime), selectedTopics, options, cache is not None,
+                      resume=not arguments.no_resume)
+            for rosbagData in rosbags
+        ]
+
+    results = []
+    if len(selectedTopics) > 0 and len(jobs) > 0:
+        results = exportBagsInParallel(jobs, maxWorkers=arguments.jobs, maxJobsPerDevice=arguments.jobs_per_device)
+
+    for result in results:
+        if result.skipped:
+            print(f"Skipped {result.inputFilename}, its earlier export is unchanged: {', '.join(result.outputFilenames)} "
+                  f"(remove it or use --no-resume to export it again)", file=sys.stderr)
+
+    report = {
+        "selectedTopics": selectedTopics,
+        "failedToLoad": [{"input": path, "error": error} for path, error in sorted(failedLoads.items())],
+        "results": [
+            {
+                "input": result.inputFilename,
+                "mergedInputs": job.mergedFilenames,
+                "output": result.outputFilename,
+                # What the output would have been called, which a resumed or skipped export leaves unused
+                "requestedOutput": job.outputFilename,
+                "outputs": result.outputFilenames,
+                "status": result.status,
+                "error": result.error,
+                "messageCount": result.messageCount,
+                "bytesWritten": result.bytesWritten,
+                "elapsedSeconds": result.elapsedSeconds,
+                "copiedChunkCount": result.copiedChunkCount,
+                "rewrittenChunkCount": result.rewrittenChunkCount,
+                "resumed": result.resumed,
+                # Checkpoint left behind by a failed export, which running the same command again resumes
+                "checkpoint": result.checkpointFilename,
+            }
+            for job, result in zip(jobs, results)
+        ],
+    }
+
+    # Loading is profiled in this process, exporting in the processes running the jobs
+    runProfile = profiling.mergeProfiles([profiling.takeProfile()] + [result.profile for result in results])
+    if runProfile is not None:
+        profiling.report(runProfile, "Profile")
+        report["profile"] = {"stages": runProfile["stages"], "counters": runProfile["counters"]}
+
+    if arguments.report == "-":
+        json.dump(report, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        with open(arguments.report, "w") as reportFile:
+            json.dump(report, reportFile, indent=4)
+
+    allSucceeded = len(failedLoads) == 0 and len(selectedTopics) > 0 and all([result.success for result in results])
+    return 0 if allSucceeded else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
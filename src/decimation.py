@@ -0,0 +1,87 @@
+"""
+Per-topic decimation (downsampling) applied while exporting, e.g. keeping poses at 1 Hz or
+every 10th lidar scan. Decisions only depend on a message's time and how many messages came
+before it on the same topic, so they can be made from the bag's index without deserializing
+(or even decompressing) anything.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Decimation:
+    """
+    How a topic is downsampled. A message is only kept if it passes every setting that is given.
+    """
+    # At most one message is kept per 1/maxHz seconds (aligned to whole multiples of 1/maxHz, so
+    # jitter in the recorded rate doesn't lower the output rate)
+    maxHz: Optional[float] = None
+    # Only every Nth message is kept, starting with the first
+    everyNth: int = 1
+    # Kept messages are at least this many seconds apart
+    minGapSeconds: Optional[float] = None
+
+    def __post_init__(self):
+        if self.maxHz is not None and self.maxHz <= 0:
+            raise ValueError("Max Hz must be positive")
+        if self.everyNth < 1:
+            raise ValueError("Every Nth must be at least 1")
+        if self.minGapSeconds is not None and self.minGapSeconds < 0:
+            raise ValueError("Min gap can't be negative")
+
+    def isActive(self) -> bool:
+        """
+        Whether this drops any messages at all
+        """
+        return self.maxHz is not None or self.everyNth > 1 or bool(self.minGapSeconds)
+
+
+class TopicDecimator:
+    """
+    Streaming decimation state of a single topic, fed its messages in the order they are exported
+    """
+
+    def __init__(self, decimation: Decimation):
+        self.everyNth = decimation.everyNth
+        self.periodNs = None if decimation.maxHz is None else 1e9 / decimation.maxHz
+        self.minGapNs = 0 if decimation.minGapSeconds is None else decimation.minGapSeconds * 1e9
+
+        self.messagesSeen = 0
+        self.lastKeptTimeNs: Optional[int] = None
+        self.lastKeptPeriod: Optional[int] = None
+
+    def keep(self, timeNs: int) -> bool:
+        """
+        Returns whether the next message on the topic, sent at the given time, is kept
+        """
+        messageNumber = self.messagesSeen
+        self.messagesSeen += 1
+
+        if messageNumber % self.everyNth != 0:
+            return False
+
+        if self.lastKeptTimeNs is not None and timeNs - self.lastKeptTimeNs < self.minGapNs:
+            return False
+
+        period = None
+        if self.periodNs is not None:
+            period = int(timeNs // self.periodNs)
+            if self.lastKeptPeriod is not None and period <= self.lastKeptPeriod:
+                return False
+
+        self.lastKeptTimeNs = timeNs
+        self.lastKeptPeriod = period
+        return True
+
+    def state(self) -> list:
+        """
+        Returns the decimation state so far, e.g. to save in an export checkpoint
+        """
+        return [self.messagesSeen, self.lastKeptTimeNs, self.lastKeptPeriod]
+
+    def restore(self, state: list):
+        """
+        Carries on from a state returned by state()
+        """
+        self.messagesSeen, self.lastKeptTimeNs, self.lastKeptPeriod = state
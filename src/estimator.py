@@ -0,0 +1,354 @@
+"""
+Dry-run estimates of exports, so the size and duration of a long export are known before
+anything is written. Which messages end up in each output bag is worked out from the input bags'
+index data records the same way the export does it (selected topics, time window, decimation and
+splitting), without reading any messages. How long the export will take is estimated from the
+throughput of earlier exports on this machine (see ExportHistory).
+"""
+
+from bagformat import CHUNK_INFO_RECORD_OVERHEAD, CHUNK_RECORD_OVERHEAD, CONNECTION_RECORD_OVERHEAD, FILE_HEADER_LENGTH, INDEX_RECORD_OVERHEAD, BagFormatError, BagReader, ChunkInfo, Compression, ConnectionInfo, encodeHeader
+from bagmetadata import DEFAULT_LOAD_THREADS, MESSAGE_RECORD_HEADER_BYTES
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimation import TopicDecimator
+from exporter import ExportJob, MessageFilter, splitBagFilename
+from exporthistory import ExportHistory
+from metadatacache import MetadataCache, openBagReader
+from predicates import PredicateError
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import contextlib
+import functools
+import heapq
+import shutil
+
+# Bytes of each message's entry in its chunk's index data records
+INDEX_ENTRY_BYTES = 12
+
+
+@dataclass
+class OutputEstimate:
+    """
+    What is expected to end up in one output bag
+    """
+    filename: str
+    messageCount: int = 0
+    # Total size of the serialized messages
+    messageBytes: int = 0
+    # Roughly how big the bag will be, including its records and index
+    fileBytes: int = 0
+
+
+@dataclass
+class JobEstimate:
+    """
+    What an export job is expected to write
+    """
+    inputFilenames: List[str]
+    outputs: List[OutputEstimate] = field(default_factory=list)
+    # Bytes of the inputs the export will read (see ExportResult.bytesRead)
+    bytesRead: int = 0
+    # Compression of the outputs
+    compression: str = Compression.NONE
+    # Predicates can only be evaluated on the messages themselves, so when there are any the
+    # counts include messages that they might drop
+    hasPredicates: bool = False
+    # Why the job couldn't be estimated, if it couldn't
+    error: str = ""
+
+    @property
+    def messageCount(self) -> int:
+        return sum([output.messageCount for output in self.outputs])
+
+    @property
+    def fileBytes(self) -> int:
+        return sum([output.fileBytes for output in self.outputs])
+
+
+@dataclass
+class ExportEstimate:
+    """
+    What a whole export (every job) is expected to write, and how long it is expected to take
+    """
+    jobs: List[JobEstimate]
+    # Expected wall time, or None when there are no earlier exports with the same compression to go by
+    seconds: Optional[float] = None
+    # Free space where the outputs are written, or None if it couldn't be found out
+    freeBytes: Optional[int] = None
+    # Why the export couldn't be estimated at all, or empty if it could
+    error: str = ""
+
+    @property
+    def messageCount(self) -> int:
+        return sum([job.messageCount for job in self.jobs])
+
+    @property
+    def fileBytes(self) -> int:
+        return sum([job.fileBytes for job in self.jobs])
+
+    def hasEnoughSpace(self) -> bool:
+        return self.freeBytes is None or self.fileBytes <= self.freeBytes
+
+
+def estimateExport(jobs: List[ExportJob], saveDirectory, parallelExports=1, cache: MetadataCache = None, history: ExportHistory = None) -> ExportEstimate:
+    """
+    Estimates every job of an export into saveDirectory, several jobs at a time, and how long the
+    export will take running parallelExports jobs at a time
+    """
+    with ThreadPoolExecutor(max(1, min(len(jobs), DEFAULT_LOAD_THREADS))) as pool:
+        jobEstimates = list(pool.map(functools.partial(estimateExportJob, cache=cache), jobs))
+
+    estimate = ExportEstimate(jobEstimates)
+
+    if history is not None:
+        estimate.seconds = _estimateSeconds(jobEstimates, parallelExports, history)
+
+    try:
+        estimate.freeBytes = shutil.disk_usage(saveDirectory).free
+    except OSError:
+        pass
+
+    return estimate
+
+
+def estimateExportJob(job: ExportJob, cache: MetadataCache = None) -> JobEstimate:
+    """
+    Works out how many messages, and how many bytes, each output bag of a job will get
+    """
+    estimate = JobEstimate(job.inputFilenames)
+
+    try:
+        with contextlib.ExitStack() as stack:
+            readers = [stack.enter_context(openBagReader(inputBagFile, cache)) for inputBagFile in job.inputFilenames]
+            _estimateOutputs(readers, job, estimate)
+    except (OSError, BagFormatError, PredicateError) as error:
+        estimate.outputs = []
+        estimate.error = str(error)
+
+    return estimate
+
+
+def _estimateOutputs(readers: List[BagReader], job: ExportJob, estimate: JobEstimate):
+    """
+    Follows the messages an export would write, in the order it would write them
+    """
+    options = job.options
+    merging = len(readers) > 1
+
+    # Like mergeBags, decimation is left out of the filters when merging (it applies to the merged
+    # stream), and a relative time window is relative to the start of the earliest bag
+    if merging:
+        startTime = min([reader.startTime for reader in readers if len(reader.chunks) > 0], default=0)
+        messageFilters = [MessageFilter(reader, set(job.topics), options, {}, startTime) for reader in readers]
+    else:
+        messageFilters = [MessageFilter(readers[0], set(job.topics), options)]
+    topicDecimators = {topic: TopicDecimator(decimation) for topic, decimation in options.decimations.items() if decimation.isActive()}
+
+    estimate.hasPredicates = any([len(messageFilter.connectionPredicates) > 0 for messageFilter in messageFilters])
+
+    inputCompression = next((reader.chunks[0].compression for reader in readers if len(reader.chunks) > 0), Compression.NONE)
+    estimate.compression = inputCompression if options.compression is None else options.compression
+    compressionRatio = _compressionRatio([chunk for reader in readers for chunk in reader.chunks], estimate.compression)
+
+    def messagesOf(bagIndex, chunk) -> List[Tuple[int, int, ConnectionInfo, int, float]]:
+        """
+        Returns (time, bag index, connection, record size, compression ratio) for each wanted
+        message of a chunk, in the order they are stored
+        """
+        reader = readers[bagIndex]
+        estimate.bytesRead += chunk.endPosition - chunk.position
+        chunkCompressionRatio = compressionRatio(chunk)
+
+        # A record's size is the distance to the next record, like in topicStatsFromReader
+        entries = reader.readMessageIndex(chunk)
+        messages = []
+        for position, (offset, connectionId, timeNs) in enumerate(entries):
+            if messageFilters[bagIndex].wantsMessage(connectionId, timeNs):
+                nextOffset = entries[position + 1][0] if position + 1 < len(entries) else chunk.uncompressedSize
+                recordBytes = max(MESSAGE_RECORD_HEADER_BYTES, nextOffset - offset)
+                messages.append((timeNs, bagIndex, reader.connections[connectionId], recordBytes, chunkCompressionRatio))
+        return messages
+
+    def mergedMessagesOf(bagIndex) -> Iterator[Tuple[int, int, ConnectionInfo, int, float]]:
+        for chunk in readers[bagIndex].chunks:
+            if not messageFilters[bagIndex].skipsChunk(chunk):
+                yield from sorted(messagesOf(bagIndex, chunk), key=lambda message: message[0])
+
+    sizer = _OutputSizer(job.outputFilename, options)
+
+    def addMessages(messages: Iterable[Tuple[int, int, ConnectionInfo, int, float]]):
+        for timeNs, _, connection, recordBytes, messageCompressionRatio in messages:
+            decimator = topicDecimators.get(connection.topic)
+            if decimator is not None and not decimator.keep(timeNs):
+                continue
+
+            sizer.addMessage(connection, timeNs, recordBytes, messageCompressionRatio)
+
+    if merging:
+        addMessages(heapq.merge(*[mergedMessagesOf(bagIndex) for bagIndex in range(len(readers))], key=lambda message: message[:2]))
+    else:
+        for chunk in readers[0].chunks:
+            if messageFilters[0].skipsChunk(chunk):
+                continue
+
+            # Like exportBag, chunks that are kept whole are copied into one bag as they are
+            if messageFilters[0].keepsWholeChunk(chunk) and sizer.canCopyChunk(chunk):
+                copiedBytes = chunk.endPosition - chunk.position if chunk.compression == estimate.compression else CHUNK_RECORD_OVERHEAD + chunk.uncompressedSize
+                sizer.addChunk(chunk, copiedBytes, messagesOf(0, chunk))
+            else:
+                addMessages(messagesOf(0, chunk))
+
+    estimate.outputs = sizer.finish()
+
+
+def _compressionRatio(chunks: List[ChunkInfo], compression) -> Callable[[ChunkInfo], float]:
+    """
+    Returns a function giving how much the records of an input chunk are expected to shrink in an
+    output with the given compression. Chunks with a different compression are assumed to shrink
+    like the input chunks that do have it, or not at all if there aren't any, which errs on the
+    large side.
+    """
+    sameCompressionChunks = [chunk for chunk in chunks if chunk.compression == compression and chunk.uncompressedSize > 0]
+    uncompressedSize = sum([chunk.uncompressedSize for chunk in sameCompressionChunks])
+    knownRatio = sum([chunk.compressedSize for chunk in sameCompressionChunks]) / uncompressedSize if uncompressedSize > 0 else 1.0
+
+    def compressionRatio(chunk: ChunkInfo) -> float:
+        if compression == Compression.NONE:
+            return 1.0
+        if chunk.compression == compression and chunk.uncompressedSize > 0:
+            return chunk.compressedSize / chunk.uncompressedSize
+        return knownRatio
+
+    return compressionRatio
+
+
+class _OutputSizer:
+    """
+    Spreads messages over output bags the way SplitBagWriter does, adding up how big each bag gets
+    """
+
+    def __init__(self, outputBagFile, options):
+        if options.splits():
+            self.filenameOf = functools.partial(splitBagFilename, outputBagFile)
+        else:
+            self.filenameOf = lambda partIndex: outputBagFile
+
+        self.maxBytes = options.splitBytes
+        self.maxDurationNs = None if options.splitSeconds is None else int(round(options.splitSeconds * 1e9))
+        self.chunkThreshold = options.chunkThreshold
+
+        self.outputs: List[OutputEstimate] = []
+        self._output: Optional[OutputEstimate] = None
+        self._startTime = None
+        self._uncompressedBytes = 0
+        self._compressedBytes = 0.0
+        # (topic, message type, md5sum) -> size of the connection's record, for the connections in the current bag
+        self._connectionBytes: Dict[Tuple[str, str, str], int] = {}
+
+    def canCopyChunk(self, chunk: ChunkInfo) -> bool:
+        """
+        Same as SplitBagWriter.canCopyChunk
+        """
+        if self.maxDurationNs is not None and chunk.endTime - chunk.startTime >= self.maxDurationNs:
+            return False
+        if self.maxBytes is not None and chunk.endPosition - chunk.position + CHUNK_INFO_RECORD_OVERHEAD > self.maxBytes - FILE_HEADER_LENGTH:
+            return False
+        return True
+
+    def addMessage(self, connection: ConnectionInfo, timeNs, recordBytes, compressionRatio):
+        self._outputFor(recordBytes * compressionRatio, timeNs, timeNs)
+        self._add(connection, timeNs, recordBytes, compressionRatio)
+
+    def addChunk(self, chunk: ChunkInfo, copiedBytes, messages: List[Tuple[int, int, ConnectionInfo, int, float]]):
+        """
+        Adds the messages of a chunk that is copied whole, so they all go into the same bag
+        """
+        self._outputFor(copiedBytes, chunk.startTime, chunk.endTime)
+        for timeNs, _, connection, recordBytes, compressionRatio in messages:
+            self._add(connection, timeNs, recordBytes, compressionRatio)
+
+    def finish(self) -> List[OutputEstimate]:
+        """
+        Returns the estimate of every output bag. Like SplitBagWriter, an empty bag is still written
+        when there are no messages.
+        """
+        if self._output is None:
+            self._startOutput()
+        self._finishOutput()
+        return self.outputs
+
+    def _outputFor(self, byteCount, startTime, endTime):
+        """
+        Rolls over to a new bag when something of the given size and time span doesn't fit the current one
+        """
+        if self._output is not None and self._output.messageCount > 0:
+            tooBig = self.maxBytes is not None and self._fileBytes() + byteCount > self.maxBytes
+            tooLong = self.maxDurationNs is not None and endTime - min(self._startTime, startTime) >= self.maxDurationNs
+            if tooBig or tooLong:
+                self._finishOutput()
+
+        if self._output is None:
+            self._startOutput()
+
+        self._startTime = startTime if self._startTime is None else min(self._startTime, startTime)
+
+    def _add(self, connection: ConnectionInfo, timeNs, recordBytes, compressionRatio):
+        key = (connection.topic, connection.datatype, connection.md5sum)
+        if key not in self._connectionBytes:
+            self._connectionBytes[key] = CONNECTION_RECORD_OVERHEAD + len(connection.topic) + len(encodeHeader(connection.header))
+
+        self._output.messageCount += 1
+        self._output.messageBytes += recordBytes - MESSAGE_RECORD_HEADER_BYTES
+        self._uncompressedBytes += recordBytes
+        self._compressedBytes += recordBytes * compressionRatio
+
+    def _startOutput(self):
+        self._output = OutputEstimate(self.filenameOf(len(self.outputs)))
+        self.outputs.append(self._output)
+        self._startTime = None
+        self._uncompressedBytes = 0
+        self._compressedBytes = 0.0
+        self._connectionBytes = {}
+
+    def _finishOutput(self):
+        self._output.fileBytes = self._fileBytes()
+        self._output = None
+
+    def _fileBytes(self) -> int:
+        """
+        Size of the current bag: its header, its messages (compressed like their input), and each
+        connection record (stored twice, in the chunk that first uses it and in the index), chunk
+        record, index data record and chunk info record
+        """
+        chunkCount = -(-self._uncompressedBytes // self.chunkThreshold)
+        chunkBytes = CHUNK_RECORD_OVERHEAD + CHUNK_INFO_RECORD_OVERHEAD + INDEX_RECORD_OVERHEAD * len(self._connectionBytes)
+
+        return int(
+            FILE_HEADER_LENGTH
+            + 2 * sum(self._connectionBytes.values())
+            + self._compressedBytes
+            + INDEX_ENTRY_BYTES * self._output.messageCount
+            + chunkCount * chunkBytes
+        )
+
+
+def _estimateSeconds(jobEstimates: List[JobEstimate], parallelExports, history: ExportHistory) -> Optional[float]:
+    """
+    Estimates the wall time of running the jobs parallelExports at a time, from the throughput of
+    earlier exports with the same compression. Throughput is measured per job while others ran
+    alongside it, so it already reflects sharing the disk and cores.
+    """
+    jobSeconds = []
+    for jobEstimate in jobEstimates:
+        if jobEstimate.error != "":
+            continue
+
+        throughput = history.throughput(jobEstimate.compression)
+        if throughput is None:
+            return None
+        jobSeconds.append(jobEstimate.bytesRead / throughput)
+
+    if len(jobSeconds) == 0:
+        return None
+
+    # The longest job, or everything shared evenly between the parallel exports, whichever takes longer
+    return max(max(jobSeconds), sum(jobSeconds) / max(1, min(parallelExports, len(jobSeconds))))
@@ -0,0 +1,169 @@
+"""
+Resuming exports that were interrupted, and skipping exports that were already done.
+
+An export of a single rosbag regularly saves a checkpoint next to its output: which chunk of the
+input it got up to, how far the output had been written (and synced to disk), and the state of
+its decimation. When the export dies (crash, full disk, closing the application, ...), running
+the same export again picks up from the last checkpoint, cutting the output back to where the
+checkpoint was taken and rebuilding its index from the chunks already written.
+
+Exports are recognised by a fingerprint of their inputs (path, size and modification time),
+topics, options and output directory, so a new export with a different timestamp in its name
+still finds the checkpoint (and carries on writing the output it belongs to). Once an export
+succeeds, its fingerprint and outputs are stored in the metadata cache, and an export with the
+same fingerprint is skipped for as long as those outputs are left unchanged.
+"""
+
+from dataclasses import asdict, dataclass
+from metadatacache import MetadataCache
+from typing import Dict, List, Optional
+import hashlib
+import json
+import os
+
+# Bump when the layout of checkpoints (or what goes into fingerprints) changes, so old ones are ignored
+CHECKPOINT_FORMAT_VERSION = 1
+
+# Input bytes handled between two checkpoints. Each checkpoint ends the output chunk being built
+# and syncs the output to disk, so they shouldn't be too frequent.
+CHECKPOINT_INTERVAL_BYTES = 256 * 1024 * 1024
+
+# Options that change how fast an export runs, but not what it writes
+_PERFORMANCE_OPTIONS = ("compressionThreads", "memoryMap")
+
+
+def exportFingerprint(inputFilenames: List[str], outputDirectory, topics: List[str], options) -> Optional[str]:
+    """
+    Returns a fingerprint of everything that decides what an export (with the given ExportOptions)
+    writes, or None if an input can't be looked at
+    """
+    inputs = []
+    for inputFilename in inputFilenames:
+        try:
+            stat = os.stat(inputFilename)
+        except OSError:
+            return None
+        inputs.append([os.path.abspath(inputFilename), stat.st_size, stat.st_mtime_ns])
+
+    optionsDict = {name: value for name, value in asdict(options).items() if name not in _PERFORMANCE_OPTIONS}
+
+    description = json.dumps({
+        "formatVersion": CHECKPOINT_FORMAT_VERSION,
+        "inputs": inputs,
+        "outputDirectory": os.path.abspath(outputDirectory),
+        "topics": sorted(topics),
+        "options": optionsDict,
+    }, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def checkpointFilename(inputFilename, outputDirectory, fingerprint) -> str:
+    """
+    Path of the checkpoint of an export, e.g. run1_0123456789ab.checkpoint
+    """
+    name = os.path.splitext(os.path.basename(inputFilename))[0]
+    return os.path.join(outputDirectory, f"{name}_{fingerprint[:12]}.checkpoint")
+
+
+@dataclass
+class ExportCheckpoint:
+    """
+    How far an export of a single rosbag had got
+    """
+    fingerprint: str
+    # Output filename of the export that wrote the checkpoint, which a resumed export keeps writing
+    outputFilename: str
+    # Index of the first chunk of the input that still has to be exported
+    chunkIndex: int
+    # SplitBagWriter.checkpoint() of the output
+    writerState: dict
+    # Topic -> TopicDecimator.state()
+    decimatorStates: Dict[str, list]
+    messageCount: int
+    copiedChunkCount: int
+    rewrittenChunkCount: int
+
+    def save(self, path):
+        """
+        Writes the checkpoint, replacing the previous one in one go so there's always a usable one
+        """
+        temporaryPath = path + ".tmp"
+        with open(temporaryPath, "w") as checkpointFile:
+            json.dump(asdict(self), checkpointFile)
+            checkpointFile.flush()
+            os.fsync(checkpointFile.fileno())
+        os.replace(temporaryPath, path)
+
+    @classmethod
+    def load(cls, path, fingerprint) -> Optional["ExportCheckpoint"]:
+        """
+        Loads the checkpoint of the export with the given fingerprint, or returns None if there
+        isn't a usable one (e.g. its output has been deleted since)
+        """
+        try:
+            with open(path) as checkpointFile:
+                checkpoint = cls(**json.load(checkpointFile))
+
+            if checkpoint.fingerprint != fingerprint:
+                return None
+
+            filenames = checkpoint.writerState["filenames"]
+            if not all([os.path.isfile(filename) for filename in filenames]):
+                return None
+            if os.path.getsize(filenames[-1]) < checkpoint.writerState["position"]:
+                return None
+        except (OSError, ValueError, TypeError, KeyError, IndexError):
+            return None
+
+        return checkpoint
+
+
+def removeCheckpoint(path):
+    for checkpointPath in (path, path + ".tmp"):
+        if os.path.exists(checkpointPath):
+            os.remove(checkpointPath)
+
+
+def findCompletedExport(cache: MetadataCache, inputFilename, fingerprint) -> Optional[dict]:
+    """
+    Returns {"outputFilename": ..., "outputFilenames": [...], "messageCount": ...} of an earlier
+    successful export with the same fingerprint, or None if there wasn't one or its outputs have
+    changed since
+    """
+    completed = cache.get(inputFilename, _cacheKind(fingerprint))
+    if completed is None or completed.get("fingerprint") != fingerprint:
+        return None
+
+    for outputFilename, size, mtimeNs in completed.get("outputs", []):
+        try:
+            stat = os.stat(outputFilename)
+        except OSError:
+            return None
+        if stat.st_size != size or stat.st_mtime_ns != mtimeNs:
+            return None
+
+    return {
+        "outputFilename": completed["outputFilename"],
+        "outputFilenames": [output[0] for output in completed["outputs"]],
+        "messageCount": completed["messageCount"],
+    }
+
+
+def recordCompletedExport(cache: MetadataCache, inputFilename, fingerprint, outputFilename, outputFilenames: List[str], messageCount):
+    """
+    Remembers a successful export, so running it again can be skipped (see findCompletedExport)
+    """
+    outputs = []
+    for path in outputFilenames:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        outputs.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+
+    completed = {"fingerprint": fingerprint, "outputFilename": outputFilename, "outputs": outputs, "messageCount": messageCount}
+    cache.put(inputFilename, completed, _cacheKind(fingerprint))
+
+
+def _cacheKind(fingerprint) -> str:
+    return f"export_{fingerprint[:16]}"
@@ -0,0 +1,768 @@
+from bagformat import ACTIVE_BAG_SUFFIX, DEFAULT_CHUNK_THRESHOLD, BagReader, ChunkInfo, Compression, ConnectionInfo, SplitBagWriter, UnsupportedBagVersionError, recordDataAt
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimation import Decimation, TopicDecimator
+from exportcheckpoint import ExportCheckpoint
+from exporthistory import ExportHistory
+from metadatacache import MetadataCache, openBagReader
+from predicates import MessageDeserializer, MessagePredicate, compilePredicates
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import contextlib
+import exportcheckpoint
+import functools
+import glob
+import heapq
+import os
+import profiling
+import time
+
+
+@dataclass
+class ExportResult:
+    """
+    Outcome of filtering a single rosbag file
+    """
+    inputFilename: str
+    outputFilename: str
+    success: bool
+    messageCount: int = 0
+    error: str = ""
+    # Chunks copied to the output as-is, and chunks that had to be decompressed and split up
+    copiedChunkCount: int = 0
+    rewrittenChunkCount: int = 0
+    bytesWritten: int = 0
+    elapsedSeconds: float = 0.0
+    cancelled: bool = False
+    # Every bag written, which is more than just outputFilename when the output is split
+    outputFilenames: List[str] = field(default_factory=list)
+    # Bytes of the input bag(s) that had to be read, leaving out chunks that were skipped
+    bytesRead: int = 0
+    # Compression of the output
+    compression: str = Compression.NONE
+    # Time spent in each stage of the export, when profiling is on (see the profiling module)
+    profile: Optional[dict] = None
+    # The same export had already been done and its output is unchanged, so nothing was written
+    skipped: bool = False
+    # The export carried on from the checkpoint of an earlier one that was interrupted
+    resumed: bool = False
+    # Checkpoint of a failed or cancelled export that left its partial output behind to be
+    # resumed (see discardPartialExport)
+    checkpointFilename: Optional[str] = None
+
+    @property
+    def status(self) -> str:
+        if self.cancelled:
+            return "CANCELLED"
+        if self.skipped:
+            return "SKIPPED"
+        return "OK" if self.success else "FAILED"
+
+
+class ExportCancelledError(Exception):
+    """
+    Raised inside an export when it has been asked to stop
+    """
+
+
+@dataclass
+class ExportProgress:
+    """
+    How far along an export is. bytesRead counts how much of the input bag has been handled,
+    including data that was skipped without being read.
+    """
+    jobIndex: int
+    bytesRead: int
+    totalBytes: int
+    messageCount: int
+
+
+@dataclass
+class ExportOptions:
+    """
+    Settings that control what ends up in an exported bag, on top of the selected topics
+    """
+    # Only messages between these times (in seconds, inclusive) are exported, None meaning no limit.
+    # When relativeTime is True they are seconds from the start of each bag, otherwise they are
+    # absolute (unix) times.
+    startTime: Optional[float] = None
+    endTime: Optional[float] = None
+    relativeTime: bool = False
+    # Topic -> predicate expression that messages on that topic must pass to be exported,
+    # evaluated once per message (see the predicates module)
+    predicates: Dict[str, str] = field(default_factory=dict)
+    # Topic -> batch predicate expression, evaluated once per block of messages
+    batchPredicates: Dict[str, str] = field(default_factory=dict)
+    # Topic -> how that topic is downsampled
+    decimations: Dict[str, Decimation] = field(default_factory=dict)
+    # When given, the output is split into several bags of at most this many bytes and/or
+    # spanning less than this many seconds each (see splitBagFilename)
+    splitBytes: Optional[int] = None
+    splitSeconds: Optional[float] = None
+    # Compression of the output (one of Compression), or None to use the input's. Chunks that
+    # are copied whole keep their size, but are recompressed when the compression differs.
+    compression: Optional[str] = None
+    # Size in bytes at which rewritten chunks are written out
+    chunkThreshold: int = DEFAULT_CHUNK_THRESHOLD
+    # Threads compressing chunks in parallel for each export, or None for one per core
+    compressionThreads: Optional[int] = None
+    # Read the input bags through memory maps, handing messages and uncompressed chunks to the
+    # writer without copying them (see BagReader). Only meant for bags on local disks.
+    memoryMap: bool = False
+
+    def splits(self) -> bool:
+        return self.splitBytes is not None or self.splitSeconds is not None
+
+    def timeWindow(self, bagStartTime: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Returns the start and end of the time window in nanoseconds, for a bag that starts at
+        bagStartTime (also in nanoseconds)
+        """
+        offset = bagStartTime if self.relativeTime else 0
+        windowStart = None if self.startTime is None else offset + int(round(self.startTime * 1e9))
+        windowEnd = None if self.endTime is None else offset + int(round(self.endTime * 1e9))
+        return windowStart, windowEnd
+
+
+@dataclass
+class ExportJob:
+    """
+    A single bag to filter, and where to write the filtered copy
+    """
+    inputFilename: str
+    outputFilename: str
+    topics: List[str]
+    options: ExportOptions = field(default_factory=ExportOptions)
+    # Whether the rosbag's index may be read from (and stored in) the metadata cache, and the
+    # export's throughput recorded in the export history
+    useMetadataCache: bool = True
+    # More rosbags whose messages are merged with the input's into the one output, in time order
+    mergedFilenames: List[str] = field(default_factory=list)
+    # Whether the export may resume an interrupted export of the same bag (and save checkpoints
+    # to be resumed from itself), or be skipped if it was already done (see exportcheckpoint)
+    resume: bool = True
+
+    @property
+    def inputFilenames(self) -> List[str]:
+        return [self.inputFilename] + self.mergedFilenames
+
+
+def filteredBagFilename(inputBagFile, saveDirectory, exportTime: Optional[datetime]) -> str:
+    """
+    Path in saveDirectory of the filtered copy of a rosbag file. Without an export time, the
+    name has no timestamp, so exporting the same bag again gives the same name.
+    """
+    # Gets the filename (without the path) of the rosbag file, removes the file extension, and appends a suffix to indicate that it has been filtered
+    filename = _bagName(inputBagFile) + "_filtered" + _timestampSuffix(exportTime) + ".bag"
+    return os.path.join(saveDirectory, filename)
+
+
+def mergedBagFilename(inputBagFiles: List[str], saveDirectory, exportTime: datetime) -> str:
+    """
+    Path in saveDirectory of the bag that several rosbag files are merged into, named after the first of them
+    """
+    filename = _bagName(inputBagFiles[0]) + "_merged" + _timestampSuffix(exportTime) + ".bag"
+    return os.path.join(saveDirectory, filename)
+
+
+def splitBagFilename(outputBagFile, partIndex) -> str:
+    """
+    Path of one part of a split output, e.g. run1_filtered.bag -> run1_filtered_0000.bag, run1_filtered_0001.bag, ...
+    """
+    return os.path.splitext(outputBagFile)[0] + f"_{partIndex:04d}.bag"
+
+
+def _existingSplitBagFilenames(outputBagFile) -> List[str]:
+    """
+    Paths of the parts of a split output that are already on disk (see splitBagFilename)
+    """
+    pattern = glob.escape(os.path.splitext(outputBagFile)[0]) + "_[0-9][0-9][0-9][0-9].bag"
+    return sorted(glob.glob(pattern))
+
+
+def _bagName(bagFile) -> str:
+    """
+    Filename of a rosbag without its path or extension, which for a rosbag that is still being
+    recorded (or whose recorder crashed) includes the .active suffix, e.g. run1.bag.active -> run1
+    """
+    filename = os.path.basename(bagFile)
+    if filename.endswith(ACTIVE_BAG_SUFFIX):
+        filename = filename[:-len(ACTIVE_BAG_SUFFIX)]
+    return "".join(filename.split(".")[:-1])
+
+
+def _timestampSuffix(exportTime: Optional[datetime]) -> str:
+    return "" if exportTime is None else "_" + exportTime.strftime("%Y_%m_%d-%I:%M:%S_%p")
+
+
+# Minimum time between two progress reports from the same export
+PROGRESS_INTERVAL_SECONDS = 0.1
+
+
+def runExportJob(job: ExportJob, jobIndex=0, progressQueue=None, cancelEvent=None) -> ExportResult:
+    """
+    Runs an export job, timing it and measuring the size of its output. When given a queue,
+    ExportProgress updates are put on it every PROGRESS_INTERVAL_SECONDS, and the export stops
+    as soon as it can once cancelEvent is set. When profiling is on, the job's profile is
+    returned in the result.
+
+    Unless the job says otherwise, an export that was already done (with the outputs left
+    unchanged) is skipped, and an export of a single bag resumes from the checkpoint of an
+    interrupted one, saving checkpoints of its own as it goes.
+    """
+    startTime = time.monotonic()
+
+    progressCallback = None
+    if progressQueue is not None:
+        lastReportTime = 0.0
+
+        def progressCallback(bytesRead, totalBytes, messageCount):
+            nonlocal lastReportTime
+            now = time.monotonic()
+            if now - lastReportTime >= PROGRESS_INTERVAL_SECONDS or bytesRead >= totalBytes:
+                lastReportTime = now
+                progressQueue.put(ExportProgress(jobIndex, bytesRead, totalBytes, messageCount))
+
+    cache = MetadataCache() if job.useMetadataCache else None
+
+    fingerprint = None
+    if job.resume:
+        fingerprint = exportcheckpoint.exportFingerprint(job.inputFilenames, os.path.dirname(job.outputFilename), job.topics, job.options)
+
+    if fingerprint is not None and cache is not None:
+        completed = exportcheckpoint.findCompletedExport(cache, job.inputFilename, fingerprint)
+        if completed is not None:
+            result = ExportResult(job.inputFilename, completed["outputFilename"], True, completed["messageCount"], skipped=True)
+            result.outputFilenames = completed["outputFilenames"]
+            result.bytesWritten = sum([os.path.getsize(outputFilename) for outputFilename in result.outputFilenames])
+            result.elapsedSeconds = time.monotonic() - startTime
+            return result
+
+    # Whatever this process recorded before belongs to something else
+    profiling.takeProfile()
+
+    with profiling.cProfiled(profiling.jobCProfilePath(jobIndex)):
+        if len(job.mergedFilenames) > 0:
+            result = mergeBags(job.inputFilenames, job.outputFilename, job.topics, progressCallback, cancelEvent, cache, job.options)
+        else:
+            result = exportBag(job.inputFilename, job.outputFilename, job.topics, progressCallback, cancelEvent, cache, job.options, fingerprint)
+
+    result.elapsedSeconds = time.monotonic() - startTime
+    result.profile = profiling.takeProfile()
+    if result.success:
+        result.bytesWritten = sum([os.path.getsize(outputFilename) for outputFilename in result.outputFilenames])
+        if job.useMetadataCache:
+            # Later exports are estimated from how fast this one went, which a resumed export doesn't show
+            if not result.resumed:
+                ExportHistory().record(result)
+            if fingerprint is not None:
+                exportcheckpoint.recordCompletedExport(cache, job.inputFilename, fingerprint, result.outputFilename, result.outputFilenames, result.messageCount)
+    return result
+
+
+def discardPartialExport(result: ExportResult):
+    """
+    Removes the partial output (and checkpoint) that a failed or cancelled export left behind to
+    be resumed, for when it isn't going to be
+    """
+    if result.checkpointFilename is None:
+        return
+
+    _removeOutputs([result.outputFilename] + result.outputFilenames)
+    exportcheckpoint.removeCheckpoint(result.checkpointFilename)
+    result.checkpointFilename = None
+
+
+def exportBag(inputBagFile, outputBagFile, topics: List[str], progressCallback: Callable[[int, int, int], None] = None, cancelEvent=None,
+              cache: MetadataCache = None, options: ExportOptions = None, fingerprint: Optional[str] = None) -> ExportResult:
+    """
+    Copies every message on one of the given topics from the input bag to the output bag.
+    Chunks that only hold selected connections are copied over still compressed, and the rest
+    are decompressed with only the records of selected connections being kept. Messages are
+    never deserialized. When the options give a time window, chunks outside of it are never
+    read, and chunks on its edges are split up like mixed chunks.
+
+    progressCallback is called with (bytes read, total bytes, messages written) after each chunk,
+    and the export is abandoned (removing the partial output) once cancelEvent is set. The
+    rosbag's index is taken from the cache when given one.
+
+    Given the export's fingerprint (see exportcheckpoint), a checkpoint is saved next to the
+    output every CHECKPOINT_INTERVAL_BYTES of input, and the export carries on from the checkpoint
+    of an interrupted export with the same fingerprint (writing to that export's output instead).
+    A failed or cancelled export that saved a checkpoint leaves its partial output behind.
+    """
+
+    result = ExportResult(inputBagFile, outputBagFile, False)
+
+    if options is None:
+        options = ExportOptions()
+
+    checkpointFilename = None
+    checkpoint = None
+    if fingerprint is not None:
+        checkpointFilename = exportcheckpoint.checkpointFilename(inputBagFile, os.path.dirname(outputBagFile), fingerprint)
+        checkpoint = ExportCheckpoint.load(checkpointFilename, fingerprint)
+        if checkpoint is not None:
+            outputBagFile = result.outputFilename = checkpoint.outputFilename
+
+    try:
+        try:
+            reader = openBagReader(inputBagFile, cache, options.memoryMap)
+        except UnsupportedBagVersionError:
+            # Older bag formats aren't chunked the same way, so let the rosbag library handle them
+            return _exportBagByMessage(inputBagFile, outputBagFile, topics, progressCallback, cancelEvent, options)
+
+        with reader:
+            _exportChunks(reader, outputBagFile, set(topics), result, progressCallback, cancelEvent, options, checkpointFilename, fingerprint, checkpoint)
+
+    except Exception as error:
+        result.cancelled = isinstance(error, ExportCancelledError)
+        result.error = str(error)
+
+        if checkpointFilename is not None and os.path.exists(checkpointFilename):
+            # Kept so the export can be resumed, though not in a state that looks like a valid export
+            result.checkpointFilename = checkpointFilename
+        else:
+            # Don't leave half written bags behind that look like a valid export
+            _removeOutputs([outputBagFile] + result.outputFilenames)
+        return result
+
+    if checkpointFilename is not None:
+        exportcheckpoint.removeCheckpoint(checkpointFilename)
+
+    result.success = True
+    return result
+
+
+def mergeBags(inputBagFiles: List[str], outputBagFile, topics: List[str], progressCallback: Callable[[int, int, int], None] = None, cancelEvent=None,
+              cache: MetadataCache = None, options: ExportOptions = None) -> ExportResult:
+    """
+    Filters several bags the same way as exportBag, but writes all of their messages into one
+    output bag in time order (e.g. to stitch a recording that was split into segments back
+    together). Connections with the same topic, message type and md5sum are written as one
+    connection. A relative time window is relative to the start of the earliest bag.
+
+    Each bag is read a chunk at a time and the bags are merged with a heap, so memory use only
+    grows with the number of bags, not with their size. Every message has to be rewritten (the
+    output's connection ids and chunk boundaries differ from every input's), and only 2.0 bags
+    can be merged.
+    """
+
+    result = ExportResult(inputBagFiles[0], outputBagFile, False)
+
+    if options is None:
+        options = ExportOptions()
+
+    try:
+        with contextlib.ExitStack() as stack:
+            readers = [stack.enter_context(openBagReader(inputBagFile, cache, options.memoryMap)) for inputBagFile in inputBagFiles]
+            _mergeChunks(readers, outputBagFile, set(topics), result, progressCallback, cancelEvent, options)
+
+    except Exception as error:
+        # Don't leave half written bags behind that look like a valid export
+        _removeOutputs([outputBagFile] + result.outputFilenames)
+
+        result.cancelled = isinstance(error, ExportCancelledError)
+        result.error = str(error)
+        return result
+
+    result.success = True
+    return result
+
+
+class MessageFilter:
+    """
+    Decides which messages of a bag end up in the export: messages on selected connections,
+    within the time window, that pass their topic's predicate (if it has one) and survive their
+    topic's decimation. Only messages on topics with a predicate are ever deserialized.
+    """
+
+    def __init__(self, reader: BagReader, topics, options: ExportOptions, topicDecimators: Dict[str, TopicDecimator] = None, startTime=None):
+        """
+        topicDecimators replaces the decimation of the options (an empty dictionary turns it off),
+        and startTime overrides the start of the bag that a relative time window is measured from
+        """
+        self.reader = reader
+        self.windowStart, self.windowEnd = options.timeWindow(reader.startTime if startTime is None else startTime)
+
+        self.selectedConnectionIds = set([connection.id for connection in reader.connections.values() if connection.topic in topics])
+
+        # Connection id -> predicate, for selected connections whose topic has a predicate
+        compiledPredicates = compilePredicates(options.predicates, options.batchPredicates)
+        self.connectionPredicates: Dict[int, MessagePredicate] = {
+            connectionId: compiledPredicates[reader.connections[connectionId].topic]
+            for connectionId in self.selectedConnectionIds
+            if reader.connections[connectionId].topic in compiledPredicates
+        }
+        self.deserializer = MessageDeserializer()
+
+        # Connection id -> decimation state, shared by every connection of the same topic since
+        # the rate is a property of the topic
+        if topicDecimators is None:
+            topicDecimators = {topic: TopicDecimator(decimation) for topic, decimation in options.decimations.items() if decimation.isActive()}
+        self.connectionDecimators: Dict[int, TopicDecimator] = {
+            connectionId: topicDecimators[reader.connections[connectionId].topic]
+            for connectionId in self.selectedConnectionIds
+            if reader.connections[connectionId].topic in topicDecimators
+        }
+
+    def skipsChunk(self, chunk: ChunkInfo) -> bool:
+        """
+        Whether nothing in the chunk can be exported, so it doesn't even need to be read
+        """
+        if set(chunk.connectionCounts.keys()).isdisjoint(self.selectedConnectionIds):
+            return True
+
+        return (self.windowStart is not None and chunk.endTime < self.windowStart) or (self.windowEnd is not None and chunk.startTime > self.windowEnd)
+
+    def keepsWholeChunk(self, chunk: ChunkInfo) -> bool:
+        """
+        Whether every message in the chunk is exported, so it can be copied without being decompressed
+        """
+        chunkConnectionIds = set(chunk.connectionCounts.keys())
+
+        if not chunkConnectionIds <= self.selectedConnectionIds:
+            return False
+        if not chunkConnectionIds.isdisjoint(self.connectionPredicates.keys()):
+            return False
+        if not chunkConnectionIds.isdisjoint(self.connectionDecimators.keys()):
+            return False
+
+        return (self.windowStart is None or chunk.startTime >= self.windowStart) and (self.windowEnd is None or chunk.endTime <= self.windowEnd)
+
+    def filterChunk(self, chunk: ChunkInfo) -> List[Tuple[int, int, bytes]]:
+        """
+        Returns (connection id, time, serialized message) for each message of the chunk that is
+        exported, in the order they are stored
+        """
+        with profiling.stage("filter"):
+            return self._filterChunk(chunk)
+
+    def _filterChunk(self, chunk: ChunkInfo) -> List[Tuple[int, int, bytes]]:
+
+        # Which messages are wanted is worked out from the chunk's index records first, so a chunk
+        # that only has messages we drop (e.g. a heavily decimated topic) is never decompressed
+        candidates = [
+            (offset, connectionId, timeNs)
+            for offset, connectionId, timeNs in self.reader.readMessageIndex(chunk)
+            if self.wantsMessage(connectionId, timeNs)
+        ]
+
+        # Decimation has to see the messages that passed the predicates, so it can only be decided
+        # up front when none of the messages need one
+        checkPredicates = any([connectionId in self.connectionPredicates for _, connectionId, _ in candidates])
+        if not checkPredicates:
+            candidates = [candidate for candidate in candidates if self._keepsAfterDecimation(candidate[1], candidate[2])]
+
+        if len(candidates) == 0:
+            return []
+
+        # Messages are sliced out of a view, so they aren't copied until they are written
+        chunkData = memoryview(self.reader.readChunkData(chunk))
+        messages = []
+        for offset, connectionId, timeNs in candidates:
+            dataStart, dataEnd = recordDataAt(chunkData, offset)
+            messages.append((connectionId, timeNs, chunkData[dataStart:dataEnd]))
+
+        if not checkPredicates:
+            return messages
+
+        # Predicates are evaluated on all of a connection's messages in this chunk at once, so
+        # batch predicates get a whole block of messages
+        dropped = set()
+        for connectionId, predicate in self.connectionPredicates.items():
+            positions = [position for position, message in enumerate(messages) if message[0] == connectionId]
+            if len(positions) == 0:
+                continue
+
+            connection = self.reader.connections[connectionId]
+            decodedMessages = [self.deserializer.deserialize(connection, messages[position][2]) for position in positions]
+            keep = predicate.evaluateBatch(decodedMessages, [messages[position][1] for position in positions])
+
+            dropped.update([position for position, kept in zip(positions, keep) if not kept])
+
+        return [
+            (connectionId, timeNs, data)
+            for position, (connectionId, timeNs, data) in enumerate(messages)
+            if position not in dropped and self._keepsAfterDecimation(connectionId, timeNs)
+        ]
+
+    def wantsMessage(self, connectionId, timeNs) -> bool:
+        """
+        Whether a message is on a selected connection and within the time window, before any
+        predicates or decimation
+        """
+        return (
+            connectionId in self.selectedConnectionIds
+            and (self.windowStart is None or timeNs >= self.windowStart)
+            and (self.windowEnd is None or timeNs <= self.windowEnd)
+        )
+
+    def _keepsAfterDecimation(self, connectionId, timeNs) -> bool:
+        decimator = self.connectionDecimators.get(connectionId)
+        return decimator is None or decimator.keep(timeNs)
+
+
+def _exportChunks(reader: BagReader, outputBagFile, topics, result: ExportResult, progressCallback, cancelEvent, options: ExportOptions,
+                  checkpointFilename=None, fingerprint=None, checkpoint: Optional[ExportCheckpoint] = None):
+    """
+    Writes the selected connections of an indexed 2.0 bag into a new bag, chunk by chunk, saving
+    checkpoints to checkpointFilename when given one, and resuming from the given checkpoint
+    """
+
+    totalBytes = os.path.getsize(reader.filename)
+
+    topicDecimators = {topic: TopicDecimator(decimation) for topic, decimation in options.decimations.items() if decimation.isActive()}
+    messageFilter = MessageFilter(reader, topics, options, topicDecimators)
+
+    # Unless told otherwise, rewritten chunks use the same compression as the input bag
+    inputCompression = reader.chunks[0].compression if len(reader.chunks) > 0 else Compression.NONE
+
+    keptFilenames = [] if checkpoint is None else checkpoint.writerState["filenames"]
+    with _openWriter(outputBagFile, inputCompression, result, options, keptFilenames) as writer:
+
+        # Output keeps the input's connection ids so that copied chunks stay valid
+        for connectionId in messageFilter.selectedConnectionIds:
+            writer.addConnection(reader.connections[connectionId])
+
+        firstChunkIndex = 0
+        if checkpoint is not None:
+            writer.resume(checkpoint.writerState)
+            for topic, state in checkpoint.decimatorStates.items():
+                topicDecimators[topic].restore(state)
+            result.messageCount = checkpoint.messageCount
+            result.copiedChunkCount = checkpoint.copiedChunkCount
+            result.rewrittenChunkCount = checkpoint.rewrittenChunkCount
+            result.resumed = True
+            firstChunkIndex = checkpoint.chunkIndex
+
+        # Checkpoints are taken at the same chunks whether or not the export was resumed (since
+        # each one ends an output chunk early), so a resumed export writes the same output
+        lastCheckpointPosition = reader.chunks[firstChunkIndex].position if firstChunkIndex < len(reader.chunks) else 0
+
+        for chunkIndex in range(firstChunkIndex, len(reader.chunks)):
+            chunk = reader.chunks[chunkIndex]
+            _checkCancelled(cancelEvent)
+
+            if checkpointFilename is not None and chunk.position - lastCheckpointPosition >= exportcheckpoint.CHECKPOINT_INTERVAL_BYTES:
+                lastCheckpointPosition = chunk.position
+                writerState = writer.checkpoint()
+                if writerState is not None:
+                    ExportCheckpoint(
+                        fingerprint, outputBagFile, chunkIndex, writerState,
+                        {topic: decimator.state() for topic, decimator in topicDecimators.items()},
+                        result.messageCount, result.copiedChunkCount, result.rewrittenChunkCount,
+                    ).save(checkpointFilename)
+
+            if progressCallback is not None:
+                progressCallback(chunk.position, totalBytes, result.messageCount)
+
+            # Nothing in this chunk is wanted, so we don't even read it
+            if messageFilter.skipsChunk(chunk):
+                continue
+
+            result.bytesRead += chunk.endPosition - chunk.position
+
+            # Every message in this chunk is wanted, so copy it over without decompressing it
+            if messageFilter.keepsWholeChunk(chunk) and writer.canCopyChunk(chunk):
+                if chunk.compression == writer.compression:
+                    writer.copyChunk(reader.readChunkRecord(chunk), reader.readIndexRecords(chunk), chunk)
+                else:
+                    writer.copyChunkData(reader.readChunkData(chunk), reader.readIndexRecords(chunk), chunk)
+                result.messageCount += chunk.messageCount
+                result.copiedChunkCount += 1
+                continue
+
+            # Mixed chunk, so keep only the messages that pass the filter
+            for connectionId, timeNs, data in messageFilter.filterChunk(chunk):
+                writer.writeMessage(connectionId, timeNs, data)
+                result.messageCount += 1
+
+            result.rewrittenChunkCount += 1
+
+    if progressCallback is not None:
+        progressCallback(totalBytes, totalBytes, result.messageCount)
+
+
+def _openWriter(outputBagFile, inputCompression, result: ExportResult, options: ExportOptions, keptFilenames: List[str] = ()) -> SplitBagWriter:
+    """
+    Opens the writer of an export, which writes the bags it creates into the result as it goes.
+    Split outputs always get the same names, so the parts of an earlier export to the same name
+    are removed first (except keptFilenames, the parts of the export being resumed), rather than
+    left behind looking like parts of this one.
+    """
+    compression = inputCompression if options.compression is None else options.compression
+    compressionThreads = options.compressionThreads if options.compressionThreads is not None else os.cpu_count() or 1
+
+    if options.splits():
+        filenameOf = functools.partial(splitBagFilename, outputBagFile)
+        _removeOutputs([filename for filename in _existingSplitBagFilenames(outputBagFile) if filename not in keptFilenames])
+    else:
+        filenameOf = lambda partIndex: outputBagFile
+
+    writer = SplitBagWriter(
+        filenameOf,
+        compression,
+        options.chunkThreshold,
+        maxBytes=options.splitBytes,
+        maxDurationNs=None if options.splitSeconds is None else int(round(options.splitSeconds * 1e9)),
+        compressionThreads=compressionThreads,
+    )
+    result.outputFilenames = writer.filenames
+    result.compression = compression
+    return writer
+
+
+def _removeOutputs(outputFilenames: List[str]):
+    for outputFilename in set(outputFilenames):
+        if os.path.exists(outputFilename):
+            os.remove(outputFilename)
+
+
+def _checkCancelled(cancelEvent):
+    """
+    Raises ExportCancelledError if the export has been asked to stop
+    """
+    if cancelEvent is not None and cancelEvent.is_set():
+        raise ExportCancelledError("Export was cancelled")
+
+
+def _mergeChunks(readers: List[BagReader], outputBagFile, topics, result: ExportResult, progressCallback, cancelEvent, options: ExportOptions):
+    """
+    Writes the selected connections of several indexed 2.0 bags into one new bag, in time order
+    """
+
+    totalBytes = sum([os.path.getsize(reader.filename) for reader in readers])
+    bytesRead = [0] * len(readers)
+
+    # Decimation applies to the merged stream of each topic rather than to each bag on its own,
+    # so it happens here instead of in the filters (which work ahead of the merge, a chunk at a time)
+    topicDecimators = {topic: TopicDecimator(decimation) for topic, decimation in options.decimations.items() if decimation.isActive()}
+    startTime = min([reader.startTime for reader in readers if len(reader.chunks) > 0], default=0)
+    messageFilters = [MessageFilter(reader, topics, options, {}, startTime) for reader in readers]
+
+    # Unless told otherwise, rewritten chunks use the same compression as the first input bag
+    inputCompression = next((reader.chunks[0].compression for reader in readers if len(reader.chunks) > 0), Compression.NONE)
+
+    with _openWriter(outputBagFile, inputCompression, result, options) as writer:
+
+        # (topic, message type, md5sum) -> output connection id
+        outputConnectionIds: Dict[Tuple[str, str, str], int] = {}
+        # Input connection id -> output connection id, for each bag
+        connectionIdMaps: List[Dict[int, int]] = []
+        # Output connection id -> decimation state of its topic
+        connectionDecimators: Dict[int, TopicDecimator] = {}
+
+        for reader, messageFilter in zip(readers, messageFilters):
+            connectionIdMap = {}
+            for connectionId in sorted(messageFilter.selectedConnectionIds):
+                connection = reader.connections[connectionId]
+                key = (connection.topic, connection.datatype, connection.md5sum)
+                if key not in outputConnectionIds:
+                    outputConnectionIds[key] = len(outputConnectionIds)
+                    writer.addConnection(ConnectionInfo(outputConnectionIds[key], connection.topic, connection.header))
+                    if connection.topic in topicDecimators:
+                        connectionDecimators[outputConnectionIds[key]] = topicDecimators[connection.topic]
+                connectionIdMap[connectionId] = outputConnectionIds[key]
+            connectionIdMaps.append(connectionIdMap)
+
+        def messagesOf(bagIndex) -> Iterator[Tuple[int, int, int, bytes]]:
+            """
+            Yields (time, bag index, output connection id, serialized message) for the messages of
+            one bag in time order, holding no more than one chunk in memory
+            """
+            reader = readers[bagIndex]
+            messageFilter = messageFilters[bagIndex]
+            connectionIdMap = connectionIdMaps[bagIndex]
+
+            for chunk in reader.chunks:
+                _checkCancelled(cancelEvent)
+
+                bytesRead[bagIndex] = chunk.position
+                if progressCallback is not None:
+                    progressCallback(sum(bytesRead), totalBytes, result.messageCount)
+
+                if messageFilter.skipsChunk(chunk):
+                    continue
+
+                result.bytesRead += chunk.endPosition - chunk.position
+
+                # Messages are stored in the order they were written, which isn't always time order
+                for connectionId, timeNs, data in sorted(messageFilter.filterChunk(chunk), key=lambda message: message[1]):
+                    yield timeNs, bagIndex, connectionIdMap[connectionId], data
+
+            bytesRead[bagIndex] = os.path.getsize(reader.filename)
+
+        # Ties are broken by bag index, so merging the same bags always gives the same output
+        for timeNs, _, connectionId, data in heapq.merge(*[messagesOf(bagIndex) for bagIndex in range(len(readers))], key=lambda message: message[:2]):
+            decimator = connectionDecimators.get(connectionId)
+            if decimator is not None and not decimator.keep(timeNs):
+                continue
+
+            writer.writeMessage(connectionId, timeNs, data)
+            result.messageCount += 1
+
+    result.rewrittenChunkCount = writer.chunkCount
+
+    if progressCallback is not None:
+        progressCallback(totalBytes, totalBytes, result.messageCount)
+
+
+def _exportBagByMessage(inputBagFile, outputBagFile, topics: List[str], progressCallback, cancelEvent, options: ExportOptions) -> ExportResult:
+    """
+    Copies every message on one of the given topics using the rosbag library, one serialized
+    message at a time. Used for bags that are older than the 2.0 format.
+    """
+
+    if options.splits():
+        raise UnsupportedBagVersionError(f"{inputBagFile} is older than version 2.0, so its output can't be split")
+
+    # Only needed for old bag formats
+    import genpy
+    import rosbag
+
+    messageCount = 0
+    totalBytes = os.path.getsize(inputBagFile)
+    predicates = compilePredicates(options.predicates, options.batchPredicates)
+    decimators = {topic: TopicDecimator(decimation) for topic, decimation in options.decimations.items() if decimation.isActive()}
+
+    # Old bags aren't chunked, so the output is uncompressed unless a compression was chosen
+    compression = Compression.NONE if options.compression is None else options.compression
+
+    with rosbag.Bag(inputBagFile) as inputBag, rosbag.Bag(outputBagFile, "w", compression=compression, chunk_threshold=options.chunkThreshold) as outputBag:
+
+        # Progress is measured in messages here, scaled to the size of the file
+        totalMessages = max(1, inputBag.get_message_count(topics))
+
+        bagStartTime = int(inputBag.get_start_time() * 1e9) if inputBag.get_message_count() > 0 else 0
+        windowStart, windowEnd = options.timeWindow(bagStartTime)
+        windowStart = None if windowStart is None else genpy.Time(nsecs=windowStart)
+        windowEnd = None if windowEnd is None else genpy.Time(nsecs=windowEnd)
+
+        # raw=True hands us the serialized message, and the connection header lets the
+        # output keep the original message definition, callerid and latching information
+        for topic, rawMessage, timestamp, connectionHeader in inputBag.read_messages(topics=topics, start_time=windowStart, end_time=windowEnd, raw=True, return_connection_header=True):
+
+            # Raw messages are (type, serialized data, md5sum, position, message class), so the
+            # message only gets deserialized when its topic has a predicate
+            predicate = predicates.get(topic)
+            if predicate is not None:
+                message = rawMessage[4]().deserialize(rawMessage[1])
+                if not predicate.evaluateBatch([message], [timestamp.to_nsec()])[0]:
+                    continue
+
+            decimator = decimators.get(topic)
+            if decimator is not None and not decimator.keep(timestamp.to_nsec()):
+                continue
+
+            outputBag.write(topic, rawMessage, timestamp, raw=True, connection_header=connectionHeader)
+            messageCount += 1
+
+            if messageCount % 1000 == 0:
+                _checkCancelled(cancelEvent)
+                if progressCallback is not None:
+                    progressCallback(totalBytes * messageCount // totalMessages, totalBytes, messageCount)
+
+    if progressCallback is not None:
+        progressCallback(totalBytes, totalBytes, messageCount)
+
+    return ExportResult(inputBagFile, outputBagFile, True, messageCount, outputFilenames=[outputBagFile], bytesRead=totalBytes, compression=compression)
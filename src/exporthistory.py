@@ -0,0 +1,87 @@
+from metadatacache import _ClosingConnection, defaultCacheDirectory
+from typing import Optional
+import os
+import sqlite3
+import statistics
+import time
+
+# Number of the most recent exports (of each output compression) that throughput is estimated from
+DEFAULT_HISTORY_LENGTH = 20
+
+
+class ExportHistory:
+    """
+    Throughput of the exports run on this machine, stored in SQLite next to the metadata cache
+    and used to estimate how long the next export will take. Compressing the output takes far
+    longer than copying, so throughput is kept per output compression.
+
+    Like the metadata cache, the history is only ever an optimization, so any problem using it
+    makes it behave as if no exports had been run rather than raising.
+    """
+
+    def __init__(self, databasePath=None, historyLength=DEFAULT_HISTORY_LENGTH):
+        if databasePath is None:
+            databasePath = os.path.join(defaultCacheDirectory(), "export_history.sqlite3")
+
+        self.databasePath = databasePath
+        self.historyLength = historyLength
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(databasePath)), exist_ok=True)
+            with self._connect() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS export_throughput ("
+                    "compression TEXT NOT NULL, "
+                    "bytes_read INTEGER NOT NULL, "
+                    "elapsed_seconds REAL NOT NULL, "
+                    "finished REAL NOT NULL)"
+                )
+            self.enabled = True
+        except (OSError, sqlite3.Error):
+            self.enabled = False
+
+    def record(self, result):
+        """
+        Stores how fast a successful export (an ExportResult) went, forgetting the oldest exports
+        of the same compression beyond historyLength
+        """
+        if not self.enabled or result.bytesRead <= 0 or result.elapsedSeconds <= 0:
+            return
+
+        try:
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT INTO export_throughput VALUES (?, ?, ?, ?)",
+                    (result.compression, result.bytesRead, result.elapsedSeconds, time.time()),
+                )
+                connection.execute(
+                    "DELETE FROM export_throughput WHERE compression = ? AND rowid NOT IN "
+                    "(SELECT rowid FROM export_throughput WHERE compression = ? ORDER BY finished DESC LIMIT ?)",
+                    (result.compression, result.compression, self.historyLength),
+                )
+        except sqlite3.Error:
+            pass
+
+    def throughput(self, compression) -> Optional[float]:
+        """
+        Returns the median throughput (bytes of input read per second) of the recent exports with
+        the given output compression, or None if there haven't been any
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            with self._connect() as connection:
+                rows = connection.execute(
+                    "SELECT bytes_read, elapsed_seconds FROM export_throughput WHERE compression = ? ORDER BY finished DESC LIMIT ?",
+                    (compression, self.historyLength),
+                ).fetchall()
+        except sqlite3.Error:
+            return None
+
+        if len(rows) == 0:
+            return None
+        return statistics.median([bytesRead / elapsedSeconds for bytesRead, elapsedSeconds in rows])
+
+    def _connect(self) -> _ClosingConnection:
+        return _ClosingConnection(sqlite3.connect(self.databasePath, timeout=10))
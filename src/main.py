@@ -1,30 +1,78 @@
-import rosbag
 from PyQt5 import QtCore, QtWidgets
-from PyQt5.QtWidgets import QAbstractScrollArea, QCheckBox, QFileDialog, QHBoxLayout, QMainWindow, QMessageBox, QPushButton, QRadioButton, QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget, QApplication
-from dataclasses import dataclass
-from typing import Tuple, List, Dict, Set
-from datetime import datetime
+from PyQt5.QtGui import QDoubleValidator
+from PyQt5.QtWidgets import QAbstractScrollArea, QCheckBox, QComboBox, QDialog, QFileDialog, QGridLayout, QHBoxLayout, QLabel, QLineEdit, QMainWindow, QMessageBox, QProgressBar, QPushButton, QRadioButton, QScrollArea, QSpinBox, QTableView, QVBoxLayout, QWidget, QApplication
+from typing import List, Dict, Set
+from datetime import datetime, timedelta
 import os
+import profiling
+import re
+import threading
+import time
+
+from bagformat import ACTIVE_BAG_SUFFIX, DEFAULT_CHUNK_THRESHOLD, Compression
+from bagmetadata import RosbagData, TopicStats, readRosbagDataConcurrently, readTopicStatsConcurrently
+from reindex import ReindexProgress
+from metadatacache import MetadataCache
+from selection import SelectionProfile
+from topictable import CheckBoxDelegate, TopicTableModel
+from topicsearch import SearchSyntax, compileSearch
+from estimator import ExportEstimate, JobEstimate, estimateExport
+from exporter import ExportJob, ExportOptions, ExportProgress, ExportResult, discardPartialExport, filteredBagFilename, mergedBagFilename
+from exporthistory import ExportHistory
+from scheduler import exportBagsInParallel
 
 class CentralWidget(QWidget):
     """
     PyQt5 Widget that has some buttons and a table to view ROS Topics/Message Types.
     """
 
+    # Number of rows looked at when sizing the table's columns to fit their text
+    COLUMN_SIZING_ROWS = 200
+
+    # Time after the search text last changed before the table is filtered by it
+    SEARCH_DELAY_MS = 150
+
+    SEARCH_TOOLTIP = (
+        "Shows the topics (or message types) matching the search, ignoring case.\n"
+        "* matches within one level of a name (e.g. /camera/*/image_raw), ** across levels and ? one character.\n"
+        "Searches with wildcards that start with / have to match whole names, anything else matches anywhere in a name."
+    )
+
     def __init__(self, parent=None):
         """
-        Initializes CentralWidget, creates: QTableWidget to show Topics/Message Types, 
+        Initializes CentralWidget, creates: QTableView to show Topics/Message Types, 
         A button to invert current selection of topics/messages, a button to export the data,
         and two radio buttons that determine the display mode that the table shows. These two
         modes are either by topic or by message type.
         """
         super().__init__(parent=parent)
 
-        self.tableWidget = QTableWidget(self)
+        # Topics/message types being displayed, set by displayRosbags
+        self.topics = set()
+        self.messageTypes = set()
+        self.messageTypeToTopicsDict = {}
+
+        # Model holding the topics/message types and which of them are selected
+        self.tableModel = TopicTableModel(self)
+
+        # Sorts the table when a column header is clicked, without touching the model's own order
+        self.sortModel = QtCore.QSortFilterProxyModel(self)
+        self.sortModel.setSourceModel(self.tableModel)
+        self.sortModel.setSortRole(TopicTableModel.SORT_ROLE)
+
+        self.tableView = QTableView(self)
+        self.tableView.setModel(self.sortModel)
+        # Start out in the model's order, until a column header is clicked
+        self.tableView.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.tableView.setSortingEnabled(True)
+        # Checkboxes are drawn by a delegate instead of being a widget per row
+        self.checkBoxDelegate = CheckBoxDelegate(self.tableView)
+        self.tableView.setItemDelegateForColumn(TopicTableModel.CHECK_COLUMN, self.checkBoxDelegate)
+        self.tableView.verticalHeader().setVisible(False)
+        # Only look at the first rows when sizing columns, so large tables don't take long to size
+        self.tableView.horizontalHeader().setResizeContentsPrecision(CentralWidget.COLUMN_SIZING_ROWS)
         # Allows table to be resized to fit the largest text
-        self.tableWidget.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
-        # Initializes table by clearing it
-        self.clearTable()
+        self.tableView.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
 
         # Making the button that inverts the selection
         self.invertSelectionButton = QPushButton(self)
@@ -35,6 +83,132 @@ class CentralWidget(QWidget):
         self.exportButton = QPushButton(self)
         self.exportButton.setText("Filter to new Rosbag")
 
+        # Making the button that estimates what an export would write, without writing anything (event is linked up in Controller class)
+        self.previewButton = QPushButton(self)
+        self.previewButton.setText("Preview")
+
+        # Creating parent widget to hold the export settings
+        self.exportOptions = QWidget()
+
+        # Number of rosbags that get exported at the same time, each in its own process
+        self.parallelExportsSpinBox = QSpinBox()
+        self.parallelExportsSpinBox.setRange(1, os.cpu_count() or 1)
+        self.parallelExportsSpinBox.setValue(os.cpu_count() or 1)
+
+        # Time window to export, left empty to export from the start/until the end
+        self.startTimeLineEdit = QLineEdit()
+        self.startTimeLineEdit.setPlaceholderText("Start")
+        self.startTimeLineEdit.setValidator(QDoubleValidator())
+        self.endTimeLineEdit = QLineEdit()
+        self.endTimeLineEdit.setPlaceholderText("End")
+        self.endTimeLineEdit.setValidator(QDoubleValidator())
+
+        # When checked, the time window is in seconds from the start of each rosbag, otherwise in unix time
+        self.relativeTimeCheckBox = QCheckBox("Relative to Bag Start")
+        self.relativeTimeCheckBox.setChecked(True)
+
+        # Size/duration that outputs are split at, left empty to not split them
+        self.splitSizeLineEdit = QLineEdit()
+        self.splitSizeLineEdit.setPlaceholderText("MB")
+        self.splitSizeLineEdit.setValidator(QDoubleValidator())
+        self.splitDurationLineEdit = QLineEdit()
+        self.splitDurationLineEdit.setPlaceholderText("Seconds")
+        self.splitDurationLineEdit.setValidator(QDoubleValidator())
+
+        # When checked, every rosbag is filtered into one merged rosbag (in time order) instead of one each
+        self.mergeCheckBox = QCheckBox("Merge into One Rosbag")
+
+        # When checked, rosbags are read through memory maps, which copies less but is only meant for local disks
+        self.memoryMapCheckBox = QCheckBox("Memory Map Inputs")
+        self.memoryMapCheckBox.setToolTip("Read the rosbags through memory maps, copying less data. Only use this for rosbags on local disks.")
+
+        # Compression of the exported rosbags (None keeps each rosbag's own compression)
+        self.compressionComboBox = QComboBox()
+        self.compressionComboBox.addItem("Same as Input", None)
+        self.compressionComboBox.addItem("None", Compression.NONE)
+        self.compressionComboBox.addItem("LZ4", Compression.LZ4)
+        self.compressionComboBox.addItem("BZ2", Compression.BZ2)
+
+        # Size of the chunks written to the exported rosbags
+        self.chunkSizeSpinBox = QSpinBox()
+        self.chunkSizeSpinBox.setRange(64, 64 * 1024)
+        self.chunkSizeSpinBox.setSingleStep(256)
+        self.chunkSizeSpinBox.setSuffix(" KB")
+        self.chunkSizeSpinBox.setValue(DEFAULT_CHUNK_THRESHOLD // 1024)
+
+        # Laying out export settings in rows within parent widget
+        parallelExportsLayout = QHBoxLayout()
+        parallelExportsLayout.addWidget(QLabel("Parallel Exports:"))
+        parallelExportsLayout.addWidget(self.parallelExportsSpinBox)
+        parallelExportsLayout.addWidget(self.mergeCheckBox)
+        parallelExportsLayout.addStretch()
+
+        timeWindowLayout = QHBoxLayout()
+        timeWindowLayout.addWidget(QLabel("Time Window (s):"))
+        timeWindowLayout.addWidget(self.startTimeLineEdit)
+        timeWindowLayout.addWidget(QLabel("to"))
+        timeWindowLayout.addWidget(self.endTimeLineEdit)
+        timeWindowLayout.addWidget(self.relativeTimeCheckBox)
+
+        splitLayout = QHBoxLayout()
+        splitLayout.addWidget(QLabel("Split Output Every:"))
+        splitLayout.addWidget(self.splitSizeLineEdit)
+        splitLayout.addWidget(QLabel("or"))
+        splitLayout.addWidget(self.splitDurationLineEdit)
+
+        compressionLayout = QHBoxLayout()
+        compressionLayout.addWidget(QLabel("Compression:"))
+        compressionLayout.addWidget(self.compressionComboBox)
+        compressionLayout.addWidget(QLabel("Chunk Size:"))
+        compressionLayout.addWidget(self.chunkSizeSpinBox)
+        compressionLayout.addWidget(self.memoryMapCheckBox)
+        compressionLayout.addStretch()
+
+        exportOptionsLayout = QVBoxLayout()
+        exportOptionsLayout.setContentsMargins(0, 0, 0, 0)
+        exportOptionsLayout.addLayout(parallelExportsLayout)
+        exportOptionsLayout.addLayout(timeWindowLayout)
+        exportOptionsLayout.addLayout(splitLayout)
+        exportOptionsLayout.addLayout(compressionLayout)
+        self.exportOptions.setLayout(exportOptionsLayout)
+
+        # Creating parent widget to hold the search box and the buttons acting on its matches
+        self.searchOptions = QWidget()
+
+        # Search box filtering the table, applied once typing pauses so large tables stay responsive
+        self.searchLineEdit = QLineEdit()
+        self.searchLineEdit.setPlaceholderText("Search, e.g. /camera/*/image_raw")
+        self.searchLineEdit.setToolTip(CentralWidget.SEARCH_TOOLTIP)
+        self.searchLineEdit.setClearButtonEnabled(True)
+
+        # When checked, the search is a regular expression instead of a glob
+        self.regexSearchCheckBox = QCheckBox("Regex")
+
+        self.searchTimer = QtCore.QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(CentralWidget.SEARCH_DELAY_MS)
+        self.searchTimer.timeout.connect(self.applySearch)
+
+        self.searchLineEdit.textChanged.connect(self.searchTimer.start)
+        self.searchLineEdit.returnPressed.connect(self.applySearch)
+        self.regexSearchCheckBox.toggled.connect(self.applySearch)
+
+        # Making the buttons that select/deselect every topic matching the search
+        self.selectMatchesButton = QPushButton(self)
+        self.selectMatchesButton.setText("Select Matches")
+        self.selectMatchesButton.clicked.connect(self.selectMatches)
+        self.deselectMatchesButton = QPushButton(self)
+        self.deselectMatchesButton.setText("Deselect Matches")
+        self.deselectMatchesButton.clicked.connect(self.deselectMatches)
+
+        searchOptionsLayout = QHBoxLayout()
+        searchOptionsLayout.setContentsMargins(0, 0, 0, 0)
+        searchOptionsLayout.addWidget(self.searchLineEdit, 1)
+        searchOptionsLayout.addWidget(self.regexSearchCheckBox)
+        searchOptionsLayout.addWidget(self.selectMatchesButton)
+        searchOptionsLayout.addWidget(self.deselectMatchesButton)
+        self.searchOptions.setLayout(searchOptionsLayout)
+
         # Creating parent widget to hold the two radio buttons
         self.displayOptions = QWidget()
 
@@ -61,101 +235,103 @@ class CentralWidget(QWidget):
         # Creating layout for CentralWidget
         layout = QVBoxLayout(self)
         layout.addWidget(self.invertSelectionButton)
-        layout.addWidget(self.exportButton)
+        exportButtonsLayout = QHBoxLayout()
+        exportButtonsLayout.addWidget(self.exportButton, 1)
+        exportButtonsLayout.addWidget(self.previewButton)
+        layout.addLayout(exportButtonsLayout)
+        layout.addWidget(self.exportOptions)
         layout.addWidget(self.displayOptions)
-        layout.addWidget(self.tableWidget)
+        layout.addWidget(self.searchOptions)
+        layout.addWidget(self.tableView)
 
         # Applying the created layout
         self.setLayout(layout)
 
 
-    def clearTable(self):
-        """
-        Clears the current table by setting rowCount and ColCount to 0. 
-        Also clears the dictionary keeping track of checkboxes
-        """
-        self.tableWidget.clear()
-        self.tableWidget.setRowCount(0)
-        self.tableWidget.setColumnCount(0)
-
-        # Dictionary storing mapping checkboxes to their respective topic/message type
-        self.checkboxWidgets: Dict[QCheckBox, str] = {}
-
-
-    def initializeTable(self, rowCount, colCount, headers):
-        """
-        Sets the size of the table, and the headers
-        """
-        self.tableWidget.setRowCount(rowCount)
-        self.tableWidget.setColumnCount(colCount)
-        self.tableWidget.setHorizontalHeaderLabels(headers)
-
     def setDisableCheckboxes(self, isDisabled):
         """
         Disables/Enables all checkboxes based on the input parameter
         """
-        for checkboxWidget in self.checkboxWidgets.keys():
-            checkboxWidget.setDisabled(isDisabled)
+        self.tableModel.setCheckable(not isDisabled)
 
     def getSelectedTopics(self):
         """
         Returns a list of strings of all of the currently selected topics based on
         the checkboxes
         """
+        return self.tableModel.getSelectedTopics()
 
-        # All the the selected topics will be put into this list
-        topics = []
-
-        # Iterating through each checkbox in the table
-        for checkboxWidget in self.checkboxWidgets.keys():
-
-            # Skip if not checked
-            if not checkboxWidget.isChecked():
-                continue
-
-            # If the table's primary key is topic, then the checkboxWidgets Dict is Checkbox -> Topic string
-            if self.displayByTopic:
-                topics.append(self.checkboxWidgets[checkboxWidget])
-            # Else, the checkboxWidgets Dict is Checkbox -> Message type
-            else:
-                messageType = self.checkboxWidgets[checkboxWidget]
-
-                # Lookup the topics corresponding to this message type
-                topics.extend(self.messageTypeToTopicsDict[messageType])
-
-        return topics
-
+    def getExportOptions(self) -> ExportOptions:
+        """
+        Returns the export settings chosen by the user
+        """
+        splitMegabytes = self._optionalFloat(self.splitSizeLineEdit.text())
+
+        return ExportOptions(
+            startTime=self._optionalFloat(self.startTimeLineEdit.text()),
+            endTime=self._optionalFloat(self.endTimeLineEdit.text()),
+            relativeTime=self.relativeTimeCheckBox.isChecked(),
+            decimations=self.tableModel.getDecimations(),
+            splitBytes=None if splitMegabytes is None else int(splitMegabytes * 1e6),
+            splitSeconds=self._optionalFloat(self.splitDurationLineEdit.text()),
+            compression=self.compressionComboBox.currentData(),
+            chunkThreshold=self.chunkSizeSpinBox.value() * 1024,
+            # Each of the parallel exports gets its share of the cores for compressing
+            compressionThreads=max(1, (os.cpu_count() or 1) // self.parallelExportsSpinBox.value()),
+            memoryMap=self.memoryMapCheckBox.isChecked(),
+        )
 
-    def setRow(self, row, checkbox, fields):
+    @classmethod
+    def _optionalFloat(cls, text):
         """
-        Adds a row to the table with the corresponding checkbox in each row to allow each row to
-        effectively be selected
+        Converts text to a float, with empty text meaning None
         """
+        text = text.strip()
+        if text == "":
+            return None
+        return float(text)
 
-        # Centering the checkbox
-        checkboxCellWidget = QWidget()
-        layout = QHBoxLayout(checkboxCellWidget)
-        layout.addWidget(checkbox)
-        layout.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-        checkboxCellWidget.setLayout(layout)
+    def invertSelection(self):
+        """
+        Inverts the current selection of checkboxes in the table
+        """
+        self.tableModel.invertSelection()
 
+    def applySearch(self):
+        """
+        Filters the table by the search box. An invalid search is shown in red, leaving the table as it was.
+        """
+        self.searchTimer.stop()
 
-        # Set the first column in this row to be the checkbox
-        self.tableWidget.setCellWidget(row, 0, checkboxCellWidget)
+        syntax = SearchSyntax.REGEX if self.regexSearchCheckBox.isChecked() else SearchSyntax.GLOB
+        try:
+            search = compileSearch(self.searchLineEdit.text(), syntax)
+        except re.error as error:
+            self.searchLineEdit.setStyleSheet("color: red")
+            self.searchLineEdit.setToolTip(f"Invalid search: {error}")
+            return
 
-        # Set the remaining columns in this row to be the provided fields
-        for index, field in enumerate(fields):
-            self.tableWidget.setItem(row, 1 + index, QTableWidgetItem(field))
+        self.searchLineEdit.setStyleSheet("")
+        self.searchLineEdit.setToolTip(CentralWidget.SEARCH_TOOLTIP)
+        self.tableModel.setSearch(search)
 
-        # Resize the table to make sure text fits within the columns
-        self.tableWidget.resizeColumnsToContents()
+    def selectMatches(self):
+        """
+        Selects every topic shown in the table (all of them when there is no search)
+        """
+        # Typing that hasn't been searched for yet still counts
+        if self.searchTimer.isActive():
+            self.applySearch()
+        self.tableModel.setTopicsChecked(self.tableModel.shownTopicRows(), True)
 
-    def invertSelection(self):
+    def deselectMatches(self):
         """
-        Inverts the current selection of checkboxes in the table
+        Deselects every topic shown in the table (all of them when there is no search)
         """
-        for checkboxWidget in self.checkboxWidgets.keys():
-            checkboxWidget.setChecked(not checkboxWidget.isChecked())
+        # Typing that hasn't been searched for yet still counts
+        if self.searchTimer.isActive():
+            self.applySearch()
+        self.tableModel.setTopicsChecked(self.tableModel.shownTopicRows(), False)
 
     def onByTopicToggle(self):
         """
@@ -181,62 +357,10 @@ class CentralWidget(QWidget):
 
     def updateDisplay(self):
         """
-        Updates the table display, either to be "By Topic" or "By Message Type"
+        Updates the table display, either to be "By Topic" or "By Message Type". The selection is
+        kept when switching between the two.
         """
-
-        if self.displayByTopic:
-
-            self.clearTable()
-            self.initializeTable(len(self.topics), 3, ("To Export", "Topic", "Message Type"))
-
-            row = 0
-
-            # Getting sorted message types
-            messageTypesSorted = list(self.messageTypes)
-            messageTypesSorted.sort()
-
-            for messageType in messageTypesSorted:
-
-                # Getting the topics of this type of message
-                topicsOfTypeSorted = list(self.messageTypeToTopicsDict[messageType])
-                topicsOfTypeSorted.sort()
-
-                # For each topic that this message type corresponds to
-                for topic in topicsOfTypeSorted:
-
-                    # Setting up checkbox so we can lookup what topic it corresponds to later on
-                    checkbox = QCheckBox()
-                    self.checkboxWidgets[checkbox] = topic
-                    self.setRow(row, checkbox, (topic, messageType))
-                    row += 1
-
-        else:
-
-            self.clearTable()
-            self.initializeTable(len(self.messageTypes), 3, ("To Export", "Message Type", "Topics"))
-
-            row = 0
-
-            # Getting sorted message types
-            messageTypesSorted = list(self.messageTypes)
-            messageTypesSorted.sort()
-
-            for messageType in messageTypesSorted:
-
-                # Getting the topics of this type of message
-                topicsOfTypeSorted = list(self.messageTypeToTopicsDict[messageType])
-                topicsOfTypeSorted.sort()
-
-                # Combining all topics of this message type into one string
-                topicsOfTypeString = ", ".join(topicsOfTypeSorted)
-
-                # Setting up checkbox so we can lookup what message type it corresponds to later on
-                checkbox = QCheckBox()
-                self.checkboxWidgets[checkbox] = messageType
-
-                self.setRow(row, checkbox, (messageType, topicsOfTypeString))
-                row += 1
-
+        self.tableModel.setDisplayByTopic(self.displayByTopic)
 
     def displayRosbags(self, topics, messageTypes, messageTypeToTopicsDict):
         """
@@ -248,7 +372,10 @@ class CentralWidget(QWidget):
         self.messageTypes = messageTypes
         self.messageTypeToTopicsDict = messageTypeToTopicsDict
 
-        self.updateDisplay()
+        self.tableModel.setRosbags(messageTypeToTopicsDict)
+
+        # Resize the table to make sure text fits within the columns
+        self.tableView.resizeColumnsToContents()
 
 
 
@@ -272,6 +399,13 @@ class MainWindow(QMainWindow):
         self.loadBag = QtWidgets.QAction("Load Bagfile(s)", self)
         self.fileMenu.addAction(self.loadBag)
 
+        # Setting up selection profile menu options, profiles can also be used by the command line interface
+        self.fileMenu.addSeparator()
+        self.saveProfile = QtWidgets.QAction("Save Selection Profile", self)
+        self.fileMenu.addAction(self.saveProfile)
+        self.loadProfile = QtWidgets.QAction("Load Selection Profile", self)
+        self.fileMenu.addAction(self.loadProfile)
+
 
     def promptForBagFiles(self):
         """
@@ -282,7 +416,8 @@ class MainWindow(QMainWindow):
         fileChooser.setWindowTitle("Select Bag File(s)")
         fileChooser.setFileMode(QFileDialog.FileMode.ExistingFiles)
         fileChooser.setAcceptMode(QFileDialog.AcceptMode.AcceptOpen)
-        fileChooser.setNameFilter("*.bag")
+        # Rosbags that were never closed (e.g. the recorder crashed) keep the .active suffix, and are reindexed on load
+        fileChooser.setNameFilter(f"*.bag *.bag{ACTIVE_BAG_SUFFIX}")
 
         if fileChooser.exec_():
             return fileChooser.selectedFiles()
@@ -303,27 +438,39 @@ class MainWindow(QMainWindow):
             return fileChooser.selectedFiles()
         return []
 
-    def warning(self, title, msg):
+    def promptForProfileFile(self, save):
+        """
+        Helper function that prompts for a selection profile file to save to or load from
+        """
+        if save:
+            path, _ = QFileDialog.getSaveFileName(self, "Save Selection Profile", "", "*.json")
+        else:
+            path, _ = QFileDialog.getOpenFileName(self, "Load Selection Profile", "", "*.json")
+        return path
+
+    def warning(self, title, msg, details=""):
         """
         Helper function that displays a warning message on screen
         """
-        self._message(title, msg, QMessageBox.Icon.Warning, QMessageBox.StandardButton.Ok)
+        self._message(title, msg, QMessageBox.Icon.Warning, QMessageBox.StandardButton.Ok, details)
 
-    def message(self, title, msg):
+    def message(self, title, msg, details=""):
         """
         Helper function that displays a message on screen
         """
-        self._message(title, msg, QMessageBox.Icon.Information, QMessageBox.StandardButton.Ok)
+        self._message(title, msg, QMessageBox.Icon.Information, QMessageBox.StandardButton.Ok, details)
 
-    def _message(self, title, msg, icon, buttons):
+    def _message(self, title, msg, icon, buttons, details=""):
         """
-        Helper function used to create a QMessageBox
+        Helper function used to create a QMessageBox, with details that are shown when asked for
         """
         messageBox = QMessageBox()
         messageBox.setIcon(icon)
         messageBox.setText(msg)
         messageBox.setWindowTitle(title)
         messageBox.setStandardButtons(buttons)
+        if details != "":
+            messageBox.setDetailedText(details)
         messageBox.exec_()
 
 
@@ -331,6 +478,379 @@ class MainWindow(QMainWindow):
 
 
 
+class ExportProgressDialog(QDialog):
+    """
+    Dialog showing the progress of a running export, per rosbag and overall, along with the
+    throughput so far, an estimated time remaining, and a button to cancel the export
+    """
+
+    # Emitted when the user asks to stop the export (cancel button or closing the dialog)
+    cancelRequested = QtCore.pyqtSignal()
+
+    # Progress bars count in tenths of a percent, since byte counts don't fit in an int
+    PROGRESS_BAR_MAXIMUM = 1000
+
+    def __init__(self, jobs: List[ExportJob], parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle("Exporting Rosbags")
+        self.resize(480, 320)
+
+        # Latest progress of each rosbag
+        self.totalBytes = [sum([self._fileSize(filename) for filename in job.inputFilenames]) for job in jobs]
+        self.bytesRead = [0] * len(jobs)
+        self.messageCounts = [0] * len(jobs)
+
+        self.startTime = time.monotonic()
+        self.isFinished = False
+
+        # One row per rosbag, inside a scroll area so that many rosbags still fit
+        bagsWidget = QWidget()
+        bagsLayout = QGridLayout(bagsWidget)
+        self.bagProgressBars: List[QProgressBar] = []
+
+        for row, job in enumerate(jobs):
+            progressBar = QProgressBar()
+            progressBar.setRange(0, ExportProgressDialog.PROGRESS_BAR_MAXIMUM)
+            self.bagProgressBars.append(progressBar)
+
+            # A merge is shown as the bag it is written to
+            label = os.path.basename(job.outputFilename if len(job.mergedFilenames) > 0 else job.inputFilename)
+            bagsLayout.addWidget(QLabel(label), row, 0)
+            bagsLayout.addWidget(progressBar, row, 1)
+
+        bagsScrollArea = QScrollArea()
+        bagsScrollArea.setWidget(bagsWidget)
+        bagsScrollArea.setWidgetResizable(True)
+
+        # Progress of all rosbags combined
+        self.overallProgressBar = QProgressBar()
+        self.overallProgressBar.setRange(0, ExportProgressDialog.PROGRESS_BAR_MAXIMUM)
+
+        # Throughput and time remaining
+        self.statsLabel = QLabel()
+
+        self.cancelButton = QPushButton("Cancel")
+        self.cancelButton.clicked.connect(self.requestCancel)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(bagsScrollArea)
+        layout.addWidget(QLabel("Overall:"))
+        layout.addWidget(self.overallProgressBar)
+        layout.addWidget(self.statsLabel)
+        layout.addWidget(self.cancelButton)
+        self.setLayout(layout)
+
+        self.updateStats()
+
+    def updateProgress(self, progress: ExportProgress):
+        """
+        Slot that takes in a progress update for one of the rosbags
+        """
+        self.totalBytes[progress.jobIndex] = progress.totalBytes
+        self.bytesRead[progress.jobIndex] = progress.bytesRead
+        self.messageCounts[progress.jobIndex] = progress.messageCount
+
+        self.bagProgressBars[progress.jobIndex].setValue(self._scaled(progress.bytesRead, progress.totalBytes))
+        self.updateStats()
+
+    def markFinished(self, jobIndex, result: ExportResult):
+        """
+        Slot for when one of the rosbags is done exporting, successfully or not
+        """
+        progressBar = self.bagProgressBars[jobIndex]
+
+        # Failed and cancelled rosbags don't count towards the overall progress
+        if result.success:
+            self.bytesRead[jobIndex] = self.totalBytes[jobIndex]
+            progressBar.setValue(ExportProgressDialog.PROGRESS_BAR_MAXIMUM)
+        else:
+            self.totalBytes[jobIndex] = self.bytesRead[jobIndex]
+
+        progressBar.setFormat(f"%p% {result.status}")
+        self.updateStats()
+
+    def updateStats(self):
+        """
+        Updates the overall progress bar and the throughput/time remaining text
+        """
+        totalBytes = sum(self.totalBytes)
+        bytesRead = sum(self.bytesRead)
+        elapsedSeconds = max(time.monotonic() - self.startTime, 1e-6)
+
+        self.overallProgressBar.setValue(self._scaled(bytesRead, totalBytes))
+
+        bytesPerSecond = bytesRead / elapsedSeconds
+        messagesPerSecond = sum(self.messageCounts) / elapsedSeconds
+
+        if bytesPerSecond > 0:
+            eta = str(timedelta(seconds=int((totalBytes - bytesRead) / bytesPerSecond)))
+        else:
+            eta = "unknown"
+
+        self.statsLabel.setText(f"{bytesPerSecond / 1e6:.1f} MB/s, {messagesPerSecond:.0f} messages/s, ETA {eta}")
+
+    def requestCancel(self):
+        """
+        Asks for the export to be cancelled. The dialog stays open until it has actually stopped.
+        """
+        self.cancelButton.setDisabled(True)
+        self.cancelButton.setText("Cancelling...")
+        self.cancelRequested.emit()
+
+    def finish(self):
+        """
+        Closes the dialog once the export is over
+        """
+        self.isFinished = True
+        self.close()
+
+    def closeEvent(self, event):
+        """
+        Closing the dialog while the export is still running cancels the export
+        """
+        if self.isFinished:
+            event.accept()
+            return
+
+        event.ignore()
+        if self.cancelButton.isEnabled():
+            self.requestCancel()
+
+    def reject(self):
+        """
+        Pressing escape behaves the same as closing the dialog
+        """
+        self.close()
+
+    @classmethod
+    def _scaled(cls, value, total) -> int:
+        if total <= 0:
+            return ExportProgressDialog.PROGRESS_BAR_MAXIMUM
+        return int(ExportProgressDialog.PROGRESS_BAR_MAXIMUM * min(value, total) / total)
+
+    @classmethod
+    def _fileSize(cls, path) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+
+class ReindexProgressDialog(QDialog):
+    """
+    Dialog showing the progress of rebuilding the index of each unindexed rosbag while loading
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle("Reindexing Rosbags")
+        self.resize(480, 160)
+
+        # Path of each rosbag being reindexed -> its progress bar
+        self.progressBars: Dict[str, QProgressBar] = {}
+
+        # One row per rosbag, added as each one starts, inside a scroll area so that many rosbags still fit
+        bagsWidget = QWidget()
+        self.bagsLayout = QGridLayout(bagsWidget)
+
+        bagsScrollArea = QScrollArea()
+        bagsScrollArea.setWidget(bagsWidget)
+        bagsScrollArea.setWidgetResizable(True)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("Rebuilding the index of rosbags that were never closed:"))
+        layout.addWidget(bagsScrollArea)
+        self.setLayout(layout)
+
+    def updateProgress(self, progress: ReindexProgress):
+        """
+        Slot that takes in a progress update for one of the rosbags
+        """
+        progressBar = self.progressBars.get(progress.filename)
+        if progressBar is None:
+            progressBar = self.progressBars[progress.filename] = QProgressBar()
+            progressBar.setRange(0, ExportProgressDialog.PROGRESS_BAR_MAXIMUM)
+
+            row = len(self.progressBars) - 1
+            self.bagsLayout.addWidget(QLabel(os.path.basename(progress.filename)), row, 0)
+            self.bagsLayout.addWidget(progressBar, row, 1)
+
+        progressBar.setValue(ExportProgressDialog._scaled(progress.bytesRead, progress.totalBytes))
+
+
+class ExportWorker(QtCore.QObject):
+    """
+    Runs the export jobs on a background QThread, passing progress back to the UI through signals
+    """
+
+    # ExportProgress for one of the rosbags
+    progress = QtCore.pyqtSignal(object)
+    # Index of the job and its ExportResult
+    bagFinished = QtCore.pyqtSignal(int, object)
+    # List of ExportResults, one per job
+    finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, jobs: List[ExportJob], maxWorkers, cancelEvent: threading.Event):
+        super().__init__()
+        self.jobs = jobs
+        self.maxWorkers = maxWorkers
+        self.cancelEvent = cancelEvent
+
+    def run(self):
+        """
+        Exports every job, returning once they are all done or cancelled. finished is always
+        emitted, with every job that didn't get to finish failed if the export itself fails
+        (e.g. when the worker processes can't be started).
+        """
+        # Job index -> ExportResult, for the jobs that have finished so far
+        finishedResults: Dict[int, ExportResult] = {}
+
+        def onBagFinished(jobIndex, result: ExportResult):
+            finishedResults[jobIndex] = result
+            self.bagFinished.emit(jobIndex, result)
+
+        try:
+            results = exportBagsInParallel(
+                self.jobs,
+                maxWorkers=self.maxWorkers,
+                progressCallback=self.progress.emit,
+                resultCallback=onBagFinished,
+                cancelEvent=self.cancelEvent,
+            )
+        except Exception as error:
+            results = []
+            for jobIndex, job in enumerate(self.jobs):
+                result = finishedResults.get(jobIndex)
+                if result is None:
+                    result = ExportResult(job.inputFilename, job.outputFilename, False, error=f"Export failed: {error}")
+                    self.bagFinished.emit(jobIndex, result)
+                results.append(result)
+
+        self.finished.emit(results)
+
+
+class ExportEstimateWorker(QtCore.QObject):
+    """
+    Estimates what export jobs would write on a background QThread, since it reads the index
+    records of every chunk
+    """
+
+    # ExportEstimate of the jobs
+    finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, jobs: List[ExportJob], saveDirectory, parallelExports, cache: MetadataCache, history: ExportHistory):
+        super().__init__()
+        self.jobs = jobs
+        self.saveDirectory = saveDirectory
+        self.parallelExports = parallelExports
+        self.cache = cache
+        self.history = history
+
+    def run(self):
+        """
+        Estimates the jobs. finished is always emitted, with an estimate saying why if there
+        isn't one (e.g. when the export history can't be read).
+        """
+        try:
+            estimate = estimateExport(self.jobs, self.saveDirectory, self.parallelExports, self.cache, self.history)
+        except Exception as error:
+            estimate = ExportEstimate([], error=str(error))
+        self.finished.emit(estimate)
+
+
+class TopicStatsWorker(QtCore.QObject):
+    """
+    Works out the topic statistics of rosbag files on a background QThread, passing each rosbag's
+    statistics back to the UI as soon as they are known
+    """
+
+    # Path of a rosbag, and its topic -> TopicStats
+    statsLoaded = QtCore.pyqtSignal(str, object)
+    # Path of a rosbag whose statistics couldn't be worked out (e.g. older than format 2.0), and why
+    statsFailed = QtCore.pyqtSignal(str, str)
+    # Emitted once every rosbag is done (or the worker was cancelled)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, bagFilePaths: List[str], cache: MetadataCache):
+        super().__init__()
+        self.bagFilePaths = bagFilePaths
+        self.cache = cache
+        self.cancelEvent = threading.Event()
+
+    def run(self):
+        """
+        Works out the statistics of every rosbag, several at a time. finished is always emitted,
+        with every rosbag that wasn't done failed if working them out fails as a whole.
+        """
+        # Rosbags whose statistics have been worked out or have failed so far
+        reportedPaths = set()
+
+        def onStatsLoaded(bagFilePath, topicStats):
+            reportedPaths.add(bagFilePath)
+            self.statsLoaded.emit(bagFilePath, topicStats)
+
+        def onStatsFailed(bagFilePath, error):
+            reportedPaths.add(bagFilePath)
+            self.statsFailed.emit(bagFilePath, error)
+
+        try:
+            readTopicStatsConcurrently(self.bagFilePaths, onStatsLoaded, onStatsFailed, cache=self.cache, cancelEvent=self.cancelEvent)
+        except Exception as error:
+            for bagFilePath in self.bagFilePaths:
+                if bagFilePath not in reportedPaths and not self.cancelEvent.is_set():
+                    self.statsFailed.emit(bagFilePath, f"Reading topic statistics failed: {error}")
+        finally:
+            self.finished.emit()
+
+
+class BagLoadWorker(QtCore.QObject):
+    """
+    Reads rosbag files on a background QThread, passing each one back to the UI as soon as it is read
+    """
+
+    # RosbagData of a rosbag that was read
+    bagLoaded = QtCore.pyqtSignal(object)
+    # Path of a rosbag that couldn't be read, and why
+    bagFailed = QtCore.pyqtSignal(str, str)
+    # ReindexProgress of an unindexed rosbag whose index is being rebuilt
+    reindexProgress = QtCore.pyqtSignal(object)
+    # Emitted once every rosbag has been read or has failed
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, bagFilePaths: List[str], cache: MetadataCache):
+        super().__init__()
+        self.bagFilePaths = bagFilePaths
+        self.cache = cache
+
+    def run(self):
+        """
+        Reads every rosbag, several at a time, rebuilding the indexes of unindexed ones first.
+        finished is always emitted, with every rosbag that wasn't read failed if loading itself
+        fails (e.g. when the worker processes can't be started).
+        """
+        # Rosbags that have been read or have failed so far
+        reportedPaths = set()
+
+        def onBagLoaded(rosbagData: RosbagData):
+            reportedPaths.add(rosbagData.filename)
+            self.bagLoaded.emit(rosbagData)
+
+        def onBagFailed(bagFilePath, error):
+            reportedPaths.add(bagFilePath)
+            self.bagFailed.emit(bagFilePath, error)
+
+        try:
+            readRosbagDataConcurrently(self.bagFilePaths, onBagLoaded, onBagFailed, cache=self.cache, reindexProgressCallback=self.reindexProgress.emit)
+        except Exception as error:
+            for bagFilePath in self.bagFilePaths:
+                if bagFilePath not in reportedPaths:
+                    self.bagFailed.emit(bagFilePath, f"Loading failed: {error}")
+        finally:
+            self.finished.emit()
+
+
 class Controller:
     """
     Main controller behind this application. Part of a MVC design, except the Model is basically the 
@@ -345,6 +865,10 @@ class Controller:
         WAITING_FOR_FILE = 0
         SELECTING_TOPICS = 1
         EXPORTING = 2
+        LOADING = 3
+
+    # Minimum time between table refreshes while rosbags are loading
+    DISPLAY_REFRESH_INTERVAL_MS = 200
 
 
     def __init__(self):
@@ -353,8 +877,34 @@ class Controller:
 
         # Connecting callback for when the load button is pressed
         self.view.loadBag.triggered.connect(self.loadBag)
+        # Connecting callbacks for the selection profile menu options
+        self.view.saveProfile.triggered.connect(self.saveProfile)
+        self.view.loadProfile.triggered.connect(self.loadProfile)
         # Connecting callback for when the export button is pressed
         self.view.mainWidget.exportButton.clicked.connect(self.export)
+        # Connecting callback for when the preview button is pressed
+        self.view.mainWidget.previewButton.clicked.connect(self.preview)
+
+        # Index information of rosbags that have been opened before
+        self.metadataCache = MetadataCache()
+        # Throughput of earlier exports, which export times are estimated from
+        self.exportHistory = ExportHistory()
+
+        # Threads running the current export/preview/load/topic statistics, if there is one
+        self.exportThread = None
+        self.previewThread = None
+        self.loadThread = None
+        self.statsThread = None
+        self.statsWorker = None
+        # Progress of rebuilding the indexes of unindexed rosbags while loading, once there are any
+        self.reindexDialog = None
+
+        # While loading, the table is refreshed with this timer instead of after every single rosbag
+        self.displayRefreshTimer = QtCore.QTimer()
+        self.displayRefreshTimer.setSingleShot(True)
+        self.displayRefreshTimer.setInterval(Controller.DISPLAY_REFRESH_INTERVAL_MS)
+        self.displayRefreshTimer.timeout.connect(self.refreshDisplay)
+        QApplication.instance().aboutToQuit.connect(self.onAboutToQuit)
 
         # Transition states to be waiting for a file(s)
         self.__transition(Controller.State.WAITING_FOR_FILE)
@@ -365,13 +915,18 @@ class Controller:
         UI elements in the view
         """
 
+        self.state = state
+
         if state == Controller.State.WAITING_FOR_FILE:
             # Only allow the user to select a file from the menu bar
             self.view.menuBar().setDisabled(False)
 
             # Disable everything else
             self.view.mainWidget.exportButton.setDisabled(True)
+            self.view.mainWidget.previewButton.setDisabled(True)
+            self.view.mainWidget.exportOptions.setDisabled(True)
             self.view.mainWidget.invertSelectionButton.setDisabled(True)
+            self.view.mainWidget.searchOptions.setDisabled(True)
 
             self.view.mainWidget.byTopicRadioButton.setDisabled(True)
             self.view.mainWidget.byMessageTypeRadioButton.setDisabled(True)
@@ -383,19 +938,25 @@ class Controller:
             self.view.menuBar().setDisabled(False)
 
             self.view.mainWidget.exportButton.setDisabled(False)
+            self.view.mainWidget.previewButton.setDisabled(False)
+            self.view.mainWidget.exportOptions.setDisabled(False)
             self.view.mainWidget.invertSelectionButton.setDisabled(False)
+            self.view.mainWidget.searchOptions.setDisabled(False)
 
             self.view.mainWidget.byTopicRadioButton.setDisabled(False)
             self.view.mainWidget.byMessageTypeRadioButton.setDisabled(False)
 
             self.view.mainWidget.setDisableCheckboxes(False)
 
-        elif state == Controller.State.EXPORTING:
-            # Disable everything while exporting
+        elif state == Controller.State.EXPORTING or state == Controller.State.LOADING:
+            # Disable everything while exporting or loading
             self.view.menuBar().setDisabled(True)
 
             self.view.mainWidget.exportButton.setDisabled(True)
+            self.view.mainWidget.previewButton.setDisabled(True)
+            self.view.mainWidget.exportOptions.setDisabled(True)
             self.view.mainWidget.invertSelectionButton.setDisabled(True)
+            self.view.mainWidget.searchOptions.setDisabled(True)
 
             self.view.mainWidget.byTopicRadioButton.setDisabled(True)
             self.view.mainWidget.byMessageTypeRadioButton.setDisabled(True)
@@ -414,12 +975,66 @@ class Controller:
         Exports the rosbag files with their filtered topics
         """
 
+        # Asks where to save the rosbags, and creates the jobs exporting them
+        exportJobs = self.createExportJobs("File Export Failed")
+        if exportJobs is None:
+            return None
+
+        jobs, bagFileSavePath = exportJobs
+
+        # Transition to exporting state so that the user cannot break anything with the UI
+        self.__transition(Controller.State.EXPORTING)
+
+        self.exportSavePath = bagFileSavePath
+
+        # Set by the progress dialog to stop the export early
+        self.exportCancelEvent = threading.Event()
+
+        self.exportDialog = ExportProgressDialog(jobs, self.view)
+        self.exportDialog.cancelRequested.connect(self.exportCancelEvent.set)
+
+        # Export the rosbags in parallel on a background thread, across as many processes as the user allows,
+        # so the UI keeps responding
+        self.exportWorker = ExportWorker(jobs, self.view.mainWidget.parallelExportsSpinBox.value(), self.exportCancelEvent)
+        self.exportThread = QtCore.QThread()
+        self.exportWorker.moveToThread(self.exportThread)
+
+        self.exportThread.started.connect(self.exportWorker.run)
+        self.exportWorker.progress.connect(self.exportDialog.updateProgress)
+        self.exportWorker.bagFinished.connect(self.exportDialog.markFinished)
+        self.exportWorker.finished.connect(self.onExportFinished)
+
+        self.exportDialog.show()
+        self.exportThread.start()
+
+    def createExportJobs(self, failureTitle):
+        """
+        Checks the selected topics and export settings, then asks for the directory to save to.
+        Returns the export jobs and the directory, or None (after warning the user) if there is
+        nothing to export.
+        """
+
         # Gets the topics to save from the view based on user selection
         exporting_topics = self.view.mainWidget.getSelectedTopics()
 
         # If the user selected no topics, lets not waste time and export empty rosbag files
         if len(exporting_topics) < 1:
-            self.view.warning("File Export Failed", "No Topics were selected to export")
+            self.view.warning(failureTitle, "No Topics were selected to export")
+            return None
+
+        # Gets the export settings, e.g. the time window
+        try:
+            exportOptions = self.view.mainWidget.getExportOptions()
+        except ValueError:
+            self.view.warning(failureTitle, "Time window and split sizes must be numbers")
+            return None
+
+        if exportOptions.startTime is not None and exportOptions.endTime is not None and exportOptions.startTime > exportOptions.endTime:
+            self.view.warning(failureTitle, "Time window must start before it ends")
+            return None
+
+        if (exportOptions.splitBytes is not None and exportOptions.splitBytes <= 0) or (exportOptions.splitSeconds is not None and exportOptions.splitSeconds <= 0):
+            self.view.warning(failureTitle, "Outputs can only be split at a positive size/duration")
             return None
 
         # Get save directory
@@ -427,7 +1042,7 @@ class Controller:
 
         # If the user selected more than one directory (should never happen), don't proceed with exporting
         if len(bagFileSavePathList) != 1:
-            self.view.warning("File Export Failed", "Can only select one directory to save to")
+            self.view.warning(failureTitle, "Can only select one directory to save to")
             return None
 
         # The save location method returns a list of files/directories, so just get the 1st and only one
@@ -435,44 +1050,213 @@ class Controller:
 
         # If the path is empty, we cannot save there
         if bagFileSavePath == "":
-            self.view.warning("File Export Failed", "Need to select save locataion in order to export bag files")
+            self.view.warning(failureTitle, "Need to select save locataion in order to export bag files")
             return None
 
-        # Transition to exporting state so that the user cannot break anything with the UI
-        self.__transition(Controller.State.EXPORTING)
+        # One export job per rosbag, or a single job merging all of them
+        jobs: List[ExportJob] = []
 
+        # Split outputs are numbered instead of timestamped, so exporting again gives the same names
+        exportTime = None if exportOptions.splits() else datetime.now()
 
-        # Iterate through rosbags and export them
-        for rosbag in self.rosbags:
+        if self.view.mainWidget.mergeCheckBox.isChecked():
+            bagFilenames = [rosbag.filename for rosbag in self.rosbags]
+            mergedBagFile = mergedBagFilename(bagFilenames, bagFileSavePath, exportTime)
+            jobs.append(ExportJob(bagFilenames[0], mergedBagFile, exporting_topics, exportOptions, mergedFilenames=bagFilenames[1:]))
+        else:
+            for rosbag in self.rosbags:
 
-            # Gets the filename (without the path) of the rosbag file, removes the file extension, and appends a suffix to indicate that it has been filtered
-            filename = "".join(os.path.basename(rosbag.filename).split(".")[:-1]) + "_filtered_" + datetime.now().strftime("%Y_%m_%d-%I:%M:%S_%p") + ".bag"
-            bagFileSavePathIncludingFile = os.path.join(bagFileSavePath, filename)
+                bagFileSavePathIncludingFile = filteredBagFilename(rosbag.filename, bagFileSavePath, exportTime)
 
-            # Generate command to execute
-            command = self.generate_rosbag_filter_command(rosbag.filename, bagFileSavePathIncludingFile, exporting_topics)
-            commandStr = " ".join(command)
+                jobs.append(ExportJob(rosbag.filename, bagFileSavePathIncludingFile, exporting_topics, exportOptions))
 
-            # Print the command we are running incase the user wants to copy it
-            print(commandStr)
+        return jobs, bagFileSavePath
 
-            # Run's command
-            os.system(commandStr)
+    def preview(self):
+        """
+        Callback for the preview button. Estimates how many messages and bytes each output rosbag
+        would get, and how long exporting would take, without writing anything
+        """
+
+        exportJobs = self.createExportJobs("Export Preview Failed")
+        if exportJobs is None:
+            return None
+
+        jobs, bagFileSavePath = exportJobs
 
-        self.view.message("Success", f"Rosbag exported successfully: {bagFileSavePath}")
+        # Nothing is written, but the settings shouldn't change while they are being estimated
+        self.__transition(Controller.State.LOADING)
 
+        # Every chunk's index records are read, which can take a while on network storage, so do it in the background
+        self.previewWorker = ExportEstimateWorker(jobs, bagFileSavePath, self.view.mainWidget.parallelExportsSpinBox.value(), self.metadataCache, self.exportHistory)
+        self.previewThread = QtCore.QThread()
+        self.previewWorker.moveToThread(self.previewThread)
+
+        self.previewThread.started.connect(self.previewWorker.run)
+        self.previewWorker.finished.connect(self.onPreviewFinished)
+
+        self.previewThread.start()
+
+    def onPreviewFinished(self, estimate: ExportEstimate):
+        """
+        Callback for when the export has been estimated. Shows the estimate, as a warning if the
+        outputs won't fit in the save directory
+        """
+
+        self.previewThread.quit()
+        self.previewThread.wait()
+        self.previewThread = None
+
+        self.__transition(Controller.State.SELECTING_TOPICS)
+
+        if estimate.error != "":
+            self.view.warning("Export Preview", f"Estimate unavailable: {estimate.error}")
+            return
+
+        summary = self.summarizeExportEstimate(estimate)
+        # Every output rosbag, e.g. "run1_filtered.bag: 1234 messages, 12.3 MB"
+        details = "\n".join([self.summarizeJobEstimate(jobEstimate) for jobEstimate in estimate.jobs])
+
+        if not estimate.hasEnoughSpace():
+            self.view.warning("Not Enough Free Space", f"The export would not fit in the save directory:\n{summary}", details)
+        elif any([jobEstimate.error != "" for jobEstimate in estimate.jobs]):
+            self.view.warning("Export Preview", f"Some rosbag(s) could not be estimated:\n{summary}", details)
+        else:
+            self.view.message("Export Preview", summary, details)
+
+    @classmethod
+    def summarizeExportEstimate(cls, estimate: ExportEstimate) -> str:
+        """
+        Creates a summary of what an export is expected to write, and how long it should take
+        """
+        outputCount = sum([len(jobEstimate.outputs) for jobEstimate in estimate.jobs])
+        lines = [f"{outputCount} rosbag(s), {estimate.messageCount} messages, about {estimate.fileBytes / 1e6:.1f} MB"]
+
+        if any([jobEstimate.hasPredicates for jobEstimate in estimate.jobs]):
+            lines.append("Messages dropped by predicates are still counted")
+
+        if estimate.seconds is None:
+            lines.append("Time: unknown until an export with the same compression has been run")
+        elif estimate.seconds < 1:
+            lines.append("Time: under a second (going by earlier exports)")
+        else:
+            lines.append(f"Time: about {timedelta(seconds=int(round(estimate.seconds)))} (going by earlier exports)")
+
+        if estimate.freeBytes is not None:
+            lines.append(f"Free space: {estimate.freeBytes / 1e6:.1f} MB")
+
+        return "\n".join(lines)
+
+    @classmethod
+    def summarizeJobEstimate(cls, jobEstimate: JobEstimate) -> str:
+        """
+        Creates a line per output rosbag of a job, or a line saying why the job couldn't be estimated
+        """
+        if jobEstimate.error != "":
+            return f"{os.path.basename(jobEstimate.inputFilenames[0])}: {jobEstimate.error}"
+
+        return "\n".join([
+            f"{os.path.basename(output.filename)}: {output.messageCount} messages, {output.fileBytes / 1e6:.1f} MB"
+            for output in jobEstimate.outputs
+        ])
+
+    def onExportFinished(self, results: List[ExportResult]):
+        """
+        Callback for when the background export is done, whether it finished, failed or was cancelled
+        """
+
+        self.exportThread.quit()
+        self.exportThread.wait()
+        self.exportDialog.finish()
+
+        profiling.report(profiling.mergeProfiles([profiling.takeProfile()] + [result.profile for result in results]), "Export profile", "export")
+
+        # Cancelling on purpose means the partial exports aren't wanted, unlike a failure or closing
+        # the application mid-export (which leave them to be resumed by exporting again)
+        if self.exportCancelEvent.is_set():
+            for result in results:
+                discardPartialExport(result)
+
+        # Summary of every bag, e.g. "run1.bag: OK, 12.3 MB in 4.5 s"
+        summary = "\n".join([self.summarizeExportResult(result) for result in results])
+
+        failedExports = [result for result in results if not result.success]
+        if self.exportCancelEvent.is_set():
+            self.view.warning("File Export Cancelled", f"Export was cancelled, partially exported rosbags were removed:\n{summary}")
+        elif len(failedExports) > 0:
+            self.view.warning("File Export Failed", f"{len(failedExports)} of {len(results)} rosbag(s) failed to export:\n{summary}")
+        else:
+            self.view.message("Success", f"Rosbag exported successfully: {self.exportSavePath}\n{summary}")
+
+        self.exportThread = None
 
         # Transition back to selecting topics state to let the user use the UI again
         self.__transition(Controller.State.SELECTING_TOPICS)
 
+    def onAboutToQuit(self):
+        """
+        Stops a running export before the application exits (leaving rosbags that were partially
+        exported to be resumed by exporting them again), and waits for any rosbags still loading
+        """
+        if self.exportThread is not None:
+            self.exportCancelEvent.set()
+            self.exportThread.wait()
+
+        if self.loadThread is not None:
+            self.loadThread.wait()
+
+        if self.previewThread is not None:
+            self.previewThread.wait()
+
+        self.stopTopicStats()
+
     @classmethod
-    def generate_rosbag_filter_command(cls, inputBagFile, outputBagFile, topics) -> List[str]:
+    def summarizeExportResult(cls, result: ExportResult) -> str:
         """
-        Creates a command from input variables in the format required for command line tool
+        Creates a one line summary of how exporting a single rosbag went
         """
-        filterArgs = " or ".join([f"topic == '{topic}'" for topic in topics])
-        cmd = ["rosbag", "filter", inputBagFile, outputBagFile, f"\"{filterArgs}\""]
-        return cmd
+        filename = os.path.basename(result.inputFilename)
+
+        if not result.success:
+            resumable = "" if result.checkpointFilename is None else " (export again to resume it)"
+            return f"{filename}: {result.status}, {result.error}{resumable}"
+
+        if result.skipped:
+            outputFilenames = ", ".join([os.path.basename(outputFilename) for outputFilename in result.outputFilenames])
+            return f"{filename}: {result.status}, its earlier export is unchanged: {outputFilenames} (remove it to export again)"
+
+        resumed = " (resumed)" if result.resumed else ""
+        return f"{filename}: {result.status}{resumed}, {result.bytesWritten / 1e6:.1f} MB in {result.elapsedSeconds:.1f} s"
+
+    def saveProfile(self):
+        """
+        Callback for the save selection profile menu option. Saves the selected topics to a file
+        """
+        profilePath = self.view.promptForProfileFile(save=True)
+        if profilePath == "":
+            return None
+
+        try:
+            SelectionProfile(topics=self.view.mainWidget.getSelectedTopics()).save(profilePath)
+        except OSError as error:
+            self.view.warning("Saving Profile Failed", str(error))
+
+    def loadProfile(self):
+        """
+        Callback for the load selection profile menu option. Selects the topics matching a profile
+        """
+        profilePath = self.view.promptForProfileFile(save=False)
+        if profilePath == "":
+            return None
+
+        try:
+            profile = SelectionProfile.load(profilePath)
+            selectedTopics = profile.selectTopics(self.view.mainWidget.messageTypeToTopicsDict)
+        except (OSError, ValueError, re.error) as error:
+            self.view.warning("Loading Profile Failed", str(error))
+            return None
+
+        self.view.mainWidget.tableModel.setSelectedTopics(selectedTopics)
 
     def loadBag(self):
         """
@@ -492,68 +1276,202 @@ class Controller:
         # Keeps track of every single topic we find in all selected rosbag files
         self.allTopics: Set[str] = set()
         # Keeps track of every single message type we find in all selected rosbag files
-        allMessageTypes: Set[str] = set()
+        self.allMessageTypes: Set[str] = set()
         # Keeps track of a map between message type and every single topic that corresponds to that message type
-        allMessageTypesToTopicsDict: Dict[str, Set[str]] = dict()
+        self.allMessageTypesToTopicsDict: Dict[str, Set[str]] = dict()
+        # Keeps track of the files that couldn't be loaded, and why
+        self.failedBagFiles: List[str] = []
+
+        # Statistics of the previously loaded rosbags are no longer wanted
+        self.stopTopicStats()
+        self.allTopicStats: Dict[str, TopicStats] = dict()
+        self.view.mainWidget.tableModel.setTopicStats(self.allTopicStats)
+
+        # Clear out whatever was loaded before
+        self.view.mainWidget.displayRosbags(self.allTopics, self.allMessageTypes, self.allMessageTypesToTopicsDict)
+
+        # Transition to loading state so that the user cannot break anything with the UI
+        self.__transition(Controller.State.LOADING)
+
+        # Read the rosbag files on a background thread, several at a time, so the UI keeps responding
+        self.loadWorker = BagLoadWorker(bagFilePaths, self.metadataCache)
+        self.loadThread = QtCore.QThread()
+        self.loadWorker.moveToThread(self.loadThread)
+
+        self.loadThread.started.connect(self.loadWorker.run)
+        self.loadWorker.bagLoaded.connect(self.onBagLoaded)
+        self.loadWorker.bagFailed.connect(self.onBagFailed)
+        self.loadWorker.reindexProgress.connect(self.onReindexProgress)
+        self.loadWorker.finished.connect(self.onLoadFinished)
+
+        self.loadThread.start()
 
-        # Iterating through each selected rosbag file
-        for bagFilePath in bagFilePaths:
+    def onBagLoaded(self, rosbagData: RosbagData):
+        """
+        Callback for when one of the rosbag files has been read. Merges its topics and message types
+        into the ones already loaded
+        """
+
+        # Adds all topics in this rosbag to the set "allTopics"
+        self.allTopics.update(rosbagData.topics)
+        self.allMessageTypes.update(rosbagData.messageTypes)
 
-            # Parse file
-            bag = rosbag.Bag(bagFilePath)
+        for messageType, topics in rosbagData.messageTypesToTopicsDict.items():
 
-            # Dictionary of topic -> topic information
-            topicDict = bag.get_type_and_topic_info()[1]
-            topics = [str(key) for key in topicDict.keys()]
-            topics.sort()
-            topics = tuple(topics)
+            if messageType not in self.allMessageTypesToTopicsDict.keys():
+                self.allMessageTypesToTopicsDict[messageType] = set()
 
-            # Adds all topics in "topics" to the set "alltopics"
-            self.allTopics.update(topics)
+            self.allMessageTypesToTopicsDict[messageType].update(topics)
 
-            # Dictionary of message type -> topic name
-            messageTypeDict : Dict[str, List[str]]= {}
+        # Store rosbag
+        self.rosbags.append(rosbagData)
 
-            # Populating messageTypeDict
-            for topic in topics:
-                messageType = topicDict[topic].msg_type
+        # Fill in the table shortly, along with any other rosbags that finish in the meantime
+        if not self.displayRefreshTimer.isActive():
+            self.displayRefreshTimer.start()
 
-                if messageType not in allMessageTypesToTopicsDict.keys():
-                    allMessageTypesToTopicsDict[messageType] = set()
+    def onReindexProgress(self, progress: ReindexProgress):
+        """
+        Callback for progress rebuilding the index of an unindexed rosbag, shown in a dialog that
+        only opens once there is one
+        """
+        if self.reindexDialog is None:
+            self.reindexDialog = ReindexProgressDialog(self.view)
+            self.reindexDialog.show()
+        self.reindexDialog.updateProgress(progress)
 
-                allMessageTypesToTopicsDict[messageType].add(topic)
+    def onBagFailed(self, bagFilePath, error):
+        """
+        Callback for when one of the rosbag files could not be read
+        """
+        self.failedBagFiles.append(f"{bagFilePath}: {error}")
 
+    def refreshDisplay(self):
+        """
+        Displays every rosbag loaded so far in the view
+        """
+        self.view.mainWidget.displayRosbags(self.allTopics, self.allMessageTypes, self.allMessageTypesToTopicsDict)
 
-                # If this is the first topic that we have found to be publishing this type of message
-                if messageType not in messageTypeDict.keys():
-                    messageTypeDict[messageType] = []
+        # The table was rebuilt, so make sure its checkboxes match the current state
+        self.__transition(self.state)
 
-                messageTypeDict[messageType].append(topic)
+    def onLoadFinished(self):
+        """
+        Callback for when every rosbag file has been read or has failed
+        """
 
-            # Get sorted messageTypes as tuple
-            messageTypes = [str(key) for key in messageTypeDict.keys()]
-            messageTypes.sort()
-            messageTypes = tuple(messageTypes)
+        self.loadThread.quit()
+        self.loadThread.wait()
+        self.loadThread = None
 
-            allMessageTypes.update(messageTypes)
+        if self.reindexDialog is not None:
+            self.reindexDialog.close()
+            self.reindexDialog = None
 
-            # Store rosbag 
-            self.rosbags.append(RosbagData(bagFilePath, topics, messageTypes, messageTypeDict))
+        profiling.report(profiling.takeProfile(), "Load profile", "load")
 
         # Display rosbag in view
-        self.view.mainWidget.displayRosbags(self.allTopics, allMessageTypes, allMessageTypesToTopicsDict)
+        self.displayRefreshTimer.stop()
+        self.view.mainWidget.displayRosbags(self.allTopics, self.allMessageTypes, self.allMessageTypesToTopicsDict)
 
-        # Transition to allow the user to now select topics
-        self.__transition(Controller.State.SELECTING_TOPICS)
+        if len(self.rosbags) > 0:
+            # Transition to allow the user to now select topics
+            self.__transition(Controller.State.SELECTING_TOPICS)
+        else:
+            self.__transition(Controller.State.WAITING_FOR_FILE)
+
+        # The table is shown now, and its statistics columns are filled in as they are worked out
+        self.startTopicStats()
+
+        if len(self.failedBagFiles) > 0:
+            failureDetails = "\n".join(self.failedBagFiles)
+            self.view.warning("File Open Failed", f"{len(self.failedBagFiles)} rosbag(s) could not be loaded:\n{failureDetails}")
+
+    def startTopicStats(self):
+        """
+        Starts working out the topic statistics of the loaded rosbags in the background
+        """
+        if len(self.rosbags) == 0:
+            return
+
+        # Rosbags whose statistics haven't come in yet, and topics whose statistics can't be known
+        self.statsPendingBagFiles: Set[str] = set([rosbag.filename for rosbag in self.rosbags])
+        self.topicsWithoutStats: Set[str] = set()
+        # Rosbags whose statistics couldn't be worked out, with why, e.g. "run1.bag: ..."
+        self.statsFailedBagFiles: List[str] = []
+
+        self.statsWorker = TopicStatsWorker(sorted(self.statsPendingBagFiles), self.metadataCache)
+        self.statsThread = QtCore.QThread()
+        self.statsWorker.moveToThread(self.statsThread)
 
-@dataclass
-class RosbagData:
-    filename: str
-    topics: Tuple[str, ...]
-    messageTypes: Tuple[str, ...]
-    messageTypesToTopicsDict: Dict[str, List[str]]
-    exporting: bool = False
+        self.statsThread.started.connect(self.statsWorker.run)
+        self.statsWorker.statsLoaded.connect(self.onTopicStatsLoaded)
+        self.statsWorker.statsFailed.connect(self.onTopicStatsFailed)
+        self.statsWorker.finished.connect(self.statsThread.quit)
+        self.statsWorker.finished.connect(self.onTopicStatsFinished)
+
+        self.statsThread.start()
+
+    def stopTopicStats(self):
+        """
+        Stops working out topic statistics, waiting for the rosbags already being read
+        """
+        if self.statsThread is None:
+            return
+
+        self.statsWorker.cancelEvent.set()
+        self.statsWorker.statsLoaded.disconnect(self.onTopicStatsLoaded)
+        self.statsWorker.statsFailed.disconnect(self.onTopicStatsFailed)
+        self.statsWorker.finished.disconnect(self.onTopicStatsFinished)
+        self.statsThread.quit()
+        self.statsThread.wait()
+        self.statsThread = None
+        self.statsWorker = None
+
+    def onTopicStatsLoaded(self, bagFilePath, topicStats: Dict[str, TopicStats]):
+        """
+        Callback for when the statistics of one of the rosbags are known. Adds them to the totals
+        of each topic, which the table shows once every rosbag with that topic is done
+        """
+        for topic, stats in topicStats.items():
+            self.allTopicStats.setdefault(topic, TopicStats()).add(stats)
+
+        self.statsPendingBagFiles.discard(bagFilePath)
+        self.refreshTopicStats()
+
+    def onTopicStatsFailed(self, bagFilePath, error):
+        """
+        Callback for when the statistics of one of the rosbags can't be worked out, which leaves
+        the statistics of its topics empty
+        """
+        self.topicsWithoutStats.update([topic for rosbag in self.rosbags if rosbag.filename == bagFilePath for topic in rosbag.topics])
+        self.statsFailedBagFiles.append(f"{bagFilePath}: {error}")
+
+        self.statsPendingBagFiles.discard(bagFilePath)
+        self.refreshTopicStats()
+
+    def onTopicStatsFinished(self):
+        """
+        Callback for when the statistics of every rosbag have been worked out or have failed.
+        Warns about the rosbags that were skipped, whose topics' statistics are left empty.
+        """
+        if len(self.statsPendingBagFiles) > 0 or len(self.statsFailedBagFiles) == 0:
+            return
+
+        failureDetails = "\n".join(self.statsFailedBagFiles)
+        self.view.warning("Topic Statistics Unavailable", f"The topic statistics of {len(self.statsFailedBagFiles)} rosbag(s) could not be worked out:\n{failureDetails}")
+        self.statsFailedBagFiles = []
+
+    def refreshTopicStats(self):
+        """
+        Shows the statistics of every topic whose totals are complete
+        """
+        incompleteTopics = set(self.topicsWithoutStats)
+        for rosbag in self.rosbags:
+            if rosbag.filename in self.statsPendingBagFiles:
+                incompleteTopics.update(rosbag.topics)
 
+        self.view.mainWidget.tableModel.setTopicStats({topic: stats for topic, stats in self.allTopicStats.items() if topic not in incompleteTopics})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+from bagformat import BagFormatError, BagIndex, BagReader, UnindexedBagError, isIndexed, rebuildIndex
+from typing import Optional
+import json
+import os
+import sqlite3
+import struct
+import time
+import zlib
+
+# Total size of the cached (compressed) entries before the least recently used ones are evicted
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# Bump when the layout of the cached entries changes, so old entries are ignored
+CACHE_FORMAT_VERSION = 1
+
+
+def defaultCacheDirectory() -> str:
+    """
+    Returns the directory the cache is kept in, following the XDG base directory spec
+    """
+    cacheHome = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cacheHome, "rosbag-filter-ui")
+
+
+class MetadataCache:
+    """
+    Persistent cache of rosbag index information, stored in SQLite and keyed by the rosbag's
+    path, size and modification time. An entry is thrown away as soon as its rosbag changes.
+
+    The cache is only ever an optimization, so any problem using it (read-only home directory,
+    corrupt database, ...) makes it behave as if it were empty rather than raising.
+    """
+
+    def __init__(self, databasePath=None, maxBytes=DEFAULT_MAX_CACHE_BYTES):
+        if databasePath is None:
+            databasePath = os.path.join(defaultCacheDirectory(), "metadata.sqlite3")
+
+        self.databasePath = databasePath
+        self.maxBytes = maxBytes
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(databasePath)), exist_ok=True)
+            with self._connect() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS bag_metadata ("
+                    "path TEXT NOT NULL, "
+                    "kind TEXT NOT NULL, "
+                    "size INTEGER NOT NULL, "
+                    "mtime_ns INTEGER NOT NULL, "
+                    "format_version INTEGER NOT NULL, "
+                    "data BLOB NOT NULL, "
+                    "data_size INTEGER NOT NULL, "
+                    "last_used REAL NOT NULL, "
+                    "PRIMARY KEY (path, kind))"
+                )
+            self.enabled = True
+        except (OSError, sqlite3.Error):
+            self.enabled = False
+
+    def get(self, path, kind="index") -> Optional[dict]:
+        """
+        Returns the cached entry of the given kind for a rosbag, or None if there isn't one or the
+        rosbag has changed since it was cached
+        """
+        if not self.enabled:
+            return None
+
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            with self._connect() as connection:
+                row = connection.execute(
+                    "SELECT size, mtime_ns, format_version, data FROM bag_metadata WHERE path = ? AND kind = ?", (path, kind)
+                ).fetchone()
+
+                if row is None:
+                    return None
+
+                size, mtimeNs, formatVersion, data = row
+
+                # The rosbag changed (or the cache layout did), so this entry is useless now
+                if size != stat.st_size or mtimeNs != stat.st_mtime_ns or formatVersion != CACHE_FORMAT_VERSION:
+                    connection.execute("DELETE FROM bag_metadata WHERE path = ?", (path,))
+                    return None
+
+                connection.execute("UPDATE bag_metadata SET last_used = ? WHERE path = ? AND kind = ?", (time.time(), path, kind))
+
+            return json.loads(zlib.decompress(data))
+        except (OSError, sqlite3.Error, ValueError, zlib.error):
+            return None
+
+    def put(self, path, value: dict, kind="index"):
+        """
+        Stores an entry of the given kind for a rosbag, then evicts old entries if the cache is too big
+        """
+        if not self.enabled:
+            return
+
+        path = os.path.abspath(path)
+        data = zlib.compress(json.dumps(value).encode())
+        try:
+            stat = os.stat(path)
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO bag_metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, kind, stat.st_size, stat.st_mtime_ns, CACHE_FORMAT_VERSION, data, len(data), time.time()),
+                )
+                self._evict(connection)
+        except (OSError, sqlite3.Error):
+            pass
+
+    def clear(self):
+        """
+        Removes every entry from the cache
+        """
+        if not self.enabled:
+            return
+
+        try:
+            with self._connect() as connection:
+                connection.execute("DELETE FROM bag_metadata")
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, connection):
+        """
+        Removes the least recently used entries until the cache fits within maxBytes
+        """
+        totalBytes = connection.execute("SELECT COALESCE(SUM(data_size), 0) FROM bag_metadata").fetchone()[0]
+        if totalBytes <= self.maxBytes:
+            return
+
+        for path, kind, dataSize in connection.execute("SELECT path, kind, data_size FROM bag_metadata ORDER BY last_used").fetchall():
+            connection.execute("DELETE FROM bag_metadata WHERE path = ? AND kind = ?", (path, kind))
+            totalBytes -= dataSize
+            if totalBytes <= self.maxBytes:
+                break
+
+    def _connect(self) -> "_ClosingConnection":
+        """
+        Opens a new connection to the database. Each call gets its own connection so the cache
+        can be used from several threads and processes at once.
+        """
+        return _ClosingConnection(sqlite3.connect(self.databasePath, timeout=10))
+
+
+class _ClosingConnection:
+    """
+    Context manager that commits (or rolls back) a sqlite3 connection and then closes it
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection.close()
+
+
+def openBagReader(bagFilePath, cache: MetadataCache = None, memoryMap=False) -> BagReader:
+    """
+    Opens a version 2.0 rosbag, using its cached index if there is one and caching it otherwise
+    (see BagReader for memoryMap). The index of an unindexed rosbag is rebuilt (see rebuildIndex),
+    which without a cache happens every time it is opened.
+    """
+    cachedIndex = None if cache is None else cache.get(bagFilePath)
+    if cachedIndex is not None:
+        return BagReader(bagFilePath, BagIndex.fromDict(cachedIndex), memoryMap)
+
+    try:
+        reader = BagReader(bagFilePath, memoryMap=memoryMap)
+    except UnindexedBagError:
+        reader = BagReader(bagFilePath, rebuildIndex(bagFilePath), memoryMap)
+
+    if cache is not None:
+        cache.put(bagFilePath, reader.index.toDict())
+    return reader
+
+
+def needsReindexing(bagFilePath, cache: MetadataCache = None) -> bool:
+    """
+    Whether a rosbag has no index of its own (e.g. the recorder crashed before closing it), nor
+    a rebuilt one in the cache
+    """
+    if cache is not None and cache.get(bagFilePath) is not None:
+        return False
+
+    try:
+        return not isIndexed(bagFilePath)
+    except (OSError, BagFormatError, KeyError, struct.error):
+        # Anything else wrong with it is reported when it's loaded
+        return False
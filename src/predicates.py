@@ -0,0 +1,120 @@
+"""
+Message content predicates used to drop messages during export, e.g. only keeping /diagnostics
+messages at ERROR level or above:
+
+    m.level >= 2
+
+Each predicate is a Python expression compiled once and then evaluated with the deserialized
+message bound to `m` (and `msg`) and its time in seconds bound to `t`.
+
+Batch predicates are evaluated once per block of messages instead of once per message. They
+see the list of messages as `msgs` and their times as `times`, and must return one truth value
+per message, which lets them use vectorized code, e.g. dropping odometry while stationary:
+
+    np.hypot([m.twist.twist.linear.x for m in msgs], [m.twist.twist.linear.y for m in msgs]) > 0.01
+"""
+
+from bagformat import ConnectionInfo
+from typing import Dict, List, Sequence, Tuple
+import math
+
+
+class PredicateError(Exception):
+    """
+    Raised when a predicate can't be compiled or fails while being evaluated
+    """
+
+
+class MessagePredicate:
+    """
+    A predicate expression compiled once, to be evaluated against many messages of one topic
+    """
+
+    def __init__(self, topic, expression, batch=False):
+        self.topic = topic
+        self.expression = expression
+        self.batch = batch
+
+        try:
+            self._code = compile(expression, f"<predicate for {topic}>", "eval")
+        except SyntaxError as error:
+            raise PredicateError(f"Invalid predicate for {topic}: {error.msg}")
+
+        self._globals = {"math": math}
+        if batch:
+            # Batch predicates are where vectorized code makes sense, so give them numpy if it's around
+            try:
+                import numpy
+                self._globals["np"] = numpy
+            except ImportError:
+                pass
+
+    def evaluate(self, message, timeNs: int) -> bool:
+        """
+        Returns whether a single message passes the predicate
+        """
+        try:
+            return bool(eval(self._code, self._globals, {"m": message, "msg": message, "t": timeNs / 1e9}))
+        except Exception as error:
+            raise PredicateError(f"Predicate for {self.topic} failed: {error}")
+
+    def evaluateBatch(self, messages: Sequence, timesNs: Sequence[int]) -> List[bool]:
+        """
+        Returns whether each of the messages passes the predicate. Batch predicates are evaluated
+        once for all of the messages, other predicates once per message.
+        """
+        if not self.batch:
+            return [self.evaluate(message, timeNs) for message, timeNs in zip(messages, timesNs)]
+
+        try:
+            keep = eval(self._code, self._globals, {"msgs": messages, "times": [timeNs / 1e9 for timeNs in timesNs]})
+            keep = [bool(value) for value in keep]
+        except Exception as error:
+            raise PredicateError(f"Batch predicate for {self.topic} failed: {error}")
+
+        if len(keep) != len(messages):
+            raise PredicateError(f"Batch predicate for {self.topic} returned {len(keep)} values for {len(messages)} messages")
+        return keep
+
+
+class MessageDeserializer:
+    """
+    Turns serialized messages into message objects, generating each message class from the
+    message definition stored in the bag (so the message packages don't need to be installed)
+    """
+
+    def __init__(self):
+        # (message type, md5sum) -> message class
+        self._messageClasses: Dict[Tuple[str, str], type] = {}
+
+    def deserialize(self, connection: ConnectionInfo, data):
+        """
+        Deserializes a message sent on the given connection
+        """
+        key = (connection.datatype, connection.md5sum)
+
+        messageClass = self._messageClasses.get(key)
+        if messageClass is None:
+            # Only needed once a predicate actually has to look inside a message
+            import genpy.dynamic
+            messageClass = genpy.dynamic.generate_dynamic(connection.datatype, connection.messageDefinition)[connection.datatype]
+            self._messageClasses[key] = messageClass
+
+        return messageClass().deserialize(bytes(data))
+
+
+def compilePredicates(predicates: Dict[str, str], batchPredicates: Dict[str, str]) -> Dict[str, MessagePredicate]:
+    """
+    Compiles the predicate expressions of each topic. A topic may only have one predicate.
+    """
+    compiledPredicates = {}
+
+    for topic, expression in predicates.items():
+        compiledPredicates[topic] = MessagePredicate(topic, expression)
+
+    for topic, expression in batchPredicates.items():
+        if topic in compiledPredicates:
+            raise PredicateError(f"{topic} has both a predicate and a batch predicate")
+        compiledPredicates[topic] = MessagePredicate(topic, expression, batch=True)
+
+    return compiledPredicates
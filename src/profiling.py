@@ -0,0 +1,281 @@
+"""
+Optional timing and counter instrumentation of the stages of loading and exporting rosbags
+(index read, chunk read, decompress, filter, compress and write), to find out where the time of
+a slow export goes.
+
+Profiling is off unless the ROSBAG_FILTER_PROFILE environment variable is set (to anything but
+"" or "0") or enable() is called. While it is off, stage() hands back one shared do-nothing
+context manager and count() returns straight away, and stages are only ever timed per chunk or
+per index (never per message), so the instrumentation costs next to nothing.
+
+While it is on, the number of calls, total time and self time (leaving out the stages nested in
+it) of every stage are added up, along with counters such as bytes read. When
+ROSBAG_FILTER_TRACE is set to a file path, every stage is also recorded as a trace event and
+written as a Chrome trace, which can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+Exports run in worker processes, so each export job takes its own profile (takeProfile) and
+hands it back in its ExportResult, where it can be combined with others by mergeProfiles. Setting
+ROSBAG_FILTER_CPROFILE to a path also dumps cProfile statistics of each export job next to it.
+"""
+
+from typing import Dict, Iterable, List, Optional
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+PROFILE_ENVIRONMENT_VARIABLE = "ROSBAG_FILTER_PROFILE"
+TRACE_ENVIRONMENT_VARIABLE = "ROSBAG_FILTER_TRACE"
+CPROFILE_ENVIRONMENT_VARIABLE = "ROSBAG_FILTER_CPROFILE"
+
+# Stages in the order they are shown in summaries, any others come after them
+STAGES = ("index_read", "chunk_read", "decompress", "filter", "compress", "write")
+
+# Returned by stage() while profiling is off
+_NO_STAGE = contextlib.nullcontext()
+
+
+class Profiler:
+    """
+    Adds up the time spent in each stage and the counters, from any number of threads
+    """
+
+    def __init__(self, recordTrace=False):
+        self.recordTrace = recordTrace
+        self._lock = threading.Lock()
+        # Stack of the time spent in nested stages, for each stage currently running on a thread
+        self._threadState = threading.local()
+
+        # Trace events are in microseconds of wall clock time, so traces of several processes line up
+        self._wallTimeOffset = time.time() - time.perf_counter()
+
+        # Stage -> [calls, total seconds, self seconds]
+        self._stages: Dict[str, List] = {}
+        self._counters: Dict[str, int] = {}
+        self._traceEvents: List[dict] = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        nestedSeconds = getattr(self._threadState, "nestedSeconds", None)
+        if nestedSeconds is None:
+            nestedSeconds = self._threadState.nestedSeconds = []
+
+        nestedSeconds.append(0.0)
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - startTime
+            selfSeconds = seconds - nestedSeconds.pop()
+            if len(nestedSeconds) > 0:
+                nestedSeconds[-1] += seconds
+
+            with self._lock:
+                totals = self._stages.setdefault(name, [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += seconds
+                totals[2] += selfSeconds
+
+                if self.recordTrace:
+                    self._traceEvents.append({
+                        "name": name,
+                        "ph": "X",
+                        "ts": (startTime + self._wallTimeOffset) * 1e6,
+                        "dur": seconds * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                    })
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def takeProfile(self) -> dict:
+        """
+        Returns everything recorded so far, and starts over
+        """
+        with self._lock:
+            profile = {
+                "stages": {name: {"calls": calls, "seconds": seconds, "selfSeconds": selfSeconds} for name, (calls, seconds, selfSeconds) in self._stages.items()},
+                "counters": dict(self._counters),
+                "traceEvents": self._traceEvents,
+            }
+            self._stages = {}
+            self._counters = {}
+            self._traceEvents = []
+        return profile
+
+
+def tracePath() -> Optional[str]:
+    """
+    Returns where the trace is written, or None if no trace is recorded
+    """
+    return os.environ.get(TRACE_ENVIRONMENT_VARIABLE) or None
+
+
+def _profilerFromEnvironment() -> Optional[Profiler]:
+    if os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, "") in ("", "0") and tracePath() is None:
+        return None
+    return Profiler(recordTrace=tracePath() is not None)
+
+
+_profiler: Optional[Profiler] = _profilerFromEnvironment()
+
+
+def enable(tracePath=None):
+    """
+    Turns profiling on, recording trace events if given the path the trace will be written to.
+    The environment variables are set too, so processes started from now on profile as well.
+    """
+    global _profiler
+
+    os.environ[PROFILE_ENVIRONMENT_VARIABLE] = "1"
+    if tracePath is not None:
+        os.environ[TRACE_ENVIRONMENT_VARIABLE] = tracePath
+    _profiler = _profilerFromEnvironment()
+
+
+def isEnabled() -> bool:
+    return _profiler is not None
+
+
+def stage(name):
+    """
+    Returns a context manager timing one run of a stage, e.g.
+
+        with profiling.stage("decompress"):
+            ...
+    """
+    if _profiler is None:
+        return _NO_STAGE
+    return _profiler.stage(name)
+
+
+def count(name, amount=1):
+    """
+    Adds to a counter, e.g. the number of bytes read
+    """
+    if _profiler is not None:
+        _profiler.count(name, amount)
+
+
+def takeProfile() -> Optional[dict]:
+    """
+    Returns everything this process recorded since the last call (or None while profiling is
+    off), as a dictionary that can be sent between processes and saved as JSON
+    """
+    if _profiler is None:
+        return None
+    return _profiler.takeProfile()
+
+
+def mergeProfiles(profiles: Iterable[Optional[dict]]) -> Optional[dict]:
+    """
+    Adds up several profiles, e.g. one per export job. Missing (None) profiles are left out.
+    """
+    merged = None
+
+    for profile in profiles:
+        if profile is None:
+            continue
+        if merged is None:
+            merged = {"stages": {}, "counters": {}, "traceEvents": []}
+
+        for name, stats in profile["stages"].items():
+            totals = merged["stages"].setdefault(name, {"calls": 0, "seconds": 0.0, "selfSeconds": 0.0})
+            for key in totals:
+                totals[key] += stats[key]
+        for name, amount in profile["counters"].items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + amount
+        merged["traceEvents"].extend(profile["traceEvents"])
+
+    return merged
+
+
+def formatSummary(profile: dict) -> str:
+    """
+    Creates a table of the time spent in each stage, followed by the counters. Stages on other
+    threads (e.g. compression) overlap with the rest, so the times can add up to more than the
+    wall time.
+    """
+    names = [name for name in STAGES if name in profile["stages"]]
+    names += sorted([name for name in profile["stages"] if name not in STAGES])
+
+    lines = [f"{'Stage':<12} {'Calls':>8} {'Total (s)':>10} {'Self (s)':>10}"]
+    for name in names:
+        stats = profile["stages"][name]
+        lines.append(f"{name:<12} {stats['calls']:>8} {stats['seconds']:>10.3f} {stats['selfSeconds']:>10.3f}")
+
+    for name, amount in sorted(profile["counters"].items()):
+        lines.append(f"{name}: {amount}")
+
+    return "\n".join(lines)
+
+
+def writeTrace(path, profile: dict):
+    """
+    Writes the trace events of a profile as a Chrome trace
+    """
+    with open(path, "w") as traceFile:
+        json.dump({"traceEvents": profile["traceEvents"], "displayTimeUnit": "ms"}, traceFile)
+
+
+def report(profile: Optional[dict], title, runName=None):
+    """
+    Prints the summary of a run's profile to stderr, and writes its trace when one is recorded.
+    Given a run name, the trace is written next to the trace path with the name added (e.g.
+    trace_export.json), so different kinds of runs don't overwrite each other's traces.
+    """
+    if profile is None:
+        return
+
+    print(f"{title}:\n{formatSummary(profile)}", file=sys.stderr)
+
+    path = tracePath()
+    if path is not None:
+        if runName is not None:
+            root, extension = os.path.splitext(path)
+            path = f"{root}_{runName}{extension}"
+        try:
+            writeTrace(path, profile)
+        except OSError as error:
+            print(f"Couldn't write trace to {path}: {error}", file=sys.stderr)
+
+
+def enableJobCProfile(outputPath):
+    """
+    Makes every export job started from now on (in any process) dump cProfile statistics to
+    outputPath with the job's index added, e.g. profile.pstats.job0
+    """
+    os.environ[CPROFILE_ENVIRONMENT_VARIABLE] = outputPath
+
+
+@contextlib.contextmanager
+def cProfiled(outputPath):
+    """
+    Runs the body under cProfile, dumping its statistics to outputPath. Does nothing when outputPath is None.
+    """
+    if outputPath is None:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(outputPath)
+
+
+def jobCProfilePath(jobIndex) -> Optional[str]:
+    """
+    Returns where the cProfile statistics of an export job go, or None if they aren't wanted
+    """
+    outputPath = os.environ.get(CPROFILE_ENVIRONMENT_VARIABLE)
+    if not outputPath:
+        return None
+    return f"{outputPath}.job{jobIndex}"
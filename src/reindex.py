@@ -0,0 +1,110 @@
+"""
+Rebuilding the indexes of rosbags that were never closed (e.g. .bag.active files left behind by
+a recorder that crashed) on worker processes, before they are loaded.
+
+The rosbags themselves are never rewritten (unlike `rosbag reindex`, which needs room for a
+second copy): each rebuilt index is stored in the metadata cache, where openBagReader picks it
+up like any other cached index, so the work isn't repeated until the rosbag changes.
+"""
+
+from bagformat import BagIndex, rebuildIndex
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from metadatacache import MetadataCache
+from typing import Callable, List
+import multiprocessing
+import os
+import queue
+import time
+
+# How often the workers report their progress, and the parent checks for it
+PROGRESS_INTERVAL_SECONDS = 0.1
+
+
+@dataclass
+class ReindexProgress:
+    """
+    How far rebuilding the index of one rosbag has got
+    """
+    filename: str
+    bytesRead: int
+    totalBytes: int
+
+
+def reindexBagsInParallel(bagFilePaths: List[str], cache: MetadataCache, maxWorkers=None,
+                          progressCallback: Callable[[ReindexProgress], None] = None,
+                          failedCallback: Callable[[str, str], None] = None) -> List[str]:
+    """
+    Rebuilds the indexes of several unindexed rosbags at once on a pool of worker processes,
+    storing each one in the cache, and returns the rosbags whose index was rebuilt.
+
+    progressCallback receives ReindexProgress updates from the workers, and failedCallback is
+    called with the path and the error for each rosbag whose index couldn't be rebuilt. Both are
+    called from the thread running this function.
+    """
+    if len(bagFilePaths) == 0:
+        return []
+
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count() or 1
+
+    reindexedPaths = []
+
+    # Worker processes can't see our objects, so progress goes through a manager
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=max(1, min(maxWorkers, len(bagFilePaths)))) as executor:
+        progressQueue = manager.Queue()
+        running = {executor.submit(reindexBag, bagFilePath, progressQueue): bagFilePath for bagFilePath in bagFilePaths}
+
+        while len(running) > 0:
+            done, _ = wait(running.keys(), timeout=PROGRESS_INTERVAL_SECONDS, return_when=FIRST_COMPLETED)
+
+            _drainProgress(progressQueue, progressCallback)
+
+            for future in done:
+                bagFilePath = running.pop(future)
+                try:
+                    index = BagIndex.fromDict(future.result())
+                except Exception as error:
+                    if failedCallback is not None:
+                        failedCallback(bagFilePath, str(error))
+                    continue
+
+                cache.put(bagFilePath, index.toDict())
+                reindexedPaths.append(bagFilePath)
+
+        _drainProgress(progressQueue, progressCallback)
+
+    return reindexedPaths
+
+
+def reindexBag(bagFilePath, progressQueue=None) -> dict:
+    """
+    Rebuilds the index of one rosbag (run on a worker process), returning it as BagIndex.toDict().
+    When given a queue, ReindexProgress updates are put on it every PROGRESS_INTERVAL_SECONDS.
+    """
+    progressCallback = None
+    if progressQueue is not None:
+        lastReportTime = 0.0
+
+        def progressCallback(bytesRead, totalBytes):
+            nonlocal lastReportTime
+            now = time.monotonic()
+            if now - lastReportTime >= PROGRESS_INTERVAL_SECONDS or bytesRead >= totalBytes:
+                lastReportTime = now
+                progressQueue.put(ReindexProgress(bagFilePath, bytesRead, totalBytes))
+
+    return rebuildIndex(bagFilePath, progressCallback).toDict()
+
+
+def _drainProgress(progressQueue, progressCallback):
+    """
+    Hands every progress update currently waiting in the queue to the callback
+    """
+    while True:
+        try:
+            progress = progressQueue.get_nowait()
+        except queue.Empty:
+            return
+
+        if progressCallback is not None:
+            progressCallback(progress)
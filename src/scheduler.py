@@ -0,0 +1,138 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import Counter
+from exporter import ExportJob, ExportProgress, ExportResult, runExportJob
+from typing import Callable, List, Set
+import multiprocessing
+import os
+import queue
+
+# How often the scheduler checks for progress updates and cancellation while jobs are running
+POLL_INTERVAL_SECONDS = 0.1
+
+# How many exports may read from or write to the same disk at once. Much more than this and the
+# workers start fighting over the disk head (or the NAS link) instead of getting more done.
+DEFAULT_JOBS_PER_DEVICE = 2
+
+
+def exportBagsInParallel(jobs: List[ExportJob], maxWorkers=None, maxJobsPerDevice=DEFAULT_JOBS_PER_DEVICE,
+                         progressCallback: Callable[[ExportProgress], None] = None,
+                         resultCallback: Callable[[int, ExportResult], None] = None,
+                         cancelEvent=None) -> List[ExportResult]:
+    """
+    Runs export jobs across a pool of worker processes and returns their results in the same
+    order as the jobs. The largest bags are started first so that a big bag doesn't end up
+    running on its own at the end, and no more than maxJobsPerDevice jobs touch the same
+    disk at once (maxJobsPerDevice of None means no limit).
+
+    progressCallback receives ExportProgress updates from the workers, and resultCallback is
+    called with (job index, result) as each job finishes. Both are called from the thread
+    running this function. Once cancelEvent (e.g. a threading.Event) is set, running jobs stop
+    and remove their partial output, and jobs that haven't started are reported as cancelled.
+    """
+
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count() or 1
+
+    # Largest bags first
+    pending = sorted(range(len(jobs)), key=lambda index: sum([_fileSize(path) for path in jobs[index].inputFilenames]), reverse=True)
+
+    results: List[ExportResult] = [None] * len(jobs)
+
+    # Number of running jobs using each disk
+    deviceLoad: Counter = Counter()
+
+    # Worker processes can't see our objects, so progress and cancellation go through a manager
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+
+        progressQueue = manager.Queue()
+        workerCancelEvent = manager.Event()
+
+        # Future -> (job index, disks used by the job)
+        running = {}
+
+        while len(pending) > 0 or len(running) > 0:
+
+            if cancelEvent is not None and cancelEvent.is_set():
+                workerCancelEvent.set()
+
+                # Jobs that never started are cancelled right away
+                for index in pending:
+                    results[index] = ExportResult(jobs[index].inputFilename, jobs[index].outputFilename, False, error="Export was cancelled", cancelled=True)
+                    if resultCallback is not None:
+                        resultCallback(index, results[index])
+                pending = []
+
+            # Start as many jobs as the worker and disk limits allow, keeping largest-first order
+            for index in list(pending):
+                if len(running) >= maxWorkers:
+                    break
+
+                devices = _devicesUsedBy(jobs[index])
+                if maxJobsPerDevice is not None and any([deviceLoad[device] >= maxJobsPerDevice for device in devices]):
+                    continue
+
+                pending.remove(index)
+                deviceLoad.update(devices)
+                running[executor.submit(runExportJob, jobs[index], index, progressQueue, workerCancelEvent)] = (index, devices)
+
+            if len(running) == 0:
+                continue
+
+            done, _ = wait(running.keys(), timeout=POLL_INTERVAL_SECONDS, return_when=FIRST_COMPLETED)
+
+            _drainProgress(progressQueue, progressCallback)
+
+            for future in done:
+                index, devices = running.pop(future)
+                deviceLoad.subtract(devices)
+                results[index] = _resultOf(future, jobs[index])
+                if resultCallback is not None:
+                    resultCallback(index, results[index])
+
+        _drainProgress(progressQueue, progressCallback)
+
+    return results
+
+
+def _drainProgress(progressQueue, progressCallback):
+    """
+    Hands every progress update currently waiting in the queue to the callback
+    """
+    while True:
+        try:
+            progress = progressQueue.get_nowait()
+        except queue.Empty:
+            return
+
+        if progressCallback is not None:
+            progressCallback(progress)
+
+
+def _resultOf(future, job: ExportJob) -> ExportResult:
+    """
+    Gets the result of a finished job, turning a crashed worker into a failed result
+    """
+    try:
+        return future.result()
+    except Exception as error:
+        return ExportResult(job.inputFilename, job.outputFilename, False, error=str(error))
+
+
+def _devicesUsedBy(job: ExportJob) -> Set[int]:
+    """
+    Returns the ids of the devices a job reads from and writes to
+    """
+    devices = set()
+    for path in job.inputFilenames + [os.path.dirname(os.path.abspath(job.outputFilename))]:
+        try:
+            devices.add(os.stat(path).st_dev)
+        except OSError:
+            pass
+    return devices
+
+
+def _fileSize(path) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,67 @@
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List
+import json
+import re
+
+
+@dataclass
+class SelectionProfile:
+    """
+    Describes which topics to export, either directly by topic or by message type, and either by
+    exact name or by regular expression (matched anywhere in the name, like re.search). A topic
+    is selected if any part of the profile matches it.
+    """
+    topics: List[str] = field(default_factory=list)
+    messageTypes: List[str] = field(default_factory=list)
+    topicPatterns: List[str] = field(default_factory=list)
+    messageTypePatterns: List[str] = field(default_factory=list)
+
+    def selectTopics(self, messageTypeToTopicsDict: Dict[str, Iterable[str]]) -> List[str]:
+        """
+        Returns the sorted topics (out of the given message type -> topics dictionary) selected
+        by this profile, the same way the table's checkboxes select them
+        """
+        topicPatterns = [re.compile(pattern) for pattern in self.topicPatterns]
+        messageTypePatterns = [re.compile(pattern) for pattern in self.messageTypePatterns]
+        explicitTopics = set(self.topics)
+        explicitMessageTypes = set(self.messageTypes)
+
+        selectedTopics = set()
+
+        for messageType, topics in messageTypeToTopicsDict.items():
+
+            # Selecting a message type selects all of its topics
+            if messageType in explicitMessageTypes or any([pattern.search(messageType) for pattern in messageTypePatterns]):
+                selectedTopics.update(topics)
+                continue
+
+            for topic in topics:
+                if topic in explicitTopics or any([pattern.search(topic) for pattern in topicPatterns]):
+                    selectedTopics.add(topic)
+
+        return sorted(selectedTopics)
+
+    def isEmpty(self) -> bool:
+        return not (self.topics or self.messageTypes or self.topicPatterns or self.messageTypePatterns)
+
+    def save(self, path):
+        """
+        Saves the profile as JSON
+        """
+        with open(path, "w") as profileFile:
+            json.dump(asdict(self), profileFile, indent=4)
+
+    @classmethod
+    def load(cls, path) -> "SelectionProfile":
+        """
+        Loads a profile saved with save()
+        """
+        with open(path) as profileFile:
+            profileDict = json.load(profileFile)
+
+        return cls(
+            topics=list(profileDict.get("topics", [])),
+            messageTypes=list(profileDict.get("messageTypes", [])),
+            topicPatterns=list(profileDict.get("topicPatterns", [])),
+            messageTypePatterns=list(profileDict.get("messageTypePatterns", [])),
+        )
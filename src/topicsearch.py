@@ -0,0 +1,319 @@
+"""
+Searching the names (topics or message types) shown in the topic table, by glob or by regular
+expression, fast enough to filter the table on every keystroke with tens of thousands of names.
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional, Pattern, Tuple
+import bisect
+import itertools
+import operator
+import re
+
+
+class SearchSyntax:
+    """
+    How search text is interpreted
+    """
+    # Shell style wildcards, ignoring case: * matches within one level of a name (e.g.
+    # /camera/*/image_raw), ** across levels, ? one character and [...] one of a set of characters.
+    # Patterns with wildcards that start with / have to match whole names, anything else matches
+    # anywhere in a name.
+    GLOB = "glob"
+    # Python regular expressions, matched anywhere in a name (like re.search)
+    REGEX = "regex"
+
+
+@dataclass
+class Search:
+    """
+    Compiled search text
+    """
+    # Pattern matched against each name (lowercased when ignoreCase is True)
+    pattern: Pattern
+    ignoreCase: bool
+    # Text searched for, when the search is for plain text rather than a pattern
+    text: Optional[str] = None
+
+    def matches(self, name) -> bool:
+        return self.pattern.search(name.lower() if self.ignoreCase else name) is not None
+
+
+# Characters that make a glob more than plain text
+_GLOB_WILDCARDS = "*?["
+
+# Characters that aren't literal in a regular expression
+_REGEX_SPECIAL_CHARACTERS = ".^$*+?{}[]\\|()"
+
+# Searches whose prefix narrows the names down to at most this fraction of them check those names
+# one at a time, anything broader is found by scanning every name at once
+_PREFIX_SEARCH_FRACTION = 0.1
+
+# Once scanning the joined names has found this many matches, the rest of the names are checked
+# one at a time instead, which is quicker for searches matching most names
+_SCAN_MATCH_LIMIT = 1000
+
+# Parts of a regular expression that stop it from being searched for in the joined names: \A and
+# \Z only match at the start/end of the whole text, negated sets and classes like \s, \D and \W
+# (and . with re.DOTALL) match the newlines between names, running on from one name into the
+# next, which is slow, and lookarounds and \n can see the newlines, so a name may not match in
+# the joined names when it does on its own
+_NOT_PER_LINE = re.compile(r"\\[AZsDWn]|\[\^|\(\?<?[=!]")
+
+# Inline flags (e.g. (?i)), which change how the whole of a regular expression matches
+_INLINE_FLAGS = re.compile(r"\(\?[-aiLmsux]")
+
+
+def globToRegex(glob) -> str:
+    """
+    Translates a glob (see SearchSyntax.GLOB) into a regular expression
+    """
+    if not any([wildcard in glob for wildcard in _GLOB_WILDCARDS]):
+        return re.escape(glob)
+
+    parts = []
+    position = 0
+    while position < len(glob):
+        character = glob[position]
+
+        if glob.startswith("**", position):
+            parts.append(".*")
+            position += 2
+            continue
+
+        if character == "*":
+            parts.append("[^/]*")
+        elif character == "?":
+            parts.append("[^/]")
+        elif character == "[":
+            # Like fnmatch, a ] straight after [ or [! is part of the set, and [! negates it
+            setStart = position + 1
+            if glob.startswith("!", setStart):
+                setStart += 1
+            if glob.startswith("]", setStart):
+                setStart += 1
+            setEnd = glob.find("]", setStart)
+
+            if setEnd < 0:
+                parts.append(re.escape(character))
+            else:
+                characterSet = glob[position + 1:setEnd].replace("\\", "\\\\")
+                if characterSet.startswith("!"):
+                    characterSet = "^" + characterSet[1:]
+                parts.append(f"[{characterSet}]")
+                position = setEnd
+        else:
+            parts.append(re.escape(character))
+
+        position += 1
+
+    if glob.startswith("/"):
+        return "^" + "".join(parts) + "$"
+
+    # Wildcards at either end don't change whether a name matches somewhere, but make searching slow
+    while len(parts) > 0 and parts[0] in (".*", "[^/]*"):
+        parts.pop(0)
+    while len(parts) > 0 and parts[-1] in (".*", "[^/]*"):
+        parts.pop()
+    return "".join(parts)
+
+
+def compileSearch(text, syntax=SearchSyntax.GLOB) -> Optional[Search]:
+    """
+    Compiles search text, or returns None for empty text (which matches everything). Raises
+    re.error if the text isn't a valid pattern.
+    """
+    text = text.strip()
+    if text == "":
+        return None
+
+    if syntax == SearchSyntax.REGEX:
+        return Search(re.compile(text), False)
+
+    # Globs ignore case by being matched in lower case, which keeps the regular expression engine's
+    # fast paths that re.IGNORECASE turns off
+    text = text.lower()
+    if not any([wildcard in text for wildcard in _GLOB_WILDCARDS]):
+        return Search(re.compile(re.escape(text)), True, text)
+    return Search(re.compile(globToRegex(text)), True)
+
+
+class TopicSearchIndex:
+    """
+    Finds which of a list of names match a search. The index is built once for a set of names
+    and keeps
+        - every name joined into one string, so a search is one scan of that string by the
+          regular expression engine rather than a Python loop over the names
+        - the names sorted (ignoring case), so a search that only matches names starting with
+          some prefix (e.g. /camera/*/image_raw) only looks at the names in that namespace
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = list(names)
+        self._lowerNames = [name.lower() for name in self.names]
+        self._joinedNames = _joinNames(self.names)
+        self._joinedLowerNames = _joinNames(self._lowerNames)
+
+        self._sortedRows = sorted(range(len(self.names)), key=lambda row: self._lowerNames[row])
+        self._sortedKeys = [self._lowerNames[row] for row in self._sortedRows]
+
+        # The last search and the names it matched. Typing into the search box mostly narrows the
+        # search down, and then only those names have to be checked again.
+        self._lastSearch: Optional[Search] = None
+        self._lastRows: List[int] = []
+
+    def search(self, search: Optional[Search]) -> List[int]:
+        """
+        Returns the indexes of the names matching a search from compileSearch (every name for
+        None), in order
+        """
+        if search is None:
+            return list(range(len(self.names)))
+
+        names = self._lowerNames if search.ignoreCase else self.names
+
+        if self._lastSearch is not None and _narrows(search, self._lastSearch):
+            if search.text is not None:
+                rows = [row for row in self._lastRows if search.text in names[row]]
+            else:
+                rows = [row for row in self._lastRows if search.pattern.search(names[row])]
+        else:
+            rows = self._searchAll(search, names)
+
+        self._lastSearch = search
+        self._lastRows = rows
+        # A copy, so the caller changing it can't change what later searches go by
+        return list(rows)
+
+    def _searchAll(self, search: Search, names: List[str]) -> List[int]:
+        """
+        Returns the indexes of the names matching a search, looking through every name
+        """
+        pattern = search.pattern
+
+        if search.text is not None:
+            return list(itertools.compress(range(len(names)), map(operator.contains, names, itertools.repeat(search.text))))
+
+        prefix = _literalPrefix(pattern.pattern).lower()
+        if prefix != "":
+            start = bisect.bisect_left(self._sortedKeys, prefix)
+            end = bisect.bisect_right(self._sortedKeys, prefix + "\U0010ffff")
+            if end - start <= len(names) * _PREFIX_SEARCH_FRACTION:
+                return sorted([row for row in self._sortedRows[start:end] if pattern.search(names[row])])
+
+        text, nameStarts = self._joinedLowerNames if search.ignoreCase else self._joinedNames
+        return self._scan(pattern, names, text, nameStarts)
+
+    def _scan(self, pattern: Pattern, names: List[str], text: str, nameStarts: List[int]) -> List[int]:
+        """
+        Finds the names matching a pattern by searching the joined names (see _joinNames)
+        """
+        if _NOT_PER_LINE.search(pattern.pattern) or pattern.flags & re.DOTALL:
+            return self._matchEach(pattern, names, 0)
+
+        textPattern = re.compile(pattern.pattern, pattern.flags | re.MULTILINE)
+
+        rows = []
+        matchCount = 0
+        position = 0
+        while True:
+            match = textPattern.search(text, position)
+            if match is None:
+                break
+
+            row = bisect.bisect_right(nameStarts, match.start()) - 1
+            nextNameStart = nameStarts[row + 1]
+
+            # A match may have run on into the next name or looked at the newlines around its own
+            # name, so only the name matching on its own counts
+            if pattern.search(names[row]):
+                rows.append(row)
+
+            matchCount += 1
+            if matchCount >= _SCAN_MATCH_LIMIT:
+                return rows + self._matchEach(pattern, names, row + 1)
+
+            position = nextNameStart
+            if position > len(text):
+                break
+
+        return rows
+
+    @classmethod
+    def _matchEach(cls, pattern: Pattern, names: List[str], firstRow) -> List[int]:
+        """
+        Returns the indexes of the names from firstRow on that match a pattern, checking them one
+        at a time
+        """
+        return list(itertools.compress(range(firstRow, len(names)), map(pattern.search, names[firstRow:])))
+
+
+def _joinNames(names: List[str]) -> Tuple[str, List[int]]:
+    """
+    Joins names into one string, one per line, returning it with the offset of each name in it
+    followed by the offset just past the end of the string
+    """
+    nameStarts = []
+    offset = 0
+    for name in names:
+        nameStarts.append(offset)
+        offset += len(name) + 1
+    nameStarts.append(offset)
+
+    return "\n".join(names), nameStarts
+
+
+def _narrows(search: Search, previousSearch: Search) -> bool:
+    """
+    Whether every name matching a search is sure to match an earlier search too, because the
+    search only adds to the end of the earlier one (e.g. /cam -> /came, or \bod -> \bodom)
+    """
+    if search.ignoreCase != previousSearch.ignoreCase or search.pattern.flags != previousSearch.pattern.flags:
+        return False
+    if search.text is not None and previousSearch.text is not None:
+        return previousSearch.text in search.text
+
+    previousRegex = previousSearch.pattern.pattern
+    regex = search.pattern.pattern
+    if not regex.startswith(previousRegex):
+        return False
+    addedRegex = regex[len(previousRegex):]
+    if addedRegex == "":
+        return True
+
+    # Whatever is added must not change what the earlier regular expression ends with (e.g. a
+    # quantifier, x{1, -> x{1,2} or \1 -> \12), match instead of it (a|b -> a|b|c), or change its
+    # flags
+    if addedRegex[0] in "*+?{" or "|" in addedRegex or _INLINE_FLAGS.search(addedRegex):
+        return False
+    if "{" in previousRegex[previousRegex.rfind("}") + 1:] or re.search(r"\\[0-9]+$", previousRegex):
+        return False
+    return True
+
+
+def _literalPrefix(regex) -> str:
+    """
+    Returns the text every match of a regular expression anchored with ^ starts with (leaving
+    out anything it can't be sure of)
+    """
+    if not regex.startswith("^") or "|" in regex:
+        return ""
+
+    prefix = []
+    position = 1
+    while position < len(regex):
+        if regex[position] == "\\" and position + 1 < len(regex) and not regex[position + 1].isalnum():
+            character = regex[position + 1]
+            position += 2
+        elif regex[position] not in _REGEX_SPECIAL_CHARACTERS:
+            character = regex[position]
+            position += 1
+        else:
+            break
+
+        # A quantifier makes the character optional or repeated, so the prefix ends before it
+        if position < len(regex) and regex[position] in "*+?{":
+            break
+        prefix.append(character)
+
+    return "".join(prefix)
@@ -0,0 +1,467 @@
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QApplication, QStyle, QStyledItemDelegate, QStyleOptionButton, QStyleOptionViewItem
+from bagmetadata import TopicStats
+from decimation import Decimation
+from topicsearch import Search, TopicSearchIndex
+from typing import Dict, Iterable, List, Optional
+import dataclasses
+
+
+class TopicTableModel(QtCore.QAbstractTableModel):
+    """
+    Table model listing every loaded topic, either one row per topic or one row per message type.
+    Which topics are selected is stored once, one byte per topic, and both views read from it,
+    so switching between them never loses or rebuilds the selection.
+
+    The table can be narrowed down to the topics/message types matching a search. The rows of
+    the table are then only the matching ones, so filtering never has to ask about every row.
+    """
+
+    # Column holding the checkboxes
+    CHECK_COLUMN = 0
+
+    # Role holding the value a cell is sorted by (numbers for the statistics, rather than their text)
+    SORT_ROLE = QtCore.Qt.UserRole
+
+    # Columns showing each topic's statistics (added up over every rosbag), filled in once they are known
+    STATS_HEADERS = ("Messages", "Size", "Frequency (Hz)", "First Message (s)", "Last Message (s)")
+    FIRST_STATS_COLUMN = 3
+
+    # Editable columns holding each topic's decimation settings, as (header, Decimation field)
+    DECIMATION_COLUMNS = (("Max Hz", "maxHz"), ("Every Nth", "everyNth"), ("Min Gap (s)", "minGapSeconds"))
+    FIRST_DECIMATION_COLUMN = FIRST_STATS_COLUMN + len(STATS_HEADERS)
+
+    TOPIC_HEADERS = ("To Export", "Topic", "Message Type") + STATS_HEADERS + tuple([header for header, _ in DECIMATION_COLUMNS])
+    MESSAGE_TYPE_HEADERS = ("To Export", "Message Type", "Topics") + STATS_HEADERS + tuple([header for header, _ in DECIMATION_COLUMNS])
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        # When True, there is one row per topic, otherwise one row per message type
+        self.displayByTopic = True
+
+        # When False, the checkboxes can't be changed by the user
+        self.checkable = True
+
+        # Topics sorted by message type and then by name, which is also the order of the topic rows
+        self.topics: List[str] = []
+        # Topic -> its index in self.topics
+        self.topicRows: Dict[str, int] = {}
+        # Message type of each topic
+        self.topicTypes: List[str] = []
+        # 1 when the topic is selected, 0 when it isn't
+        self.topicChecked = bytearray()
+
+        # Sorted message types, which is also the order of the message type rows
+        self.messageTypes: List[str] = []
+        # Indexes (into self.topics) of the topics of each message type
+        self.messageTypeTopicRows: List[List[int]] = []
+        # Topics of each message type joined into one string, for display
+        self.messageTypeTopicStrings: List[str] = []
+
+        # Topic -> how it is downsampled when exported. Kept by name (like the selection) so it
+        # survives loading more rosbags.
+        self.decimations: Dict[str, Decimation] = {}
+
+        # Topic -> its statistics, for the topics whose statistics are known so far
+        self.topicStats: Dict[str, TopicStats] = {}
+
+        # Search the rows have to match (None showing every row), and indexes for searching the
+        # topics and message types quickly
+        self.search: Optional[Search] = None
+        self.topicSearchIndex = TopicSearchIndex([])
+        self.messageTypeSearchIndex = TopicSearchIndex([])
+        # Indexes (into self.topics or self.messageTypes, depending on the display) of the rows shown
+        self.shownRows: List[int] = []
+
+    def setRosbags(self, messageTypeToTopicsDict: Dict[str, Iterable[str]]):
+        """
+        Replaces the topics and message types shown in the table. Topics that were already in the
+        table keep their selection.
+        """
+        self.beginResetModel()
+
+        previouslyChecked = set(self.getSelectedTopics())
+
+        self.topics = []
+        self.topicTypes = []
+        self.messageTypes = sorted(messageTypeToTopicsDict.keys())
+        self.messageTypeTopicRows = []
+        self.messageTypeTopicStrings = []
+
+        for messageType in self.messageTypes:
+            topicsOfTypeSorted = sorted(messageTypeToTopicsDict[messageType])
+
+            self.messageTypeTopicRows.append(list(range(len(self.topics), len(self.topics) + len(topicsOfTypeSorted))))
+            self.messageTypeTopicStrings.append(", ".join(topicsOfTypeSorted))
+
+            self.topics.extend(topicsOfTypeSorted)
+            self.topicTypes.extend([messageType] * len(topicsOfTypeSorted))
+
+        self.topicRows = {topic: row for row, topic in enumerate(self.topics)}
+        self.topicChecked = bytearray([topic in previouslyChecked for topic in self.topics])
+
+        self.topicSearchIndex = TopicSearchIndex(self.topics)
+        self.messageTypeSearchIndex = TopicSearchIndex(self.messageTypes)
+        self._updateShownRows()
+
+        self.endResetModel()
+
+    def setSearch(self, search: Optional[Search]):
+        """
+        Only shows the rows whose topic/message type matches the search (or every row for None)
+        """
+        self.beginResetModel()
+        self.search = search
+        self._updateShownRows()
+        self.endResetModel()
+
+    def _updateShownRows(self):
+        searchIndex = self.topicSearchIndex if self.displayByTopic else self.messageTypeSearchIndex
+        self.shownRows = searchIndex.search(self.search)
+
+    def shownTopicRows(self) -> List[int]:
+        """
+        Returns the indexes of the topics on the rows shown, e.g. to select every search match
+        """
+        if self.displayByTopic:
+            return self.shownRows
+        return [topicRow for row in self.shownRows for topicRow in self.messageTypeTopicRows[row]]
+
+    def setTopicStats(self, topicStats: Dict[str, TopicStats]):
+        """
+        Replaces the statistics shown in the table (topics without statistics show empty cells)
+        """
+        self.topicStats = topicStats
+
+        if self.rowCount() > 0:
+            self.dataChanged.emit(
+                self.index(0, TopicTableModel.FIRST_STATS_COLUMN),
+                self.index(self.rowCount() - 1, TopicTableModel.FIRST_DECIMATION_COLUMN - 1),
+                [QtCore.Qt.DisplayRole, TopicTableModel.SORT_ROLE],
+            )
+
+    def rowStats(self, row) -> Optional[TopicStats]:
+        """
+        Statistics of the topics on a row, or None until the statistics of all of them are known
+        """
+        stats = TopicStats()
+        for topicRow in self.topicRowsOf(row):
+            topicStats = self.topicStats.get(self.topics[topicRow])
+            if topicStats is None:
+                return None
+            stats.add(topicStats)
+        return stats
+
+    def setDisplayByTopic(self, displayByTopic):
+        """
+        Switches between one row per topic and one row per message type
+        """
+        if displayByTopic == self.displayByTopic:
+            return
+
+        self.beginResetModel()
+        self.displayByTopic = displayByTopic
+        self._updateShownRows()
+        self.endResetModel()
+
+    def setCheckable(self, checkable):
+        """
+        Enables/Disables changing the checkboxes
+        """
+        self.checkable = checkable
+        self._checkStatesChanged()
+
+    def getSelectedTopics(self) -> List[str]:
+        """
+        Returns the selected topics
+        """
+        return [topic for topic, checked in zip(self.topics, self.topicChecked) if checked]
+
+    def setSelectedTopics(self, topics: Iterable[str]):
+        """
+        Selects exactly the given topics (ignoring any that aren't in the table)
+        """
+        topics = set(topics)
+        self.topicChecked = bytearray([topic in topics for topic in self.topics])
+        self._checkStatesChanged()
+
+    def setTopicsChecked(self, topicRows: Iterable[int], checked):
+        """
+        Selects/Deselects the topics at the given indexes
+        """
+        for topicRow in topicRows:
+            self.topicChecked[topicRow] = checked
+        self._checkStatesChanged()
+
+    def getDecimations(self) -> Dict[str, Decimation]:
+        """
+        Returns the decimation of every topic in the table that is downsampled
+        """
+        return {topic: self.decimations[topic] for topic in self.topics if topic in self.decimations and self.decimations[topic].isActive()}
+
+    def invertSelection(self):
+        """
+        Inverts the selection of every topic
+        """
+        self.topicChecked = bytearray([not checked for checked in self.topicChecked])
+        self._checkStatesChanged()
+
+    def topicRowsOf(self, row) -> List[int]:
+        """
+        Returns the indexes of the topics shown on a row of the table
+        """
+        if self.displayByTopic:
+            return [self.shownRows[row]]
+        return self.messageTypeTopicRows[self.shownRows[row]]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.shownRows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers())
+
+    def headers(self):
+        return TopicTableModel.TOPIC_HEADERS if self.displayByTopic else TopicTableModel.MESSAGE_TYPE_HEADERS
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.headers()[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = index.row()
+        column = index.column()
+
+        if column == TopicTableModel.CHECK_COLUMN:
+            if role == QtCore.Qt.CheckStateRole:
+                return self.checkState(row)
+            if role == TopicTableModel.SORT_ROLE:
+                return int(self.checkState(row))
+            return None
+
+        if column >= TopicTableModel.FIRST_DECIMATION_COLUMN:
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole, TopicTableModel.SORT_ROLE):
+                return self.decimationText(row, TopicTableModel.DECIMATION_COLUMNS[column - TopicTableModel.FIRST_DECIMATION_COLUMN][1])
+            return None
+
+        if column >= TopicTableModel.FIRST_STATS_COLUMN:
+            if role == QtCore.Qt.DisplayRole:
+                return self.statsText(row, column - TopicTableModel.FIRST_STATS_COLUMN)
+            if role == TopicTableModel.SORT_ROLE:
+                return self.statsValue(row, column - TopicTableModel.FIRST_STATS_COLUMN)
+            if role == QtCore.Qt.TextAlignmentRole:
+                return int(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+            return None
+
+        if role not in (QtCore.Qt.DisplayRole, TopicTableModel.SORT_ROLE):
+            return None
+
+        row = self.shownRows[row]
+        if self.displayByTopic:
+            return self.topics[row] if column == 1 else self.topicTypes[row]
+        return self.messageTypes[row] if column == 1 else self.messageTypeTopicStrings[row]
+
+    def statsValue(self, row, statsIndex):
+        """
+        Number behind one of the statistics columns of a row, or -1 when it isn't known (so
+        unknown values sort first)
+        """
+        stats = self.rowStats(row)
+        if stats is None:
+            return -1
+
+        value = (stats.messageCount, stats.byteCount, stats.frequency, stats.startTime, stats.endTime)[statsIndex]
+        return -1 if value is None else value
+
+    def statsText(self, row, statsIndex) -> str:
+        """
+        Text of one of the statistics columns of a row
+        """
+        value = self.statsValue(row, statsIndex)
+        if value == -1:
+            return ""
+
+        if statsIndex == 0:
+            return str(value)
+        if statsIndex == 1:
+            return _formatBytes(value)
+        if statsIndex == 2:
+            return f"{value:.2f}"
+        # Times are shown in seconds, the same as the time window
+        return f"{value / 1e9:.3f}"
+
+    def checkState(self, row):
+        """
+        Check state of a row. A message type row is partially checked when only some of its
+        topics are selected.
+        """
+        checkedCount = sum([self.topicChecked[topicRow] for topicRow in self.topicRowsOf(row)])
+
+        if checkedCount == 0:
+            return QtCore.Qt.Unchecked
+        if checkedCount == len(self.topicRowsOf(row)):
+            return QtCore.Qt.Checked
+        return QtCore.Qt.PartiallyChecked
+
+    def decimationText(self, row, fieldName) -> str:
+        """
+        Text of one decimation setting of a row. A message type row only shows a setting when
+        all of its topics share it.
+        """
+        values = set([getattr(self.decimations.get(self.topics[topicRow], Decimation()), fieldName) for topicRow in self.topicRowsOf(row)])
+        if len(values) != 1:
+            return "(mixed)"
+
+        value = values.pop()
+        if value is None or value == getattr(Decimation(), fieldName):
+            return ""
+        return f"{value:g}"
+
+    def setDecimation(self, row, fieldName, text) -> bool:
+        """
+        Sets one decimation setting of every topic on a row from the text typed into the table,
+        with empty text meaning the default. Returns False if the text isn't a valid setting.
+        """
+        text = text.strip()
+        try:
+            if text == "":
+                value = getattr(Decimation(), fieldName)
+            elif fieldName == "everyNth":
+                value = int(text)
+            else:
+                value = float(text)
+
+            decimations = {}
+            for topicRow in self.topicRowsOf(row):
+                topic = self.topics[topicRow]
+                decimations[topic] = dataclasses.replace(self.decimations.get(topic, Decimation()), **{fieldName: value})
+        except ValueError:
+            return False
+
+        self.decimations.update(decimations)
+        return True
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or not self.checkable:
+            return False
+
+        if index.column() >= TopicTableModel.FIRST_DECIMATION_COLUMN:
+            if role != QtCore.Qt.EditRole:
+                return False
+            fieldName = TopicTableModel.DECIMATION_COLUMNS[index.column() - TopicTableModel.FIRST_DECIMATION_COLUMN][1]
+            if not self.setDecimation(index.row(), fieldName, str(value)):
+                return False
+            self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole])
+            return True
+
+        if index.column() != TopicTableModel.CHECK_COLUMN or role != QtCore.Qt.CheckStateRole:
+            return False
+
+        checked = value == QtCore.Qt.Checked
+        for topicRow in self.topicRowsOf(index.row()):
+            self.topicChecked[topicRow] = checked
+
+        self.dataChanged.emit(index, index, [QtCore.Qt.CheckStateRole])
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if index.column() == TopicTableModel.CHECK_COLUMN:
+            flags = QtCore.Qt.ItemIsUserCheckable
+            if self.checkable:
+                flags |= QtCore.Qt.ItemIsEnabled
+        elif index.column() >= TopicTableModel.FIRST_DECIMATION_COLUMN and self.checkable:
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def _checkStatesChanged(self):
+        """
+        Lets the view know that every checkbox may have changed
+        """
+        if self.rowCount() > 0:
+            self.dataChanged.emit(
+                self.index(0, TopicTableModel.CHECK_COLUMN),
+                self.index(self.rowCount() - 1, TopicTableModel.CHECK_COLUMN),
+                [QtCore.Qt.CheckStateRole],
+            )
+
+
+def _formatBytes(byteCount) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if byteCount < 1000:
+            return f"{byteCount:.0f} {unit}" if unit == "B" else f"{byteCount:.1f} {unit}"
+        byteCount /= 1000
+    return f"{byteCount:.1f} TB"
+
+
+class CheckBoxDelegate(QStyledItemDelegate):
+    """
+    Draws the check state of a cell as a checkbox centered in the cell, and toggles it when clicked
+    """
+
+    def paint(self, painter, option, index):
+        # Draw the cell background (e.g. selection highlight) without any text/check indicator
+        backgroundOption = QStyleOptionViewItem(option)
+        self.initStyleOption(backgroundOption, index)
+        backgroundOption.features &= ~QStyleOptionViewItem.HasCheckIndicator
+        backgroundOption.text = ""
+        style = option.widget.style() if option.widget is not None else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, backgroundOption, painter, option.widget)
+
+        checkBoxOption = QStyleOptionButton()
+        checkBoxOption.rect = self._checkBoxRect(option)
+        checkBoxOption.state = QStyle.State_Enabled if index.flags() & QtCore.Qt.ItemIsEnabled else QStyle.State_None
+
+        checkState = index.data(QtCore.Qt.CheckStateRole)
+        if checkState == QtCore.Qt.Checked:
+            checkBoxOption.state |= QStyle.State_On
+        elif checkState == QtCore.Qt.PartiallyChecked:
+            checkBoxOption.state |= QStyle.State_NoChange
+        else:
+            checkBoxOption.state |= QStyle.State_Off
+
+        style.drawControl(QStyle.CE_CheckBox, checkBoxOption, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if not (index.flags() & QtCore.Qt.ItemIsEnabled) or not (index.flags() & QtCore.Qt.ItemIsUserCheckable):
+            return False
+
+        if event.type() == QtCore.QEvent.MouseButtonRelease:
+            if event.button() != QtCore.Qt.LeftButton or not self._checkBoxRect(option).contains(event.pos()):
+                return False
+        elif event.type() == QtCore.QEvent.MouseButtonDblClick:
+            # Swallow double clicks so they don't toggle twice
+            return self._checkBoxRect(option).contains(event.pos())
+        elif event.type() == QtCore.QEvent.KeyPress:
+            if event.key() not in (QtCore.Qt.Key_Space, QtCore.Qt.Key_Select):
+                return False
+        else:
+            return False
+
+        # Anything not fully checked becomes checked, fully checked becomes unchecked
+        checked = index.data(QtCore.Qt.CheckStateRole) != QtCore.Qt.Checked
+        return model.setData(index, QtCore.Qt.Checked if checked else QtCore.Qt.Unchecked, QtCore.Qt.CheckStateRole)
+
+    @classmethod
+    def _checkBoxRect(cls, option) -> QtCore.QRect:
+        """
+        Rectangle of a checkbox centered in the cell
+        """
+        style = option.widget.style() if option.widget is not None else QApplication.style()
+        checkBoxOption = QStyleOptionButton()
+        indicatorRect = style.subElementRect(QStyle.SE_CheckBoxIndicator, checkBoxOption, option.widget)
+
+        rect = QtCore.QRect(indicatorRect)
+        rect.moveCenter(option.rect.center())
+        return rect